@@ -332,6 +332,8 @@ import { UserLevelSessionHistory } from '../models/UserLevelSessionHistory';
         const filterQuestionsByTopics = (questions: any[]): any[] => {
           return questions.filter(qt => {
             if (!qt.quesId || typeof qt.quesId !== 'object' || !('topics' in qt.quesId) || !Array.isArray(qt.quesId.topics) || !qt.quesId.topics.length) return false;
+            // Soft-deleted by the question feeder's sync (status -1)
+            if (qt.quesId.status === -1) return false;
             const topicIds = qt.quesId.topics.map((t: any) => t.id.toString());
             return topicIds.length >= 1 && topicIds.every((id: string) => levelTopicIds.includes(id));
           });
@@ -376,7 +378,8 @@ import { UserLevelSessionHistory } from '../models/UserLevelSessionHistory';
           const randomQuestions = await QuestionTs.aggregate([
             { $sample: { size: numQuestions - finalQuestionTsList.length } },
             { $lookup: { from: 'questions', localField: 'quesId', foreignField: '_id', as: 'quesObj' } },
-            { $unwind: '$quesObj' }
+            { $unwind: '$quesObj' },
+            { $match: { 'quesObj.status': { $ne: -1 } } }
           ]);
           randomQuestions.forEach(q => { q.quesId = q.quesObj; });
           finalQuestionTsList.push(...randomQuestions);
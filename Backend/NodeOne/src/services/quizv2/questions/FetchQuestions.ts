@@ -2,6 +2,9 @@ import { IQuestionTs, QuestionTs } from "./../../../models/QuestionTs";
 import { IUserChapterTicket } from "./../../../models/UserChapterTicket";
 import { ISkill } from "../../../models/UserTs";
 
+// Questions soft-deleted by the feeder's sync (status -1) populate as null and are dropped
+const ACTIVE_QUESTION_POPULATE = { path: "quesId", match: { status: { $ne: -1 } } };
+
 export const fetchUserChapterTicketQuestionPool = async ({
 	userChapterTicket,
 	userTrueSkillData
@@ -27,9 +30,9 @@ export const fetchUserChapterTicketQuestionPool = async ({
 			"difficulty.mu": muFilterObject, //TODO TrueSkill error here
 			quesId: { $nin: questionAttemptedList },
 			type: 'single',
-		}).populate("quesId").sort({ "difficulty.mu": 1 }).limit(10).exec();
+		}).populate(ACTIVE_QUESTION_POPULATE).sort({ "difficulty.mu": 1 }).limit(10).exec();
 		console.log("QUESTIONS1 :", questions);
-		return questions;
+		return questions.filter((q) => q.quesId);
 	}
 	console.log("NO QUESTIONS FOUND");
 	return [];
@@ -50,11 +53,11 @@ export const fetchQuestionsByChapterIdAndMu = async ({
 		"difficulty.mu": muFilterObject,
 		type: 'single',
 	})
-		.populate("quesId")
+		.populate(ACTIVE_QUESTION_POPULATE)
 		.sort({ "difficulty.mu": 1 }) // Sort by mu ascending (easiest first)
 		.exec();
 
-	return questions;
+	return questions.filter((q) => q.quesId);
 };
 
 export const fetchQuestionByMu = async ({
@@ -62,16 +65,14 @@ export const fetchQuestionByMu = async ({
 }: {
 	mu: number;
 }): Promise<IQuestionTs | null> => {
-	const question = await QuestionTs.findOne({
+	const questions = await QuestionTs.find({
 		"difficulty.mu": { $gt: mu },
 		type: 'single',
 	})
-		.populate("quesId")
+		.populate(ACTIVE_QUESTION_POPULATE)
 		.sort({ "difficulty.mu": 1 }) // Sort by mu ascending (easiest first)
+		.limit(10)
 		.exec();
 
-	if (!question) {
-		return null;
-	}
-	return question;
+	return questions.find((q) => q.quesId) || null;
 };
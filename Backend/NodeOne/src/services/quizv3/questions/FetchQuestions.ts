@@ -57,8 +57,9 @@ export const fetchQuestionsByChapterIdAndMuRange = async ({
 		};
 		console.log(`[FetchQuestions] Query filter:`, JSON.stringify(queryFilter, null, 2));
 
+		// Questions soft-deleted by the feeder's sync (status -1) populate as null and are skipped below
 		const questions = await QuestionTs.find(queryFilter)
-			.populate("quesId")
+			.populate({ path: "quesId", match: { status: { $ne: -1 } } })
 			.sort({ "difficulty.mu": 1 }) // Sort by mu ascending
 			.exec();
 		
@@ -190,7 +191,8 @@ export const getQuestionCountByChapterId = async ({chapterId}: {chapterId: strin
 	const result = await Question.aggregate([
 		{
 			$match: {
-				chapterId: new mongoose.Types.ObjectId(chapterId)
+				chapterId: new mongoose.Types.ObjectId(chapterId),
+				status: { $ne: -1 }
 			}
 		},
 		{
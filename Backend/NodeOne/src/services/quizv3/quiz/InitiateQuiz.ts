@@ -58,13 +58,13 @@ const initiateQuizSession = async ({ sessionId }: { sessionId?: string }) => {
 				chapterId: userChapterSession.chapterId.toString(),
 				type: { $in: ['single', 'multicorrect'] },
 			})
-				.populate("quesId")
+				.populate({ path: "quesId", match: { status: { $ne: -1 } } })
 				.limit(3)
 				.exec();
 			
-			// Filter out already attempted questions
+			// Filter out soft-deleted (quesId populated as null) and already attempted questions
 			const attemptedIds = userChapterSession.ongoing?.questions?.map(q => q.toString()) || [];
-			questionList = allQuestions.filter(q => !attemptedIds.includes(q.quesId.toString()));
+			questionList = allQuestions.filter(q => q.quesId && !attemptedIds.includes(q.quesId.toString()));
 			
 			// Take first 3
 			questionList = questionList.slice(0, 3);
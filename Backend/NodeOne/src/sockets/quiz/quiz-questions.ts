@@ -74,6 +74,8 @@ const replenishQuestionBankByMu = async (session: any, level: any) => {
   const filterQuestionsByTopics = (questions: any[]): any[] => {
     return questions.filter(qt => {
       if (!qt.quesId || typeof qt.quesId !== 'object' || !('topics' in qt.quesId) || !Array.isArray(qt.quesId.topics) || !qt.quesId.topics.length) return false;
+      // Soft-deleted by the question feeder's sync (status -1)
+      if (qt.quesId.status === -1) return false;
       const topicIds = qt.quesId.topics.map((t: any) => t.id.toString());
       return topicIds.length >= 1 && topicIds.every((id: string) => levelTopicIds.includes(id));
     });
@@ -169,6 +171,7 @@ const replenishQuestionBankByUnit = async (session: any, level: any) => {
   // Strategy 1: Get random questions from the level's unit (excluding already used questions)
   const unitQuestions = await Question.find({ 
     unitId: level.unitId,
+    status: { $ne: -1 }, // Skip questions soft-deleted by the feeder's sync
     _id: { $nin: session.questionBank }
   })
   .populate('topics.id')
@@ -184,6 +187,7 @@ const replenishQuestionBankByUnit = async (session: any, level: any) => {
     const chapterQuestions = await Question.find({ 
       chapterId: level.chapterId,
       unitId: { $ne: level.unitId },
+      status: { $ne: -1 },
       _id: { $nin: [...session.questionBank, ...newQuestions.map(q => q._id)] }
     })
     .populate('topics.id')
@@ -199,6 +203,7 @@ const replenishQuestionBankByUnit = async (session: any, level: any) => {
   if (newQuestions.length < replenishmentSize) {
     const anyChapterQuestions = await Question.find({ 
       chapterId: level.chapterId,
+      status: { $ne: -1 },
       _id: { $nin: [...session.questionBank, ...newQuestions.map(q => q._id)] }
     })
     .populate('topics.id')
@@ -214,7 +219,7 @@ const replenishQuestionBankByUnit = async (session: any, level: any) => {
     const randomQuestionsNeeded = replenishmentSize - newQuestions.length;
     const existingQuestionIds = [...session.questionBank, ...newQuestions.map(q => q._id)];
     const randomQuestions = await Question.aggregate([
-      { $match: { _id: { $nin: existingQuestionIds } } },
+      { $match: { _id: { $nin: existingQuestionIds }, status: { $ne: -1 } } },
       { $lookup: { from: 'topics', localField: 'topics.id', foreignField: '_id', as: 'topics' } },
       { $sample: { size: randomQuestionsNeeded * 2 } }
     ]);
@@ -0,0 +1,234 @@
+import json
+import os
+import re
+import sys
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from upload_questions import (
+    DEFAULT_BATCH_SIZE, build_question_documents, fetch_topic_lookup, iter_json_records, load_questions_bulk,
+    sync_questions, stream_questions
+)
+from question_index import INDEX_COLLECTION, ensure_index_indexes
+
+MODES = ("bulk", "sync", "stream")
+CHAPTER_FILE_PATTERN = re.compile(r'^([0-9a-fA-F]{24})(?:[._-].*)?\.(json|jsonl)$')
+
+
+class TopicLookupCache:
+    """Topic name -> ID lookup per chapter, fetched once and shared by the feeder threads"""
+
+    def __init__(self, db):
+        self.db = db
+        self._lookups = {}
+        self._lock = threading.Lock()
+
+    def get(self, chapter_id):
+        with self._lock:
+            if chapter_id not in self._lookups:
+                self._lookups[chapter_id] = fetch_topic_lookup(self.db, chapter_id)
+            return self._lookups[chapter_id]
+
+
+def read_manifest(manifest_path):
+    """
+    Manifest: a JSON list (or {"chapters": [...]}) of
+      {"chapterId": "...", "file": "questions/x.json" | "files": [...], "mode": "bulk|sync|stream", "delete": true}
+    File paths are relative to the manifest. Returns chapter entries with absolute paths.
+    """
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    entries = manifest["chapters"] if isinstance(manifest, dict) else manifest
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    chapters = []
+    for entry in entries:
+        files = entry.get("files") or [entry["file"]]
+        mode = entry.get("mode", "bulk")
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode '{mode}' for chapter {entry['chapterId']}")
+        chapters.append({
+            "chapterId": entry["chapterId"],
+            "files": [os.path.join(base_dir, path) for path in files],
+            "mode": mode,
+            "delete": entry.get("delete", True)
+        })
+    return chapters
+
+
+def discover_chapter_files(directory, mode="bulk", delete=True):
+    """Directory mode: files named <chapterId>.json, <chapterId>_<anything>.jsonl, ..."""
+    by_chapter = {}
+    for name in sorted(os.listdir(directory)):
+        match = CHAPTER_FILE_PATTERN.match(name)
+        if not match:
+            logging.warning(f"Skipping {name}: file name does not start with a chapter id")
+            continue
+        by_chapter.setdefault(match.group(1).lower(), []).append(os.path.join(directory, name))
+    return [{"chapterId": chapter_id, "files": files, "mode": mode, "delete": delete}
+            for chapter_id, files in by_chapter.items()]
+
+
+def read_question_batches(file_path, mode, batch_size):
+    """A stream file in batches of batch_size (bounded memory), any other file as one batch"""
+    if mode != "stream":
+        with open(file_path, 'r') as f:
+            yield json.load(f)
+        return
+    batch = []
+    for item, _ in iter_json_records(file_path):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def validate_chapter_files(chapter_id, chapter, topic_lookup, batch_size):
+    """Dry run: validate every file of a chapter without writing anything; returns (valid, invalid)"""
+    valid = 0
+    invalid = 0
+    for file_path in chapter["files"]:
+        read = 0
+        for questions in read_question_batches(file_path, chapter["mode"], batch_size):
+            pairs, errors = build_question_documents(questions, chapter_id, topic_lookup, read)
+            for error in errors:
+                print(f"❌ {os.path.basename(file_path)}: {error}")
+            read += len(questions)
+            valid += len(pairs)
+            invalid += len(errors)
+    return valid, invalid
+
+
+def feed_chapter(client, topic_cache, chapter, batch_size, skip_invalid, dry_run):
+    """
+    Load every file of one chapter. Files of a chapter never run concurrently. Bulk and sync
+    chapters are validated and written as one unit: an invalid file refuses the whole chapter.
+    Stream files run in order and only the first one deletes the existing questions.
+    """
+    chapter_id = ObjectId(chapter["chapterId"])
+    topic_lookup = topic_cache.get(chapter_id)
+    report = {"chapterId": chapter["chapterId"], "mode": chapter["mode"], "files": len(chapter["files"]),
+              "deleted": 0, "inserted": 0, "updated": 0, "failed": 0, "invalid": 0, "failures": 0,
+              "error": None, "note": None}
+    started = time.perf_counter()
+    try:
+        results = []
+        if dry_run and chapter["mode"] != "sync":
+            valid, invalid = validate_chapter_files(chapter_id, chapter, topic_lookup, batch_size)
+            existing = client['projectx']['questions'].count_documents({"chapterId": chapter_id}) if chapter["delete"] else 0
+            results.append({"invalid": invalid})
+            report["note"] = f"dry run: would delete {existing} and insert {valid} questions"
+        elif chapter["mode"] == "stream":
+            for index, file_path in enumerate(chapter["files"]):
+                results.append(stream_questions(client, chapter_id, file_path, chapter["delete"] and index == 0, batch_size,
+                                                topic_lookup=topic_lookup))
+        else:
+            # The files together are the chapter: loading them one by one would let a refused file
+            # skip the delete while the others stack on the old questions (or, in sync mode, delete each other's)
+            questions = []
+            for file_path in chapter["files"]:
+                with open(file_path, 'r') as f:
+                    questions.extend(json.load(f))
+            if chapter["mode"] == "sync":
+                results.append(sync_questions(client, chapter_id, questions, dry_run=dry_run, batch_size=batch_size,
+                                              skip_invalid=skip_invalid, topic_lookup=topic_lookup))
+            else:
+                results.append(load_questions_bulk(client, chapter_id, questions, chapter["delete"], batch_size,
+                                                   skip_invalid=skip_invalid, topic_lookup=topic_lookup))
+        for result in results:
+            report["deleted"] += result.get("deleted", 0) + result.get("soft_deleted", 0)
+            report["inserted"] += result.get("inserted", 0)
+            report["updated"] += result.get("updated", 0) + result.get("ts_updated", 0)
+            report["failed"] += result.get("failed", 0)
+            report["invalid"] += result.get("invalid", 0)
+        # Without --skip-invalid a chapter with invalid questions is refused as a whole (stream mode always skips them)
+        if report["invalid"] and not skip_invalid and chapter["mode"] != "stream":
+            report["failures"] += 1
+            report["error"] = f"{report['invalid']} invalid questions, nothing written for the chapter (use --skip-invalid)"
+    except Exception as e:
+        logging.exception(f"Chapter {chapter['chapterId']} failed")
+        report["failures"] += 1
+        report["error"] = str(e)
+    report["seconds"] = time.perf_counter() - started
+    return report
+
+
+def feed_chapters(chapters, workers=4, batch_size=DEFAULT_BATCH_SIZE, skip_invalid=False, dry_run=False):
+    """Run the chapter loads on a thread pool sharing one pooled MongoClient"""
+    logging.info(f"Connecting to MongoDB: {os.getenv('MONGO_URI')}")
+    # One pool for every thread; leave room for each worker's concurrent cursors and bulk writes
+    client = MongoClient(os.getenv('MONGO_URI'), maxPoolSize=max(10, workers * 2))
+    topic_cache = TopicLookupCache(client['projectx'])
+    if not dry_run:
+        # Once for the whole run rather than per chapter load
+        ensure_index_indexes(client['projectx'][INDEX_COLLECTION])
+    reports = []
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="feeder") as pool:
+            futures = [pool.submit(feed_chapter, client, topic_cache, chapter, batch_size, skip_invalid, dry_run)
+                       for chapter in chapters]
+            for future in as_completed(futures):
+                report = future.result()
+                reports.append(report)
+                status = "❌" if report["failures"] else "✅"
+                logging.info(f"{status} Chapter {report['chapterId']} done in {report['seconds']:.2f}s")
+    finally:
+        client.close()
+    print_report(reports, time.perf_counter() - started)
+    return reports
+
+
+def print_report(reports, elapsed):
+    columns = ("deleted", "inserted", "updated", "failed", "invalid", "failures")
+    print(f"\n📊 {'chapterId':<26}{'mode':<8}{'files':>6}" + "".join(f"{column:>10}" for column in columns) + f"{'seconds':>10}")
+    totals = {column: 0 for column in columns}
+    for report in sorted(reports, key=lambda r: r["chapterId"]):
+        print(f"   {report['chapterId']:<26}{report['mode']:<8}{report['files']:>6}" +
+              "".join(f"{report[column]:>10}" for column in columns) + f"{report['seconds']:>10.2f}")
+        if report["error"]:
+            print(f"   ↳ {report['error']}")
+        if report["note"]:
+            print(f"   ↳ {report['note']}")
+        for column in columns:
+            totals[column] += report[column]
+    print(f"   {'TOTAL':<26}{'':<8}{sum(r['files'] for r in reports):>6}" +
+          "".join(f"{totals[column]:>10}" for column in columns) + f"{elapsed:>10.2f}")
+    print(f"🚀 {totals['inserted'] / max(elapsed, 1e-6):.0f} questions/s over {len(reports)} chapters")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Load the questions of many chapters concurrently')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help='JSON manifest mapping question files to chapters')
+    source.add_argument('--dir', help='Directory of <chapterId>*.json / .jsonl files')
+    parser.add_argument('--mode', choices=MODES, default='bulk', help='Load mode for --dir (manifest entries set their own)')
+    parser.add_argument('--no-delete', action='store_true', help='With --dir, keep existing questions (bulk/stream modes)')
+    parser.add_argument('--workers', type=int, default=4, help='Chapters loaded concurrently')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Questions per insert_many')
+    parser.add_argument('--skip-invalid', action='store_true', help='Load the valid questions of files with invalid ones')
+    parser.add_argument('--dry-run', action='store_true', help='Validate and report only: nothing is written in any mode')
+
+    args = parser.parse_args()
+
+    if args.manifest:
+        chapters = read_manifest(args.manifest)
+    else:
+        chapters = discover_chapter_files(args.dir, args.mode, not args.no_delete)
+    if not chapters:
+        print("ℹ️ No chapters to load")
+        sys.exit(0)
+    reports = feed_chapters(chapters, max(1, args.workers), args.batch_size, args.skip_invalid, args.dry_run)
+    sys.exit(1 if any(report["failures"] for report in reports) else 0)
+
+
+#python feed_chapters.py --manifest manifest.json --workers 8
+#python feed_chapters.py --dir questions/by_chapter --mode sync --dry-run
@@ -0,0 +1,219 @@
+import sys
+import math
+import time
+from datetime import datetime
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+import os
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+# Difficulty-bucketed question index, one document per (chapterId, topicId, muBucket):
+#   {chapterId, topicId, muBucket, muMin, muMax, bucketWidth, questions: [{quesId, mu, xp}], count}
+# A question is filed under every one of its topics. The feeder keeps it in step with
+# insert / delete / sync; mu is the questionsts value at ingest, so --rebuild refreshes
+# buckets after the live TrueSkill updates have moved questions around.
+INDEX_COLLECTION = 'questionindex'
+# Width of a difficulty.mu bucket: with the default width, mu 100-109 is bucket 10, 110-119 bucket 11, ...
+# Question mu sits roughly between 100 and 320, so this gives a topic about 20 buckets to pick from
+DEFAULT_BUCKET_WIDTH = 10
+# Question ids fetched from questionsts per $in query
+TS_LOOKUP_CHUNK = 5000
+
+def mu_bucket(mu, bucket_width=DEFAULT_BUCKET_WIDTH):
+    return math.floor(mu / bucket_width)
+
+def ensure_index_indexes(index_collection):
+    index_collection.create_index([("chapterId", 1), ("topicId", 1), ("muBucket", 1)], unique=True)
+    index_collection.create_index([("questions.quesId", 1)])
+
+def chapter_bucket_width(index_collection, chapter_id, session=None):
+    """Bucket width the chapter was indexed with, so incremental updates land in the same buckets"""
+    doc = index_collection.find_one({"chapterId": chapter_id}, {"bucketWidth": 1}, session=session)
+    return doc["bucketWidth"] if doc else DEFAULT_BUCKET_WIDTH
+
+def index_entries(pairs):
+    """Index entries of (question doc, questionTs doc) pairs as written by the feeder"""
+    return [
+        {
+            "quesId": ques_doc["_id"],
+            "chapterId": ques_doc["chapterId"],
+            "topicIds": [topic["id"] for topic in ques_doc["topics"]],
+            "mu": ques_ts_doc["difficulty"]["mu"],
+            "xp": ques_ts_doc.get("xp", {"correct": 0, "incorrect": 0})
+        }
+        for ques_doc, ques_ts_doc in pairs
+    ]
+
+def group_entries(entries, bucket_width):
+    buckets = {}
+    for entry in entries:
+        bucket = mu_bucket(entry["mu"], bucket_width)
+        for topic_id in entry["topicIds"]:
+            buckets.setdefault((entry["chapterId"], topic_id, bucket), []).append(
+                {"quesId": entry["quesId"], "mu": entry["mu"], "xp": entry["xp"]}
+            )
+    return buckets
+
+def index_add(db, entries, session=None):
+    """Append questions to their buckets: one upsert per touched bucket"""
+    if not entries:
+        return 0
+    index_collection = db[INDEX_COLLECTION]
+    now = datetime.utcnow()
+    widths = {}
+    operations = []
+    for chapter_id in {entry["chapterId"] for entry in entries}:
+        widths[chapter_id] = chapter_bucket_width(index_collection, chapter_id, session)
+    for chapter_id, bucket_width in widths.items():
+        chapter_entries = [entry for entry in entries if entry["chapterId"] == chapter_id]
+        for (_, topic_id, bucket), questions in group_entries(chapter_entries, bucket_width).items():
+            operations.append(UpdateOne(
+                {"chapterId": chapter_id, "topicId": topic_id, "muBucket": bucket},
+                {"$push": {"questions": {"$each": questions}},
+                 "$inc": {"count": len(questions)},
+                 "$set": {"updatedAt": now},
+                 "$setOnInsert": {"muMin": bucket * bucket_width, "muMax": (bucket + 1) * bucket_width,
+                                  "bucketWidth": bucket_width}},
+                upsert=True
+            ))
+    if operations:
+        index_collection.bulk_write(operations, ordered=False, session=session)
+    return len(operations)
+
+def index_remove(db, question_ids, session=None):
+    """Pull questions out of whichever buckets hold them (their mu may have moved since indexing)"""
+    if not question_ids:
+        return 0
+    index_collection = db[INDEX_COLLECTION]
+    removed = set(question_ids)
+    now = datetime.utcnow()
+    operations = []
+    touched = []
+    for doc in index_collection.find({"questions.quesId": {"$in": list(removed)}}, {"questions.quesId": 1}, session=session):
+        present = [question["quesId"] for question in doc["questions"] if question["quesId"] in removed]
+        # Guarded on the ids still being there, so a repeated removal cannot decrement twice
+        operations.append(UpdateOne(
+            {"_id": doc["_id"], "questions.quesId": {"$all": present}},
+            {"$pull": {"questions": {"quesId": {"$in": present}}}, "$inc": {"count": -len(present)}, "$set": {"updatedAt": now}}
+        ))
+        touched.append(doc["_id"])
+    if operations:
+        index_collection.bulk_write(operations, ordered=False, session=session)
+        index_collection.delete_many({"_id": {"$in": touched}, "count": {"$lte": 0}}, session=session)
+    return len(operations)
+
+def index_clear_chapter(db, chapter_id, session=None):
+    return db[INDEX_COLLECTION].delete_many({"chapterId": chapter_id}, session=session).deleted_count
+
+def fetch_chapter_questions(db, chapter_id):
+    """
+    Questions of a chapter that can be served, joined with their questionsts:
+    [{"quesId", "chapterId", "topicIds", "mu", "xp"}]. Soft-deleted questions (status -1) and
+    questions without a questionsts document are left out.
+    """
+    questions = {
+        doc["_id"]: [topic["id"] for topic in doc.get("topics", [])]
+        for doc in db['questions'].find({"chapterId": chapter_id, "status": {"$ne": -1}}, {"_id": 1, "topics.id": 1})
+    }
+    question_ids = list(questions)
+    entries = []
+    for start in range(0, len(question_ids), TS_LOOKUP_CHUNK):
+        chunk = question_ids[start:start + TS_LOOKUP_CHUNK]
+        for ts_doc in db['questionsts'].find({"quesId": {"$in": chunk}}, {"quesId": 1, "difficulty.mu": 1, "xp": 1}):
+            mu = (ts_doc.get("difficulty") or {}).get("mu")
+            if mu is None:
+                continue
+            entries.append({
+                "quesId": ts_doc["quesId"],
+                "chapterId": chapter_id,
+                "topicIds": questions[ts_doc["quesId"]],
+                "mu": mu,
+                "xp": ts_doc.get("xp", {"correct": 0, "incorrect": 0})
+            })
+    return entries
+
+def rebuild_chapter_index(db, chapter_id, bucket_width=DEFAULT_BUCKET_WIDTH):
+    """Recompute a chapter's buckets from questions/questionsts and drop the buckets of older builds"""
+    index_collection = db[INDEX_COLLECTION]
+    build_id = ObjectId()
+    now = datetime.utcnow()
+    entries = fetch_chapter_questions(db, chapter_id)
+    operations = [
+        UpdateOne(
+            {"chapterId": chapter_id, "topicId": topic_id, "muBucket": bucket},
+            {"$set": {"muMin": bucket * bucket_width, "muMax": (bucket + 1) * bucket_width, "bucketWidth": bucket_width,
+                      "questions": questions, "count": len(questions), "buildId": build_id, "updatedAt": now}},
+            upsert=True
+        )
+        for (_, topic_id, bucket), questions in group_entries(entries, bucket_width).items()
+    ]
+    if operations:
+        index_collection.bulk_write(operations, ordered=False)
+    stale = index_collection.delete_many({"chapterId": chapter_id, "buildId": {"$ne": build_id}})
+    print(f"🗂️ Indexed {len(entries)} questions of chapterId {chapter_id} into {len(operations)} buckets, "
+          f"removed {stale.deleted_count} stale buckets")
+    return len(operations)
+
+def print_coverage(db, chapter_id):
+    """Questions per topic and mu bucket, to spot difficulty ranges with few questions"""
+    topic_names = {doc["_id"]: doc.get("topic", str(doc["_id"])) for doc in db['topics'].find({"chapterId": chapter_id}, {"topic": 1})}
+    coverage = {}
+    for doc in db[INDEX_COLLECTION].find({"chapterId": chapter_id}, {"topicId": 1, "muMin": 1, "muMax": 1, "count": 1}):
+        coverage.setdefault(doc["topicId"], []).append(doc)
+    print(f"\n📊 Coverage of chapterId {chapter_id}")
+    for topic_id, buckets in coverage.items():
+        cells = "  ".join(f"{b['muMin']:g}-{b['muMax']:g}:{b['count']}" for b in sorted(buckets, key=lambda b: b["muMin"]))
+        print(f"   {topic_names.get(topic_id, str(topic_id))[:40]:<40} {sum(b['count'] for b in buckets):>6}  {cells}")
+
+def rebuild_index(chapter_ids=None, bucket_width=DEFAULT_BUCKET_WIDTH, coverage=False):
+    logging.info(f"Connecting to MongoDB: {os.getenv('MONGO_URI')}")
+    client = MongoClient(os.getenv('MONGO_URI'))
+    db = client['projectx']
+    ensure_index_indexes(db[INDEX_COLLECTION])
+    started = time.perf_counter()
+    chapter_ids = [ObjectId(c) for c in chapter_ids] if chapter_ids else db['questions'].distinct("chapterId")
+    for chapter_id in chapter_ids:
+        rebuild_chapter_index(db, chapter_id, bucket_width)
+        if coverage:
+            print_coverage(db, chapter_id)
+    client.close()
+    print(f"✅ Rebuilt the index of {len(chapter_ids)} chapters in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rebuild the difficulty-bucketed question index')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the buckets from questions/questionsts')
+    parser.add_argument('--chapter-id', action='append', default=[], help='Only this chapter (repeatable, default all)')
+    parser.add_argument('--bucket-width', type=float, default=DEFAULT_BUCKET_WIDTH, help='difficulty.mu range per bucket')
+    parser.add_argument('--coverage', action='store_true', help='Print questions per topic and bucket')
+
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_index(args.chapter_id, args.bucket_width, args.coverage)
+    elif args.coverage and args.chapter_id:
+        client = MongoClient(os.getenv('MONGO_URI'))
+        for chapter_id in args.chapter_id:
+            print_coverage(client['projectx'], ObjectId(chapter_id))
+        client.close()
+    else:
+        parser.print_help()
+
+
+#python question_index.py --rebuild
+#python question_index.py --rebuild --chapter-id 686923b0a6d909494cadaeaf --coverage
+#python question_index.py --coverage --chapter-id 686923b0a6d909494cadaeaf
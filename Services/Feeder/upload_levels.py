@@ -0,0 +1,282 @@
+import json
+import sys
+import time
+from datetime import datetime
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+import os
+import logging
+from dotenv import load_dotenv
+
+from upload_questions import fetch_topic_lookup
+from question_index import DEFAULT_BUCKET_WIDTH, mu_bucket, fetch_chapter_questions
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+
+POOL_COLLECTION = 'levelquestionpools'
+LEVEL_TYPES = ("time_rush", "precision_path")
+# Schema defaults of Level.difficultyParams
+DEFAULT_DIFFICULTY_PARAMS = {"mean": 750, "sd": 150, "alpha": 5}
+# Per level type: its settings sub-document and the fields the quiz reads from it (Level schema)
+MODE_SETTINGS = {
+    "time_rush": ("timeRush", ("requiredCorrectQuestions", "totalTime", "totalQuestions")),
+    "precision_path": ("precisionPath", ("requiredCorrectQuestions", "totalQuestions", "expectedTime"))
+}
+
+def read_level_files(file_paths):
+    """Each file holds one level definition or a list of them"""
+    levels = []
+    for file_path in file_paths:
+        with open(file_path, 'r') as f:
+            content = json.load(f)
+        for level in content if isinstance(content, list) else [content]:
+            levels.append((file_path, level))
+    return levels
+
+def build_mode_settings(level):
+    """The level's timeRush / precisionPath settings, checked against the Level schema"""
+    mode_field, required = MODE_SETTINGS[level["type"]]
+    settings = level.get(mode_field)
+    if not isinstance(settings, dict):
+        raise ValueError(f"❌ Level '{level['name']}' of type {level['type']} needs '{mode_field}' with {', '.join(required)}")
+    unknown = [key for key in settings if key not in required]
+    if unknown:
+        hint = " (requiredXp is no longer used, give requiredCorrectQuestions)" if "requiredXp" in unknown else ""
+        raise ValueError(f"❌ Level '{level['name']}' has unknown {mode_field} fields {', '.join(unknown)}{hint}")
+    missing = [key for key in required if key not in settings]
+    if missing:
+        raise ValueError(f"❌ Level '{level['name']}' is missing {mode_field}.{', '.join(missing)}")
+    for key in required:
+        value = settings[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"❌ Level '{level['name']}' has invalid {mode_field}.{key} {value!r}")
+    other_field = next(field for mode, (field, _) in MODE_SETTINGS.items() if mode != level["type"])
+    if other_field in level:
+        raise ValueError(f"❌ Level '{level['name']}' of type {level['type']} cannot have '{other_field}'")
+    return mode_field, {key: settings[key] for key in required}
+
+def resolve_unit(level, level_doc, units_collection):
+    """
+    unitId and sectionId are required by the Level schema. A missing unitId resolves to the only unit of the
+    chapter covering all of the level's topics; a missing sectionId to the unit's section.
+    """
+    if level.get("unitId"):
+        unit = units_collection.find_one({"_id": ObjectId(level["unitId"]), "chapterId": level_doc["chapterId"]}, {"sectionId": 1})
+        if not unit:
+            raise ValueError(f"❌ Unit {level['unitId']} not found for chapterId {level['chapterId']}")
+    else:
+        units = list(units_collection.find({"chapterId": level_doc["chapterId"], "topics": {"$all": level_doc["topics"]}}, {"sectionId": 1}))
+        if len(units) != 1:
+            raise ValueError(f"❌ Level '{level['name']}' has no unitId and {len(units)} units of chapterId "
+                             f"{level['chapterId']} cover its topics; set unitId")
+        unit = units[0]
+    level_doc["unitId"] = unit["_id"]
+    if level.get("sectionId"):
+        level_doc["sectionId"] = ObjectId(level["sectionId"])
+    elif unit.get("sectionId"):
+        level_doc["sectionId"] = unit["sectionId"]
+    else:
+        raise ValueError(f"❌ Level '{level['name']}' has no sectionId and unit {unit['_id']} has none either")
+
+def build_level_document(level, topic_lookup, units_collection):
+    """Validate a level definition and resolve its topic names, unit and section; raises ValueError"""
+    for field in ("name", "levelNumber", "description", "chapterId", "type", "topics"):
+        if field not in level:
+            raise ValueError(f"❌ Level '{level.get('name', '?')}' is missing '{field}'")
+    if level["type"] not in LEVEL_TYPES:
+        raise ValueError(f"❌ Level '{level['name']}' has unknown type '{level['type']}'")
+
+    topic_ids = []
+    for topic_name in level["topics"]:
+        if topic_name not in topic_lookup:
+            raise ValueError(f"❌ Topic '{topic_name}' not found for chapterId {level['chapterId']}")
+        topic_ids.append(topic_lookup[topic_name])
+
+    level_doc = {
+        "name": level["name"].strip(),
+        "levelNumber": level["levelNumber"],
+        "description": level["description"].strip(),
+        "topics": topic_ids,
+        "status": level.get("status", False),
+        "chapterId": ObjectId(level["chapterId"]),
+        "type": level["type"],
+        "difficultyParams": {**DEFAULT_DIFFICULTY_PARAMS, **level.get("difficultyParams", {})}
+    }
+    mode_field, settings = build_mode_settings(level)
+    level_doc[mode_field] = settings
+    resolve_unit(level, level_doc, units_collection)
+    return level_doc
+
+def upsert_levels(level_collection, level_docs):
+    """Upsert levels keyed by (chapterId, type, levelNumber); returns the level ids in input order"""
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"chapterId": doc["chapterId"], "type": doc["type"], "levelNumber": doc["levelNumber"]},
+            {"$set": {**doc, "updatedAt": now}, "$setOnInsert": {"createdAt": now}},
+            upsert=True
+        )
+        for doc in level_docs
+    ]
+    if not operations:
+        return [], 0, 0
+    result = level_collection.bulk_write(operations, ordered=True)
+    stored = {
+        (doc["chapterId"], doc["type"], doc["levelNumber"]): doc["_id"]
+        for doc in level_collection.find(
+            {"$or": [{"chapterId": d["chapterId"], "type": d["type"], "levelNumber": d["levelNumber"]} for d in level_docs]},
+            {"chapterId": 1, "type": 1, "levelNumber": 1}
+        )
+    }
+    level_ids = [stored[(doc["chapterId"], doc["type"], doc["levelNumber"])] for doc in level_docs]
+    return level_ids, result.upserted_count, result.matched_count
+
+def build_level_pool(level_id, level_doc, chapter_questions, bucket_width=DEFAULT_BUCKET_WIDTH):
+    """
+    Pool documents of one level, one per (topicId, muBucket). A question is eligible when all
+    of its topics belong to the level (the rule the quiz socket filters with); it is filed under
+    its first topic so it is drawn at most once per pool.
+    """
+    level_topics = {str(topic_id) for topic_id in level_doc["topics"]}
+    buckets = {}
+    for question in chapter_questions:
+        topic_ids = question["topicIds"]
+        if not topic_ids or not all(str(topic_id) in level_topics for topic_id in topic_ids):
+            continue
+        bucket = mu_bucket(question["mu"], bucket_width)
+        entry = buckets.setdefault((str(topic_ids[0]), bucket), {
+            "levelId": level_id,
+            "chapterId": level_doc["chapterId"],
+            "topicId": topic_ids[0],
+            "muBucket": bucket,
+            "muMin": bucket * bucket_width,
+            "muMax": (bucket + 1) * bucket_width,
+            "questionIds": [],
+            "xp": []
+        })
+        entry["questionIds"].append(question["quesId"])
+        entry["xp"].append(question["xp"])
+    for entry in buckets.values():
+        entry["count"] = len(entry["questionIds"])
+    return list(buckets.values())
+
+def store_level_pools(pool_collection, level_ids, pool_docs, bucket_width):
+    """Replace the pools of the given levels: upsert the new buckets, then drop buckets of older builds"""
+    build_id = ObjectId()
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"levelId": doc["levelId"], "topicId": doc["topicId"], "muBucket": doc["muBucket"]},
+            {"$set": {**doc, "bucketWidth": bucket_width, "buildId": build_id, "builtAt": now}},
+            upsert=True
+        )
+        for doc in pool_docs
+    ]
+    if operations:
+        pool_collection.bulk_write(operations, ordered=False)
+    stale = pool_collection.delete_many({"levelId": {"$in": level_ids}, "buildId": {"$ne": build_id}})
+    return len(operations), stale.deleted_count
+
+def ensure_pool_indexes(pool_collection):
+    pool_collection.create_index([("levelId", 1), ("topicId", 1), ("muBucket", 1)], unique=True)
+    # Sampling path: buckets of a level around a target difficulty
+    pool_collection.create_index([("levelId", 1), ("muBucket", 1)])
+
+def build_pools(db, levels, bucket_width=DEFAULT_BUCKET_WIDTH):
+    """Precompute the pools of (level_id, level_doc) pairs, reading each chapter's questions once"""
+    chapter_cache = {}
+    pool_docs = []
+    for level_id, level_doc in levels:
+        if level_doc["chapterId"] not in chapter_cache:
+            chapter_cache[level_doc["chapterId"]] = fetch_chapter_questions(db, level_doc["chapterId"])
+        level_pool = build_level_pool(level_id, level_doc, chapter_cache[level_doc["chapterId"]], bucket_width)
+        if not level_pool:
+            print(f"⚠️ Level '{level_doc['name']}' has no eligible questions")
+        pool_docs.extend(level_pool)
+    written, removed = store_level_pools(db[POOL_COLLECTION], [level_id for level_id, _ in levels], pool_docs, bucket_width)
+    print(f"🎯 Stored {written} pool buckets ({sum(doc['count'] for doc in pool_docs)} questions) "
+          f"for {len(levels)} levels, removed {removed} stale buckets")
+    return written
+
+def load_levels(file_paths, build_question_pools=True, bucket_width=DEFAULT_BUCKET_WIDTH):
+    logging.info(f"Connecting to MongoDB: {os.getenv('MONGO_URI')}")
+    client = MongoClient(os.getenv('MONGO_URI'))
+    db = client['projectx']
+    started = time.perf_counter()
+
+    topic_lookups = {}
+    level_docs = []
+    invalid = 0
+    for file_path, level in read_level_files(file_paths):
+        try:
+            chapter_id = ObjectId(level.get("chapterId"))
+            if chapter_id not in topic_lookups:
+                topic_lookups[chapter_id] = fetch_topic_lookup(db, chapter_id)
+            level_docs.append(build_level_document(level, topic_lookups[chapter_id], db['units']))
+        except Exception as e:
+            print(f"⚠️ Skipping level from {file_path}: {e}")
+            invalid += 1
+
+    level_ids, inserted, updated = upsert_levels(db['levels'], level_docs)
+    print(f"✅ Upserted {len(level_ids)} levels ({inserted} new, {updated} updated)")
+
+    if build_question_pools and level_ids:
+        ensure_pool_indexes(db[POOL_COLLECTION])
+        build_pools(db, list(zip(level_ids, level_docs)), bucket_width)
+
+    client.close()
+    print(f"⏱️ Done in {time.perf_counter() - started:.2f}s")
+    return {"inserted": inserted, "updated": updated, "invalid": invalid}
+
+def rebuild_pools(chapter_ids, bucket_width=DEFAULT_BUCKET_WIDTH):
+    """Recompute the pools of the stored levels of some chapters, e.g. after uploading questions"""
+    logging.info(f"Connecting to MongoDB: {os.getenv('MONGO_URI')}")
+    client = MongoClient(os.getenv('MONGO_URI'))
+    db = client['projectx']
+    ensure_pool_indexes(db[POOL_COLLECTION])
+    levels = [
+        (level_doc["_id"], level_doc)
+        for level_doc in db['levels'].find({"chapterId": {"$in": [ObjectId(c) for c in chapter_ids]}},
+                                           {"name": 1, "chapterId": 1, "topics": 1})
+    ]
+    if levels:
+        build_pools(db, levels, bucket_width)
+    else:
+        print("ℹ️ No levels found for these chapters")
+    client.close()
+    return len(levels)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Upload level definitions and precompute their question pools')
+    parser.add_argument('file_paths', nargs='*', help='Level JSON files (one level or a list of levels each)')
+    parser.add_argument('--no-pools', action='store_true', help='Only upsert the levels')
+    parser.add_argument('--rebuild-pools', metavar='CHAPTER_ID', action='append', default=[],
+                        help='Recompute the pools of the stored levels of a chapter (repeatable)')
+    parser.add_argument('--bucket-width', type=float, default=DEFAULT_BUCKET_WIDTH, help='difficulty.mu range per pool bucket')
+
+    args = parser.parse_args()
+
+    if args.rebuild_pools:
+        rebuild_pools(args.rebuild_pools, args.bucket_width)
+    elif args.file_paths:
+        result = load_levels(args.file_paths, not args.no_pools, args.bucket_width)
+        sys.exit(1 if result["invalid"] else 0)
+    else:
+        parser.print_help()
+
+
+#python upload_levels.py levels/precision_path_level.json levels/time_rush_level.json
+#python upload_levels.py levels/*.json --bucket-width 25
+#python upload_levels.py --rebuild-pools 686923b0a6d909494cadaeaf
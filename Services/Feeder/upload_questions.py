@@ -1,11 +1,19 @@
 import json
+import re
 import sys
+import time
+import struct
+import hashlib
+from datetime import datetime, timezone
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from dotenv import load_dotenv
 
+from question_index import INDEX_COLLECTION, ensure_index_indexes, index_entries, index_add, index_remove, index_clear_chapter
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -18,14 +26,21 @@ logging.basicConfig(
     ]
 )
 
-def delete_existing_questions(chapter_id, question_collection, question_ts_collection):
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_READ_CHUNK = 1 << 20
+CHECKPOINT_COLLECTION = 'feedercheckpoints'
+# Authored question content; the fingerprint of these fields is stored as contentHash
+QUESTION_CONTENT_FIELDS = ("ques", "options", "correct", "topics")
+
+def delete_existing_questions(chapter_id, question_collection, question_ts_collection, session=None):
     """Delete existing questions and their associated questionTs for a given chapter"""
-    existing_questions = list(question_collection.find({"chapterId": chapter_id}, {"_id": 1}))
+    existing_questions = list(question_collection.find({"chapterId": chapter_id}, {"_id": 1}, session=session))
     existing_ids = [q["_id"] for q in existing_questions]
 
     if existing_ids:
-        delete_q = question_collection.delete_many({"_id": {"$in": existing_ids}})
-        delete_ts = question_ts_collection.delete_many({"quesId": {"$in": existing_ids}})
+        delete_q = question_collection.delete_many({"_id": {"$in": existing_ids}}, session=session)
+        delete_ts = question_ts_collection.delete_many({"quesId": {"$in": existing_ids}}, session=session)
+        index_clear_chapter(question_collection.database, chapter_id, session)
         print(f"🗑️ Deleted {delete_q.deleted_count} questions and {delete_ts.deleted_count} questionTs for chapterId {chapter_id}")
         return len(existing_ids)
     else:
@@ -35,6 +50,7 @@ def delete_existing_questions(chapter_id, question_collection, question_ts_colle
 def insert_questions(questions, chapter_id, question_collection, question_ts_collection, topic_lookup):
     """Insert new questions and their associated questionTs"""
     inserted_count = 0
+    written_pairs = []
 
     for q in questions:
         try:
@@ -68,15 +84,500 @@ def insert_questions(questions, chapter_id, question_collection, question_ts_col
             }
             question_ts_collection.insert_one(ques_ts_doc)
             inserted_count += 1
+            written_pairs.append(({**ques_doc, "_id": result.inserted_id}, ques_ts_doc))
 
         except Exception as e:
             print(f"⚠️ Skipping question due to error: {e}")
             continue
 
+    index_add(question_collection.database, index_entries(written_pairs))
     print(f"✅ Successfully inserted {inserted_count} questions.")
     return inserted_count
 
-def load_questions(chapter_id_str, file_path, delete_existing=True):
+def fetch_topic_lookup(db, chapter_id):
+    """Topic name -> ID lookup of a chapter, using the 'topic' field"""
+    return {doc["topic"]: doc["_id"] for doc in db['topics'].find({"chapterId": chapter_id}, {"_id": 1, "topic": 1})}
+
+def fingerprint(content):
+    """Stable hash of JSON-like content (key order and ObjectId vs string do not matter)"""
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+def question_fingerprint(ques_doc):
+    return fingerprint({field: ques_doc.get(field) for field in QUESTION_CONTENT_FIELDS})
+
+def ts_fingerprint(mu, xp):
+    """
+    Hash of the authored difficulty/xp. Stored on the question as tsHash because
+    questionsts.difficulty.mu itself is updated live as students answer.
+    """
+    return fingerprint({"mu": mu, "xp": xp})
+
+def question_key(ques):
+    """Identity of a question across edits of its options/answer/topics: whitespace- and case-insensitive text"""
+    return " ".join(str(ques or "").split()).lower()
+
+def build_question_documents(questions, chapter_id, topic_lookup, start_index=0, make_id=ObjectId):
+    """
+    Validate the whole file and resolve topics before anything is written.
+    Returns (pairs, errors): pairs of (question doc, questionTs doc) sharing a pre-generated _id,
+    errors as "question <index>: <reason>" strings.
+    """
+    pairs = []
+    errors = []
+    for index, q in enumerate(questions, start_index):
+        try:
+            missing = [field for field in ("ques", "options", "correct", "topics", "difficulty") if field not in q]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+            if not isinstance(q["options"], list):
+                raise ValueError("options must be a list")
+            # An index or a non-empty list of indexes (multicorrect), as in the Question schema
+            correct = q["correct"] if isinstance(q["correct"], list) else [q["correct"]]
+            if not correct or not all(isinstance(i, int) and not isinstance(i, bool) and 0 <= i < len(q["options"]) for i in correct):
+                raise ValueError(f"correct {q['correct']!r} is not an option index (or non-empty list of them) for {len(q['options'])} options")
+            if "mu" not in q["difficulty"]:
+                raise ValueError("missing difficulty.mu")
+            unknown = [topic_name for topic_name in q["topics"] if topic_name not in topic_lookup]
+            if unknown:
+                raise ValueError(f"topics not found for chapterId {chapter_id}: {', '.join(unknown)}")
+        except (ValueError, TypeError) as e:
+            errors.append(f"question {index}: {e}")
+            continue
+
+        ques_id = make_id(index) if make_id is not ObjectId else ObjectId()
+        ques_doc = {
+            "_id": ques_id,
+            "ques": q["ques"],
+            "options": q["options"],
+            "correct": q["correct"],
+            "chapterId": chapter_id,
+            "topics": [{"id": topic_lookup[topic_name], "name": topic_name} for topic_name in q["topics"]]
+        }
+        ques_ts_doc = {
+            "quesId": ques_id,
+            "difficulty": {
+                "mu": q["difficulty"]["mu"]
+            },
+            "xp": q.get("xp", {"correct": 0, "incorrect": 0})
+        }
+        ques_doc["contentHash"] = question_fingerprint(ques_doc)
+        ques_doc["tsHash"] = ts_fingerprint(ques_ts_doc["difficulty"]["mu"], ques_ts_doc["xp"])
+        pairs.append((ques_doc, ques_ts_doc))
+    return pairs, errors
+
+def failed_indexes(error):
+    return {write_error["index"] for write_error in error.details.get("writeErrors", [])}
+
+def bulk_insert_questions(pairs, question_collection, question_ts_collection, batch_size=DEFAULT_BATCH_SIZE, session=None):
+    """
+    Insert validated (question, questionTs) pairs with batched unordered insert_many.
+    Outside a transaction a question whose questionTs could not be written is removed again,
+    so no question is left without its TS document. Returns (inserted, failed) question counts.
+    """
+    inserted_count = 0
+    failed_count = 0
+    started = time.perf_counter()
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start:start + batch_size]
+        ques_docs = [ques_doc for ques_doc, _ in batch]
+        try:
+            question_collection.insert_many(ques_docs, ordered=False, session=session)
+            failed = set()
+        except BulkWriteError as e:
+            if session is not None:
+                raise
+            failed = failed_indexes(e)
+            print(f"⚠️ {len(failed)} questions of batch {start // batch_size} failed: {e.details['writeErrors'][0]['errmsg']}")
+
+        ts_docs = [ts_doc for i, (_, ts_doc) in enumerate(batch) if i not in failed]
+        try:
+            if ts_docs:
+                question_ts_collection.insert_many(ts_docs, ordered=False, session=session)
+        except BulkWriteError as e:
+            if session is not None:
+                raise
+            orphan_ids = {ts_docs[i]["quesId"] for i in failed_indexes(e)}
+            question_collection.delete_many({"_id": {"$in": list(orphan_ids)}})
+            print(f"⚠️ Removed {len(orphan_ids)} questions whose questionTs insert failed")
+            failed |= {i for i, (ques_doc, _) in enumerate(batch) if ques_doc["_id"] in orphan_ids}
+
+        index_add(question_collection.database, index_entries([pair for i, pair in enumerate(batch) if i not in failed]), session)
+        inserted_count += len(batch) - len(failed)
+        failed_count += len(failed)
+        elapsed = time.perf_counter() - started
+        logging.info(f"Inserted {inserted_count}/{len(pairs)} questions ({inserted_count / max(elapsed, 1e-6):.0f} questions/s)")
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Successfully inserted {inserted_count} questions in {elapsed:.2f}s "
+          f"({inserted_count / max(elapsed, 1e-6):.0f} questions/s), {failed_count} failed.")
+    return inserted_count, failed_count
+
+def load_questions_bulk(client, chapter_id, questions, delete_existing=True, batch_size=DEFAULT_BATCH_SIZE,
+                        use_transaction=False, skip_invalid=False, topic_lookup=None):
+    """Validate everything, then delete and bulk insert (optionally as one transaction)"""
+    db = client['projectx']
+    question_collection = db['questions']
+    question_ts_collection = db['questionsts']
+    if topic_lookup is None:
+        topic_lookup = fetch_topic_lookup(db, chapter_id)
+
+    pairs, errors = build_question_documents(questions, chapter_id, topic_lookup)
+    for error in errors:
+        print(f"❌ {error}")
+    if errors and not skip_invalid:
+        print(f"❌ {len(errors)} invalid questions, nothing written (use --skip-invalid to load the valid ones)")
+        return {"deleted": 0, "inserted": 0, "failed": 0, "invalid": len(errors)}
+
+    def write(session=None):
+        deleted = 0
+        if delete_existing:
+            deleted = delete_existing_questions(chapter_id, question_collection, question_ts_collection, session)
+        inserted, failed = bulk_insert_questions(pairs, question_collection, question_ts_collection, batch_size, session)
+        return deleted, inserted, failed
+
+    if use_transaction:
+        # Requires a replica set; readers see the old or the new chapter, never a mix
+        with client.start_session() as session:
+            deleted, inserted, failed = session.with_transaction(lambda s: write(s))
+    else:
+        deleted, inserted, failed = write()
+    return {"deleted": deleted, "inserted": inserted, "failed": failed, "invalid": len(errors)}
+
+def match_stored_questions(pairs, stored_docs):
+    """
+    Pair file questions with stored ones: first by identical content, then by question text.
+    Returns (matches, new_pairs, removed_docs), matches being (pair, stored doc).
+    """
+    by_hash = {}
+    by_key = {}
+    for doc in stored_docs:
+        by_hash.setdefault(doc.get("contentHash") or question_fingerprint(doc), []).append(doc)
+        by_key.setdefault(question_key(doc.get("ques")), []).append(doc)
+
+    matched_ids = set()
+
+    def take(candidates):
+        while candidates:
+            doc = candidates.pop(0)
+            if doc["_id"] not in matched_ids:
+                matched_ids.add(doc["_id"])
+                return doc
+        return None
+
+    matches = []
+    unmatched = []
+    for pair in pairs:
+        doc = take(by_hash.get(pair[0]["contentHash"], []))
+        if doc:
+            matches.append((pair, doc))
+        else:
+            unmatched.append(pair)
+    new_pairs = []
+    for pair in unmatched:
+        doc = take(by_key.get(question_key(pair[0]["ques"]), []))
+        if doc:
+            matches.append((pair, doc))
+        else:
+            new_pairs.append(pair)
+    removed_docs = [doc for doc in stored_docs if doc["_id"] not in matched_ids]
+    return matches, new_pairs, removed_docs
+
+def sync_questions(client, chapter_id, questions, soft_delete=False, dry_run=False, batch_size=DEFAULT_BATCH_SIZE,
+                   skip_invalid=False, topic_lookup=None):
+    """
+    Diff the file against the stored chapter and write only the difference: changed questions
+    are updated in place (keeping their _id), new ones inserted, removed ones deleted or
+    soft-deleted (status -1). Writes are proportional to the edit.
+    A question the feeder soft-deleted gets its previous status back when it returns to the file;
+    one archived by an admin (status -1 set outside the feeder) is left alone.
+    """
+    db = client['projectx']
+    question_collection = db['questions']
+    question_ts_collection = db['questionsts']
+    if topic_lookup is None:
+        topic_lookup = fetch_topic_lookup(db, chapter_id)
+
+    pairs, errors = build_question_documents(questions, chapter_id, topic_lookup)
+    for error in errors:
+        print(f"❌ {error}")
+    if errors and not skip_invalid:
+        print(f"❌ {len(errors)} invalid questions, nothing written (use --skip-invalid to sync the valid ones)")
+        return {"invalid": len(errors)}
+
+    projection = {field: 1 for field in QUESTION_CONTENT_FIELDS}
+    projection.update({"contentHash": 1, "tsHash": 1, "status": 1, "archivedBy": 1, "statusBeforeArchive": 1})
+    stored_docs = list(question_collection.find({"chapterId": chapter_id}, projection))
+    stored_ts = {
+        ts["quesId"]: ts for ts in question_ts_collection.find(
+            {"quesId": {"$in": [doc["_id"] for doc in stored_docs]}}, {"quesId": 1, "difficulty.mu": 1, "xp": 1}
+        )
+    }
+    matches, new_pairs, removed_docs = match_stored_questions(pairs, stored_docs)
+    # Questions already soft-deleted stay as they are unless they come back
+    removed_docs = [doc for doc in removed_docs if doc.get("status") != -1]
+    # An admin's archive wins over the file: the question keeps its content and stays archived
+    admin_archived = [stored for _, stored in matches if stored.get("status") == -1 and stored.get("archivedBy") != "feeder"]
+    matches = [(pair, stored) for pair, stored in matches if stored.get("status") != -1 or stored.get("archivedBy") == "feeder"]
+
+    summary = {"unchanged": 0, "updated": 0, "restored": 0, "ts_updated": 0, "inserted": len(new_pairs),
+               "deleted": 0, "soft_deleted": 0, "archived_kept": len(admin_archived), "invalid": len(errors)}
+    question_ops = []
+    ts_ops = []
+    # Questions whose bucket, topics or xp may have changed, re-filed in the question index
+    reindexed_pairs = []
+    for (ques_doc, ques_ts_doc), stored in matches:
+        # Hashes are stamped on questions loaded before they existed, which is not a change
+        update = {}
+        unset = {}
+        changed = False
+        ts_changed = False
+        if stored.get("contentHash") != ques_doc["contentHash"]:
+            if question_fingerprint(stored) != ques_doc["contentHash"]:
+                update.update({field: ques_doc[field] for field in QUESTION_CONTENT_FIELDS})
+                summary["updated"] += 1
+                changed = True
+            update["contentHash"] = ques_doc["contentHash"]
+        if stored.get("status") == -1:
+            # Back to the status it had before the feeder archived it (none for feeder-loaded questions)
+            if stored.get("statusBeforeArchive") is None:
+                unset["status"] = ""
+            else:
+                update["status"] = stored["statusBeforeArchive"]
+            unset.update({"archivedBy": "", "statusBeforeArchive": ""})
+            summary["restored"] += 1
+            changed = True
+
+        if stored.get("tsHash") != ques_doc["tsHash"]:
+            ts = stored_ts.get(stored["_id"]) or {}
+            stored_authored = stored.get("tsHash") or ts_fingerprint((ts.get("difficulty") or {}).get("mu"), ts.get("xp"))
+            if stored_authored != ques_doc["tsHash"]:
+                ts_ops.append(UpdateOne(
+                    {"quesId": stored["_id"]},
+                    {"$set": {"difficulty.mu": ques_ts_doc["difficulty"]["mu"], "xp": ques_ts_doc["xp"]}},
+                    upsert=True
+                ))
+                summary["ts_updated"] += 1
+                changed = ts_changed = True
+            update["tsHash"] = ques_doc["tsHash"]
+
+        operators = {key: fields for key, fields in (("$set", update), ("$unset", unset)) if fields}
+        if operators:
+            question_ops.append(UpdateOne({"_id": stored["_id"]}, operators))
+        if changed:
+            ts = stored_ts.get(stored["_id"])
+            if ts and not ts_changed:
+                # Authored difficulty unchanged: keep the live mu the question has drifted to
+                ques_ts_doc = {"difficulty": {"mu": (ts.get("difficulty") or {}).get("mu", ques_ts_doc["difficulty"]["mu"])},
+                               "xp": ts.get("xp", ques_ts_doc["xp"])}
+            reindexed_pairs.append(({**ques_doc, "_id": stored["_id"]}, ques_ts_doc))
+        if not changed:
+            summary["unchanged"] += 1
+
+    removed_ids = [doc["_id"] for doc in removed_docs]
+    summary["soft_deleted" if soft_delete else "deleted"] = len(removed_ids)
+
+    print(f"📊 Sync {'(dry run) ' if dry_run else ''}for chapterId {chapter_id}: " +
+          ", ".join(f"{key}={value}" for key, value in summary.items()))
+    for (ques_doc, _), stored in matches:
+        if stored.get("contentHash") != ques_doc["contentHash"] and question_fingerprint(stored) != ques_doc["contentHash"]:
+            logging.info(f"~ {stored['_id']}: {ques_doc['ques'][:80]}")
+    for ques_doc, _ in new_pairs:
+        logging.info(f"+ {ques_doc['ques'][:80]}")
+    for doc in removed_docs:
+        logging.info(f"- {doc['_id']}: {str(doc.get('ques'))[:80]}")
+    for _, stored in matches:
+        if stored.get("status") == -1:
+            logging.info(f"^ {stored['_id']} (restored to {'status ' + str(stored['statusBeforeArchive']) if stored.get('statusBeforeArchive') is not None else 'no status'}): {str(stored.get('ques'))[:80]}")
+    for doc in admin_archived:
+        logging.info(f"= {doc['_id']} (archived by an admin, left archived): {str(doc.get('ques'))[:80]}")
+    if dry_run:
+        return summary
+
+    started = time.perf_counter()
+    for start in range(0, len(question_ops), batch_size):
+        question_collection.bulk_write(question_ops[start:start + batch_size], ordered=False)
+    for start in range(0, len(ts_ops), batch_size):
+        question_ts_collection.bulk_write(ts_ops[start:start + batch_size], ordered=False)
+    if reindexed_pairs:
+        index_remove(db, [ques_doc["_id"] for ques_doc, _ in reindexed_pairs])
+        index_add(db, index_entries(reindexed_pairs))
+    if new_pairs:
+        summary["inserted"], summary["failed"] = bulk_insert_questions(new_pairs, question_collection, question_ts_collection, batch_size)
+    if removed_ids:
+        if soft_delete:
+            # Remember the status each question had, so a question that comes back gets it again
+            by_status = {}
+            for doc in removed_docs:
+                by_status.setdefault(doc.get("status"), []).append(doc["_id"])
+            for status, ids in by_status.items():
+                question_collection.update_many(
+                    {"_id": {"$in": ids}},
+                    {"$set": {"status": -1, "archivedBy": "feeder", "statusBeforeArchive": status}}
+                )
+        else:
+            question_collection.delete_many({"_id": {"$in": removed_ids}})
+            question_ts_collection.delete_many({"quesId": {"$in": removed_ids}})
+        index_remove(db, removed_ids)
+    print(f"✅ Sync written in {time.perf_counter() - started:.2f}s")
+    return summary
+
+def iter_json_records(file_path, chunk_size=DEFAULT_READ_CHUNK):
+    """
+    Yield the items of a top-level JSON array, or the values of a JSON Lines file, one at a
+    time as (item, characters consumed so far). Memory is bounded by the read chunk plus the
+    largest single item, not the file size.
+    """
+    decoder = json.JSONDecoder()
+    separators = re.compile(r'[\s,]*')
+    whitespace = re.compile(r'\s*')
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        consumed = 0
+        eof = False
+        in_array = None
+
+        def read_more(minimum):
+            nonlocal buffer, pos, eof
+            data = f.read(max(chunk_size, minimum))
+            eof = not data
+            # Drop what was already parsed before growing the buffer
+            buffer = buffer[pos:] + data
+            pos = 0
+
+        while True:
+            skip = (separators if in_array else whitespace).match(buffer, pos).end()
+            consumed += skip - pos
+            pos = skip
+            if pos == len(buffer):
+                if eof:
+                    if in_array:
+                        raise ValueError("Unexpected end of file inside the JSON array")
+                    return
+                read_more(0)
+                continue
+            if in_array is None:
+                in_array = buffer[pos] == '['
+                if in_array:
+                    pos += 1
+                    consumed += 1
+                continue
+            if in_array and buffer[pos] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Item not complete yet: grow geometrically so a huge item is re-parsed O(log n) times
+                read_more(len(buffer) - pos)
+                continue
+            consumed += end - pos
+            pos = end
+            yield item, consumed
+
+def ingest_object_id(started_at, job_id, index):
+    """
+    Deterministic ObjectId for record `index` of an ingest job: job start time, job hash and the
+    record offset. A resumed job regenerates the same ids, so a half-written batch can be cleaned up.
+    """
+    job_hash = hashlib.blake2b(job_id.encode('utf-8'), digest_size=4).digest()
+    return ObjectId(struct.pack('>I', int(started_at.timestamp())) + job_hash + struct.pack('>I', index))
+
+def stream_questions(client, chapter_id, file_path, delete_existing=True, batch_size=DEFAULT_BATCH_SIZE,
+                     job_id=None, resume=False, start_offset=0, topic_lookup=None):
+    """
+    Stream a JSON array / JSON Lines file: validate and resolve topics per item, insert in
+    fixed-size batches and checkpoint the record offset after every batch, so peak memory is
+    one batch and an interrupted load resumes with --resume (or from --start-offset).
+    Invalid items are reported and skipped.
+    """
+    db = client['projectx']
+    question_collection = db['questions']
+    question_ts_collection = db['questionsts']
+    checkpoints = db[CHECKPOINT_COLLECTION]
+    if topic_lookup is None:
+        topic_lookup = fetch_topic_lookup(db, chapter_id)
+
+    job_id = job_id or f"{chapter_id}:{os.path.basename(file_path)}"
+    checkpoint = checkpoints.find_one({"_id": job_id}) if resume else None
+    if checkpoint and checkpoint.get("done"):
+        print(f"ℹ️ Job {job_id} already completed, nothing to do")
+        return checkpoint["totals"]
+    totals = {"deleted": 0, "read": 0, "inserted": 0, "failed": 0, "invalid": 0}
+    if checkpoint:
+        totals.update(checkpoint["totals"])
+    offset = checkpoint["offset"] if checkpoint else start_offset
+    started_at = checkpoint["startedAt"] if checkpoint else datetime.now(timezone.utc).replace(microsecond=0)
+    if started_at.tzinfo is None:
+        started_at = started_at.replace(tzinfo=timezone.utc)
+
+    if checkpoint:
+        print(f"↩️ Resuming job {job_id} at record {offset}")
+    elif delete_existing and offset == 0:
+        totals["deleted"] = delete_existing_questions(chapter_id, question_collection, question_ts_collection)
+
+    file_size = os.path.getsize(file_path)
+    started = time.perf_counter()
+    batch = []
+    batch_start = offset
+    cleanup_first_batch = checkpoint is not None
+
+    def make_id(index):
+        return ingest_object_id(started_at, job_id, index)
+
+    def flush(next_offset, position):
+        nonlocal batch, batch_start, cleanup_first_batch
+        pairs, errors = build_question_documents(batch, chapter_id, topic_lookup, batch_start, make_id)
+        for error in errors:
+            print(f"❌ {error}")
+        if cleanup_first_batch:
+            # The interrupted run may have written part of this batch
+            ids = [make_id(index) for index in range(batch_start, next_offset)]
+            question_collection.delete_many({"_id": {"$in": ids}})
+            question_ts_collection.delete_many({"quesId": {"$in": ids}})
+            index_remove(db, ids)
+            cleanup_first_batch = False
+        if pairs:
+            inserted, failed = bulk_insert_questions(pairs, question_collection, question_ts_collection, batch_size)
+            totals["inserted"] += inserted
+            totals["failed"] += failed
+        totals["invalid"] += len(errors)
+        checkpoints.update_one(
+            {"_id": job_id},
+            {"$set": {"chapterId": chapter_id, "file": os.path.abspath(file_path), "offset": next_offset,
+                      "startedAt": started_at, "totals": totals, "done": False},
+             "$currentDate": {"updatedAt": True}},
+            upsert=True
+        )
+        elapsed = time.perf_counter() - started
+        logging.info(f"📦 Records {next_offset} ({position / max(file_size, 1):.0%} of file) | inserted={totals['inserted']} "
+                     f"invalid={totals['invalid']} | {(next_offset - offset) / max(elapsed, 1e-6):.0f} records/s")
+        batch = []
+        batch_start = next_offset
+
+    index = -1
+    position = 0
+    for index, (item, position) in enumerate(iter_json_records(file_path)):
+        if index < offset:
+            continue
+        totals["read"] += 1
+        batch.append(item)
+        if len(batch) >= batch_size:
+            flush(index + 1, position)
+    if batch:
+        flush(index + 1, position)
+
+    checkpoints.update_one({"_id": job_id}, {"$set": {"done": True, "totals": totals}, "$currentDate": {"updatedAt": True}}, upsert=True)
+    print(f"✅ Streamed {totals['read']} records in {time.perf_counter() - started:.2f}s: "
+          f"inserted={totals['inserted']} failed={totals['failed']} invalid={totals['invalid']}")
+    return totals
+
+def load_questions(chapter_id_str, file_path, delete_existing=True, bulk=False, batch_size=DEFAULT_BATCH_SIZE,
+                   use_transaction=False, skip_invalid=False, sync=False, soft_delete=False, dry_run=False,
+                   stream=False, job_id=None, resume=False, start_offset=0):
     # Connect to MongoDB
     logging.info(f"Connecting to MongoDB: {os.getenv('MONGO_URI')}")
     client = MongoClient(os.getenv('MONGO_URI'))
@@ -84,9 +585,25 @@ def load_questions(chapter_id_str, file_path, delete_existing=True):
     question_collection = db['questions']
     question_ts_collection = db['questionsts']
     topics_collection = db['topics']
+    if not dry_run:
+        # index_add / index_remove look buckets up by (chapterId, topicId, muBucket) and questions.quesId
+        ensure_index_indexes(db[INDEX_COLLECTION])
 
     chapter_id = ObjectId(chapter_id_str)
 
+    if stream:
+        return stream_questions(client, chapter_id, file_path, delete_existing, batch_size, job_id, resume, start_offset)
+
+    if sync:
+        with open(file_path, 'r') as f:
+            questions = json.load(f)
+        return sync_questions(client, chapter_id, questions, soft_delete, dry_run, batch_size, skip_invalid)
+
+    if bulk:
+        with open(file_path, 'r') as f:
+            questions = json.load(f)
+        return load_questions_bulk(client, chapter_id, questions, delete_existing, batch_size, use_transaction, skip_invalid)
+
     # Step 1: Delete existing questions for this chapter (if requested)
     deleted_count = 0
     if delete_existing:
@@ -116,13 +633,30 @@ if __name__ == "__main__":
     parser.add_argument('chapter_id', help='Chapter ID to upload questions for')
     parser.add_argument('file_path', help='Path to the JSON file containing questions')
     parser.add_argument('--no-delete', action='store_true', help='Skip deletion of existing questions')
+    parser.add_argument('--bulk', action='store_true', help='Validate the whole file, then insert with batched insert_many')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Questions per insert_many (with --bulk)')
+    parser.add_argument('--transaction', action='store_true', help='Delete and insert in one transaction (with --bulk, needs a replica set)')
+    parser.add_argument('--skip-invalid', action='store_true', help='Load the valid questions even if some fail validation (with --bulk/--sync)')
+    parser.add_argument('--sync', action='store_true', help='Diff the file against the stored chapter and write only the changes')
+    parser.add_argument('--soft-delete', action='store_true', help='With --sync, mark removed questions status -1 (skipped by the quiz question selection) instead of deleting them; they get their previous status back if they return to the file (admin archives are kept)')
+    parser.add_argument('--dry-run', action='store_true', help='With --sync, print the change summary without writing')
+    parser.add_argument('--stream', action='store_true',
+                        help='Parse a JSON array or JSON Lines file incrementally and insert in --batch-size batches')
+    parser.add_argument('--job-id', default=None, help='With --stream, checkpoint name (default <chapter_id>:<file name>)')
+    parser.add_argument('--resume', action='store_true', help='With --stream, continue from the last checkpointed record')
+    parser.add_argument('--start-offset', type=int, default=0, help='With --stream, skip the first N records')
     
     args = parser.parse_args()
     
     logging.info(f"Loading questions from {args.file_path} for chapter {args.chapter_id}")
-    result = load_questions(args.chapter_id, args.file_path, not args.no_delete)
-    print(f"📊 Summary: Deleted {result['deleted']} questions, Inserted {result['inserted']} questions")
+    result = load_questions(args.chapter_id, args.file_path, not args.no_delete, args.bulk, args.batch_size,
+                            args.transaction, args.skip_invalid, args.sync, args.soft_delete, args.dry_run,
+                            args.stream, args.job_id, args.resume, args.start_offset)
+    if not args.sync and not args.stream:
+        print(f"📊 Summary: Deleted {result['deleted']} questions, Inserted {result['inserted']} questions")
 
 
 #python upload_questions.py 686923b0a6d909494cadaeaf questions/questions1.json
-#python upload_questions.py 686923b0a6d909494cadaeaf questions/questions1.json --no-delete
\ No newline at end of file
+#python upload_questions.py 686923b0a6d909494cadaeaf questions/questions1.json --no-delete
+#python upload_questions.py 686923b0a6d909494cadaeaf questions/questions1.json --bulk --transaction
+#python upload_questions.py 686923b0a6d909494cadaeaf questions/questions1.json --sync --soft-delete --dry-run
\ No newline at end of file
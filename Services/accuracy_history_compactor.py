@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Accuracy History Compactor
+Bounds the size of UserTopicPerformance.topics[].accuracyHistory with retention tiers:
+raw points for the last --raw-days, one point per day up to --daily-days, one point per week beyond.
+Bucketed points keep min/mean/last/count; `accuracy` is the bucket's last value and `timestamp`
+the time of its last point, so readers that pick the newest point still get the current accuracy.
+
+Users are compacted incrementally (historyCompactedAt marks when a user was last compacted).
+Writes are conditional on the document version maintained by user_topic_performance.py, so
+the compactor can run alongside the live worker: a concurrent update makes it retry.
+"""
+
+import os
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+DEFAULT_RAW_DAYS = 30
+DEFAULT_DAILY_DAYS = 180
+MAX_CONFLICT_RETRIES = 3
+
+
+def load_mongo_uri() -> str:
+    load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        raise RuntimeError('MONGO_URI missing in Services/.env')
+    return mongo_uri
+
+
+def bucket_key(timestamp: datetime, now: datetime, raw_days: int, daily_days: int) -> Optional[Tuple[str, datetime]]:
+    """Return (resolution, bucket start) for a point, or None if it stays raw"""
+    age = now - timestamp
+    if age < timedelta(days=raw_days):
+        return None
+    day = datetime(timestamp.year, timestamp.month, timestamp.day)
+    if age < timedelta(days=daily_days):
+        return 'day', day
+    return 'week', day - timedelta(days=day.weekday())
+
+
+def compact_history(history: List[Dict[str, Any]], now: datetime, raw_days: int, daily_days: int) -> List[Dict[str, Any]]:
+    """
+    Downsample one topic's accuracy history. Idempotent: already bucketed points merge into
+    coarser buckets as they age, weighted by their point count.
+    A history with any point lacking a datetime timestamp cannot be ordered and is returned untouched.
+    """
+    if not all(isinstance(p.get('timestamp'), datetime) for p in history):
+        return list(history)
+    points = sorted(history, key=lambda p: p['timestamp'])
+    compacted: List[Dict[str, Any]] = []
+    buckets: Dict[Tuple[str, datetime], Dict[str, Any]] = {}
+
+    for point in points:
+        key = bucket_key(point['timestamp'], now, raw_days, daily_days)
+        if key is None:
+            compacted.append(point)
+            continue
+        count = point.get('count', 1)
+        mean = point.get('mean', point['accuracy'])
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = {
+                'timestamp': point['timestamp'],
+                'accuracy': point['accuracy'],
+                'resolution': key[0],
+                'bucketStart': key[1],
+                'min': point.get('min', point['accuracy']),
+                'mean': mean,
+                'last': point.get('last', point['accuracy']),
+                'count': count
+            }
+            buckets[key] = bucket
+            compacted.append(bucket)
+            continue
+        total = bucket['count'] + count
+        bucket['mean'] = (bucket['mean'] * bucket['count'] + mean * count) / total
+        bucket['count'] = total
+        bucket['min'] = min(bucket['min'], point.get('min', point['accuracy']))
+        # Points are in time order, so the latest one defines last/accuracy/timestamp
+        bucket['last'] = point.get('last', point['accuracy'])
+        bucket['accuracy'] = bucket['last']
+        bucket['timestamp'] = point['timestamp']
+
+    compacted.sort(key=lambda p: p['timestamp'])
+    return compacted
+
+
+def compact_user(collection, user_doc: Dict[str, Any], now: datetime, raw_days: int, daily_days: int,
+                 dry_run: bool = False) -> Dict[str, int]:
+    """Compact every topic of one user with a single versioned update"""
+    stats = {'points_before': 0, 'points_after': 0, 'topics_compacted': 0, 'topics_skipped': 0}
+    update_set: Dict[str, Any] = {'historyCompactedAt': now}
+    array_filters = []
+    for topic in user_doc.get('topics', []):
+        history = topic.get('accuracyHistory') or []
+        if not all(isinstance(p.get('timestamp'), datetime) for p in history):
+            logging.warning(f"Skipping topic {topic.get('topicId')} of {user_doc['_id']}: accuracyHistory has points without a date timestamp")
+            stats['topics_skipped'] += 1
+        compacted = compact_history(history, now, raw_days, daily_days)
+        stats['points_before'] += len(history)
+        stats['points_after'] += len(compacted)
+        if len(compacted) == len(history):
+            continue
+        ident = f"t{len(array_filters)}"
+        update_set[f"topics.$[{ident}].accuracyHistory"] = compacted
+        array_filters.append({f"{ident}.topicId": topic['topicId']})
+        stats['topics_compacted'] += 1
+
+    if dry_run:
+        return stats
+
+    version = user_doc.get('version')
+    version_filter = {'$exists': False} if version is None else version
+    update: Dict[str, Any] = {'$set': update_set}
+    if array_filters:
+        # Rewriting accuracyHistory races with the worker's $push, so it must bump the version
+        update['$inc'] = {'version': 1}
+    result = collection.update_one(
+        {'_id': user_doc['_id'], 'version': version_filter},
+        update,
+        array_filters=array_filters or None
+    )
+    stats['conflict'] = 0 if result.matched_count else 1
+    return stats
+
+
+def run_compaction(db, raw_days: int, daily_days: int, min_interval: timedelta, batch_size: int,
+                   user_ids: List[ObjectId] = None, dry_run: bool = False) -> Dict[str, int]:
+    collection = db.usertopicperformances
+    now = datetime.utcnow()
+    query: Dict[str, Any]
+    if user_ids:
+        query = {'userId': {'$in': user_ids}}
+    else:
+        # Only users not compacted recently
+        query = {'$or': [
+            {'historyCompactedAt': {'$exists': False}},
+            {'historyCompactedAt': {'$lt': now - min_interval}}
+        ]}
+
+    totals = {'users': 0, 'points_before': 0, 'points_after': 0, 'topics_compacted': 0, 'topics_skipped': 0, 'conflicts': 0}
+    started = time.monotonic()
+    ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}).batch_size(batch_size)]
+    for doc_id in ids:
+        for _ in range(MAX_CONFLICT_RETRIES):
+            user_doc = collection.find_one({'_id': doc_id}, {'topics.topicId': 1, 'topics.accuracyHistory': 1, 'version': 1})
+            if not user_doc:
+                break
+            stats = compact_user(collection, user_doc, now, raw_days, daily_days, dry_run)
+            if not stats.get('conflict'):
+                totals['users'] += 1
+                totals['points_before'] += stats['points_before']
+                totals['points_after'] += stats['points_after']
+                totals['topics_compacted'] += stats['topics_compacted']
+                totals['topics_skipped'] += stats['topics_skipped']
+                break
+        else:
+            # The live worker keeps winning; the user stays due and is picked up next run
+            totals['conflicts'] += 1
+        if totals['users'] and totals['users'] % batch_size == 0:
+            logging.info(f"Compacted {totals['users']} users ({totals['users'] / (time.monotonic() - started):.1f} users/s)")
+
+    logging.info(
+        f"Compaction {'dry run ' if dry_run else ''}complete: users={totals['users']} "
+        f"points {totals['points_before']} -> {totals['points_after']} "
+        f"topics_compacted={totals['topics_compacted']} topics_skipped={totals['topics_skipped']} "
+        f"conflicts={totals['conflicts']}"
+    )
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Downsample UserTopicPerformance accuracy history into retention tiers')
+    parser.add_argument('--raw-days', type=int, default=int(os.getenv('ACCURACY_RAW_DAYS', DEFAULT_RAW_DAYS)),
+                        help='Keep every point newer than this many days')
+    parser.add_argument('--daily-days', type=int, default=int(os.getenv('ACCURACY_DAILY_DAYS', DEFAULT_DAILY_DAYS)),
+                        help='Keep one point per day up to this age; older points become weekly')
+    parser.add_argument('--min-interval-hours', type=float, default=24, help='Skip users compacted more recently than this')
+    parser.add_argument('--batch-size', type=int, default=100, help='Progress/log batch size')
+    parser.add_argument('--user-id', action='append', default=[], help='Compact only this user (repeatable)')
+    parser.add_argument('--loop', type=int, default=0, help='Run again every N seconds (0 = run once)')
+    parser.add_argument('--dry-run', action='store_true', help='Report the expected reduction without writing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.daily_days < args.raw_days:
+        parser.error('--daily-days must be >= --raw-days')
+
+    client = MongoClient(load_mongo_uri())
+    db = client.get_default_database()
+    db.usertopicperformances.create_index([('historyCompactedAt', 1)], name='historyCompactedAt')
+    user_ids = [ObjectId(value) for value in args.user_id]
+    try:
+        while True:
+            run_compaction(db, args.raw_days, args.daily_days, timedelta(hours=args.min_interval_hours),
+                           args.batch_size, user_ids, args.dry_run)
+            if not args.loop:
+                break
+            time.sleep(args.loop)
+    except KeyboardInterrupt:
+        logging.info("Interrupted, stopping compaction")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
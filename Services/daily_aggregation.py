@@ -2,34 +2,204 @@
 """
 Session Processing Service - Phase 3
 Continuous running script that processes UserLevelSessionTopicsLogs with status 1
-and creates UserChapterTopicsPerformanceLogs with exact timestamps
+and creates UserChapterTopicsPerformanceLogs with exact timestamps,
+keeping per-day rollups (per user chapter level and per topic) up to date
 """
 
 import os
+import json
 import time
+import hashlib
+import socket
 import logging
+import argparse
+import multiprocessing
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 from bson import ObjectId
 from dotenv import load_dotenv
 
+from work_waiter import WorkWaiter
+from metrics import REGISTRY, start_metrics_server, start_summary_logger
+
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('daily_aggregation.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def configure_logging():
+    """Log to daily_aggregation.log and stderr; only when run as the service, not when imported"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('daily_aggregation.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+# Session log statuses
+STATUS_NOT_READY = 0
+STATUS_PENDING = 1
+STATUS_DONE = 2
+STATUS_PROCESSING = 3
+STATUS_FAILED = -1
+
+# Lease defaults for claimed sessions
+DEFAULT_LEASE_SECONDS = 60
+DEFAULT_MAX_CLAIM_ATTEMPTS = 5
+
+# Queue statistics are recomputed at most once per TTL
+DEFAULT_STATS_TTL_SECONDS = 30
+STATUS_INDEX = [("status", ASCENDING), ("createdAt", ASCENDING)]
+
+# Unique index used to upsert performance logs by their idempotency key
+PERFORMANCE_KEY_INDEX = "performanceKey_unique"
+
+# Per-day rollup collections maintained alongside the performance logs
+LEVEL_ROLLUP_COLLECTION = "userchapterleveldailyrollups"
+TOPIC_ROLLUP_COLLECTION = "usertopicdailyrollups"
+# Attempts to re-apply a rollup update whose upsert lost a race for the first document of a day
+ROLLUP_CONFLICT_RETRIES = 5
+
+# Instrumentation
+STAGE_SECONDS = REGISTRY.histogram('session_stage_seconds', 'Time spent in each session processing stage')
+SESSION_SECONDS = REGISTRY.histogram('session_processing_seconds', 'Claim-to-done latency per session (batch time / batch size in batch mode)')
+BATCH_SECONDS = REGISTRY.histogram('session_batch_seconds', 'Claim-to-done time of a whole session batch')
+SESSIONS_PROCESSED = REGISTRY.counter('sessions_processed_total', 'Sessions turned into performance logs')
+SESSIONS_FAILED = REGISTRY.counter('sessions_failed_total', 'Sessions marked failed')
+QUEUE_LAG = REGISTRY.gauge('session_queue_lag_seconds', 'Age of the oldest session in the last claim')
+QUEUE_DEPTH = REGISTRY.gauge('session_queue_sessions', 'Session logs per status')
+OLDEST_PENDING = REGISTRY.gauge('session_oldest_pending_seconds', 'Age of the oldest pending session')
+
+def aggregate_session_data(sessions: List[Dict]) -> Dict[str, Any]:
+    """
+    Aggregate data from single session (topics should remain as exact set)
+    """
+    if not sessions:
+        return {"topics": [], "questionsAnswered": [], "totalSessions": 0}
+
+    # For single session, keep exact topic set
+    session = sessions[0]
+    topics = session.get('topics', [])
+
+    # Convert topics to ObjectId if they're strings
+    topic_ids = []
+    for topic in topics:
+        if isinstance(topic, str):
+            topic_ids.append(ObjectId(topic))
+        else:
+            topic_ids.append(topic)
+
+    # Collect all questions
+    questions = session.get('questionsAnswered', [])
+    if not isinstance(questions, list):
+        questions = []
+
+    return {
+        "topics": topic_ids,  # Exact topic set as ObjectIds
+        "questionsAnswered": questions,
+        "totalSessions": 1
+    }
+
+def performance_log_key(user_level_session_id, topic_ids: List) -> str:
+    """
+    Compact deterministic idempotency key of a performance log:
+    hash of the session id and the sorted topic set
+    """
+    topics = ",".join(sorted(str(topic_id) for topic_id in topic_ids))
+    return hashlib.blake2b(f"{user_level_session_id}|{topics}".encode(), digest_size=16).hexdigest()
+
+def build_performance_log_update(session: Dict):
+    """
+    Build the (filter, update, timestamp) triple used to upsert the performance log of a session
+    """
+    # Use actual session timestamp instead of day start
+    created_at = session.get('createdAt')
+    if isinstance(created_at, datetime):
+        session_timestamp = created_at
+    else:
+        session_timestamp = datetime.now()
+
+    user_chapter_level_id = session['userChapterLevelId']
+
+    # Aggregate data from single session
+    aggregated_data = aggregate_session_data([session])
+
+    # Upsert by the hashed key alone so the unique index serves the lookup
+    performance_key = performance_log_key(session['userLevelSessionId'], aggregated_data['topics'])
+    session_filter = {"performanceKey": performance_key}
+    session_update = {
+        "$set": {
+            "performanceKey": performance_key,
+            "userChapterLevelId": user_chapter_level_id,
+            "userLevelSessionId": session['userLevelSessionId'],
+            "date": session_timestamp,  # Store exact timestamp
+            "topics": aggregated_data['topics'],
+            "totalSessions": aggregated_data['totalSessions'],
+            "questionsAnswered": aggregated_data['questionsAnswered']
+        },
+        "$currentDate": {
+            "updatedAt": True
+        },
+        "$setOnInsert": {
+            "createdAt": datetime.now()
+        }
+    }
+    return session_filter, session_update, session_timestamp
+
+def count_correct_answers(questions: List) -> int:
+    """Count answered questions flagged as correct"""
+    return sum(1 for question in questions if isinstance(question, dict) and question.get('isCorrect') is True)
+
+def build_rollup_operations(performance_log: Dict) -> Dict[str, List[UpdateOne]]:
+    """
+    Build the per-day rollup upserts for one performance log, keyed by rollup collection.
+    Each rollup remembers the sessions it already counted: the filter excludes documents
+    that contain the session, so re-applying a session hits the unique index (duplicate key)
+    instead of counting it twice. A duplicate key can also mean two workers raced to create
+    the day's document; see SessionProcessingService._resolve_rollup_conflicts.
+    """
+    timestamp = performance_log['date']
+    day = datetime(timestamp.year, timestamp.month, timestamp.day)
+    session_id = performance_log['userLevelSessionId']
+    user_chapter_level_id = performance_log['userChapterLevelId']
+    questions = performance_log.get('questionsAnswered') or []
+    increments = {
+        "sessions": 1,
+        "questionsAnswered": len(questions),
+        "correct": count_correct_answers(questions)
+    }
+    
+    level_rollup = UpdateOne(
+        {"userChapterLevelId": user_chapter_level_id, "day": day, "sessionIds": {"$ne": session_id}},
+        {
+            "$inc": increments,
+            "$addToSet": {"sessionIds": session_id, "topics": {"$each": performance_log.get('topics') or []}},
+            "$currentDate": {"updatedAt": True}
+        },
+        upsert=True
+    )
+    topic_rollups = [
+        UpdateOne(
+            {"userChapterLevelId": user_chapter_level_id, "topicId": topic_id, "day": day, "sessionIds": {"$ne": session_id}},
+            {
+                "$inc": increments,
+                "$addToSet": {"sessionIds": session_id},
+                "$currentDate": {"updatedAt": True}
+            },
+            upsert=True
+        )
+        for topic_id in performance_log.get('topics') or []
+    ]
+    return {LEVEL_ROLLUP_COLLECTION: [level_rollup], TOPIC_ROLLUP_COLLECTION: topic_rollups}
+
 class SessionProcessingService:
-    def __init__(self):
+    def __init__(self, worker_id: str = None, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+                 max_claim_attempts: int = DEFAULT_MAX_CLAIM_ATTEMPTS,
+                 stats_ttl_seconds: int = DEFAULT_STATS_TTL_SECONDS):
         """Initialize the aggregation service with database connection"""
         self.mongo_uri = os.getenv('MONGO_URI')
         if not self.mongo_uri:
@@ -41,49 +211,318 @@ class SessionProcessingService:
         # Collections
         self.session_logs = self.db.userlevelsessiontopicslogs
         self.performance_logs = self.db.userchaptertopicsperformancelogs
+        self.level_rollups = self.db[LEVEL_ROLLUP_COLLECTION]
+        self.topic_rollups = self.db[TOPIC_ROLLUP_COLLECTION]
+        
+        # Lease settings - a claimed session belongs to this worker until leaseExpiresAt
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.max_claim_attempts = max_claim_attempts
+        
+        # Cached queue statistics snapshot
+        self.stats_ttl_seconds = stats_ttl_seconds
+        self._stats_cache = None
+        self._stats_cached_at = 0.0
         
-        # Log total documents at startup
-        total_session_logs = self.session_logs.count_documents({})
-        total_performance_logs = self.performance_logs.count_documents({})
+        self._ensure_indexes()
+        
+        # Log total documents at startup (collection metadata, no scan)
+        total_session_logs = self.session_logs.estimated_document_count()
+        total_performance_logs = self.performance_logs.estimated_document_count()
         
         logger.info(f"Session Processing Service initialized")
         logger.info(f"Total session logs: {total_session_logs}")
         logger.info(f"Total performance logs: {total_performance_logs}")
+        logger.info(f"Worker id: {self.worker_id} (lease: {self.lease_seconds}s)")
+    
+    def _ensure_indexes(self):
+        """
+        Create the session log indexes used for claiming and statistics.
+        The status index covers the status histogram and the oldest pending lookup.
+        """
+        self.session_logs.create_index(STATUS_INDEX, name="status_createdAt")
+        self.session_logs.create_index([("batchId", ASCENDING)], name="batchId", sparse=True)
+        self.session_logs.create_index(
+            [("status", ASCENDING), ("leaseExpiresAt", ASCENDING)],
+            name="status_leaseExpiresAt"
+        )
+        
+        # Logs written before the key existed are excluded until migrated (see migrate_performance_keys)
+        try:
+            self.performance_logs.create_index(
+                [("performanceKey", ASCENDING)],
+                name=PERFORMANCE_KEY_INDEX,
+                unique=True,
+                partialFilterExpression={"performanceKey": {"$exists": True}}
+            )
+        except OperationFailure as e:
+            raise RuntimeError(f"Cannot create unique performanceKey index: {e}")
+        index = self.performance_logs.index_information().get(PERFORMANCE_KEY_INDEX)
+        if not index or not index.get('unique'):
+            raise RuntimeError(f"Index {PERFORMANCE_KEY_INDEX} on {self.performance_logs.name} is missing or not unique")
+        
+        # One rollup document per user-chapter-level (and topic) per day
+        self.level_rollups.create_index(
+            [("userChapterLevelId", ASCENDING), ("day", ASCENDING)],
+            name="userChapterLevelId_day", unique=True
+        )
+        self.topic_rollups.create_index(
+            [("userChapterLevelId", ASCENDING), ("topicId", ASCENDING), ("day", ASCENDING)],
+            name="userChapterLevelId_topicId_day", unique=True
+        )
+        self.performance_logs.create_index([("date", ASCENDING)], name="date")
+    
+    def _apply_rollups(self, performance_logs: List[Dict]):
+        """Fold performance logs into the per-day rollups; sessions already counted are skipped"""
+        operations = {LEVEL_ROLLUP_COLLECTION: [], TOPIC_ROLLUP_COLLECTION: []}
+        for performance_log in performance_logs:
+            for collection_name, rollup_ops in build_rollup_operations(performance_log).items():
+                operations[collection_name].extend(rollup_ops)
+        
+        for collection_name, rollup_ops in operations.items():
+            if not rollup_ops:
+                continue
+            try:
+                self.db[collection_name].bulk_write(rollup_ops, ordered=False)
+            except BulkWriteError as bwe:
+                write_errors = bwe.details.get('writeErrors', [])
+                errors = [e for e in write_errors if e.get('code') != 11000]
+                if errors:
+                    raise RuntimeError(f"Rollup update failed on {collection_name}: {errors[0].get('errmsg')}")
+                self._resolve_rollup_conflicts(self.db[collection_name], [e['op'] for e in write_errors])
+    
+    def _resolve_rollup_conflicts(self, collection, ops: List[Dict]):
+        """
+        Settle rollup upserts that hit the unique index. Either the session was already counted
+        (skip), or another worker created the day's document first: the server does not retry
+        such an upsert because the sessionIds filter is not an equality, so it is re-applied here.
+        """
+        for op in ops:
+            session_id = op['q']['sessionIds']['$ne']
+            rollup_key = {field: value for field, value in op['q'].items() if field != 'sessionIds'}
+            for _ in range(ROLLUP_CONFLICT_RETRIES):
+                if collection.find_one({**rollup_key, "sessionIds": session_id}, {"_id": 1}):
+                    break
+                try:
+                    collection.update_one(op['q'], op['u'], upsert=True)
+                    break
+                except DuplicateKeyError:
+                    continue
+            else:
+                raise RuntimeError(f"Rollup update on {collection.name} kept conflicting for session {session_id}")
+    
+    def rerollup_days(self, date_from: datetime, date_to: datetime, batch_size: int = 1000) -> int:
+        """
+        Rebuild the rollups of days in [date_from, date_to) from the stored performance logs.
+        Returns number of performance logs folded in
+        """
+        day_filter = {"day": {"$gte": date_from, "$lt": date_to}}
+        deleted_levels = self.level_rollups.delete_many(day_filter).deleted_count
+        deleted_topics = self.topic_rollups.delete_many(day_filter).deleted_count
+        logger.info(f"Removed {deleted_levels} level rollups and {deleted_topics} topic rollups between {date_from} and {date_to}")
+        
+        folded = 0
+        batch = []
+        cursor = self.performance_logs.find(
+            {"date": {"$gte": date_from, "$lt": date_to}},
+            {"userChapterLevelId": 1, "userLevelSessionId": 1, "date": 1, "topics": 1, "questionsAnswered": 1}
+        ).batch_size(batch_size)
+        for performance_log in cursor:
+            batch.append(performance_log)
+            if len(batch) >= batch_size:
+                self._apply_rollups(batch)
+                folded += len(batch)
+                batch = []
+        if batch:
+            self._apply_rollups(batch)
+            folded += len(batch)
+        logger.info(f"Re-rolled up {folded} performance logs between {date_from} and {date_to}")
+        return folded
+    
+    def migrate_performance_keys(self, batch_size: int = 1000) -> Dict[str, int]:
+        """
+        Compute performanceKey for performance logs written before it existed.
+        Logs whose key collides with an existing log are duplicates and are left unkeyed and reported.
+        """
+        totals = {"migrated": 0, "duplicates": 0}
+        operations = []
+        
+        def flush():
+            if not operations:
+                return
+            try:
+                result = self.performance_logs.bulk_write(operations, ordered=False)
+                totals["migrated"] += result.modified_count
+            except BulkWriteError as bwe:
+                totals["migrated"] += bwe.details.get('nModified', 0)
+                for write_error in bwe.details.get('writeErrors', []):
+                    if write_error.get('code') != 11000:
+                        raise
+                    op = write_error['op']
+                    key = op['u']['$set']['performanceKey']
+                    # Only a duplicate if another log really holds the key; otherwise apply it again
+                    if self.performance_logs.find_one({"performanceKey": key, "_id": {"$ne": op['q']['_id']}}, {"_id": 1}):
+                        totals["duplicates"] += 1
+                        logger.warning(f"Duplicate performance log left unkeyed: {op['q']['_id']}")
+                    else:
+                        result = self.performance_logs.update_one(op['q'], op['u'])
+                        totals["migrated"] += result.modified_count
+            operations.clear()
+        
+        cursor = self.performance_logs.find(
+            {"performanceKey": {"$exists": False}},
+            {"_id": 1, "userLevelSessionId": 1, "topics": 1}
+        ).batch_size(batch_size)
+        for doc in cursor:
+            key = performance_log_key(doc.get('userLevelSessionId'), doc.get('topics') or [])
+            operations.append(UpdateOne({"_id": doc['_id']}, {"$set": {"performanceKey": key}}))
+            if len(operations) >= batch_size:
+                flush()
+        flush()
+        logger.info(f"Performance key migration complete: {totals}")
+        return totals
+    
+    def get_queue_stats(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        Return a snapshot of the session queue: status histogram, queue depth,
+        oldest pending age and failure count. Cached for stats_ttl_seconds.
+        """
+        if (not force_refresh and self._stats_cache is not None
+                and time.monotonic() - self._stats_cached_at < self.stats_ttl_seconds):
+            return self._stats_cache
+        
+        # Single covered scan of the status index instead of one count per status
+        by_status = {}
+        pipeline = [
+            {"$project": {"_id": 0, "status": 1}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]
+        for row in self.session_logs.aggregate(pipeline, hint="status_createdAt"):
+            by_status[row['_id']] = row['count']
+        
+        oldest_pending_age = None
+        oldest_pending = self.session_logs.find_one(
+            {"status": STATUS_PENDING},
+            {"_id": 0, "createdAt": 1},
+            sort=STATUS_INDEX
+        )
+        if oldest_pending and isinstance(oldest_pending.get('createdAt'), datetime):
+            oldest_pending_age = (datetime.utcnow() - oldest_pending['createdAt']).total_seconds()
+        
+        self._stats_cache = {
+            "generatedAt": datetime.utcnow().isoformat(),
+            "total": sum(by_status.values()),
+            "byStatus": {str(status): count for status, count in by_status.items()},
+            "queueDepth": by_status.get(STATUS_PENDING, 0),
+            "processing": by_status.get(STATUS_PROCESSING, 0),
+            "failed": by_status.get(STATUS_FAILED, 0),
+            "oldestPendingAgeSeconds": oldest_pending_age
+        }
+        self._stats_cached_at = time.monotonic()
+        
+        for status, count in by_status.items():
+            QUEUE_DEPTH.set(count, status=status)
+        if oldest_pending_age is not None:
+            OLDEST_PENDING.set(oldest_pending_age)
+        else:
+            OLDEST_PENDING.set(0)
+        return self._stats_cache
+    
+    def _lease_fields(self) -> Dict[str, Any]:
+        """Fields set on a session when this worker claims it"""
+        return {
+            "status": STATUS_PROCESSING,
+            "claimedBy": self.worker_id,
+            "leaseExpiresAt": datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+        }
+    
+    def _complete_sessions(self, session_ids: List[ObjectId]):
+        """Mark sessions claimed by this worker as done and release their lease"""
+        if not session_ids:
+            return
+        result = self.session_logs.update_many(
+            {"_id": {"$in": session_ids}, "status": STATUS_PROCESSING, "claimedBy": self.worker_id},
+            {
+                "$set": {"status": STATUS_DONE},
+                "$unset": {"claimedBy": "", "leaseExpiresAt": "", "batchId": ""}
+            }
+        )
+        if result.modified_count != len(session_ids):
+            # The lease expired and another worker re-claimed the session; its upsert is idempotent
+            logger.warning(f"Lost lease on {len(session_ids) - result.modified_count} of {len(session_ids)} sessions")
+    
+    def _fail_session(self, session_id: ObjectId, failure_reason: str):
+        """Mark a session claimed by this worker as failed"""
+        self.session_logs.update_one(
+            {"_id": session_id, "claimedBy": self.worker_id},
+            {
+                "$set": {"status": STATUS_FAILED, "failureReason": failure_reason},
+                "$unset": {"claimedBy": "", "leaseExpiresAt": "", "batchId": ""}
+            }
+        )
+    
+    def reap_expired_leases(self) -> int:
+        """
+        Re-queue sessions whose lease expired (the owning worker crashed or stalled).
+        Sessions that exhausted max_claim_attempts are marked failed instead.
+        Returns number of re-queued sessions
+        """
+        now = datetime.utcnow()
+        expired = {"status": STATUS_PROCESSING, "leaseExpiresAt": {"$lt": now}}
+        
+        poisoned = self.session_logs.update_many(
+            {**expired, "claimAttempts": {"$gte": self.max_claim_attempts}},
+            {
+                "$set": {
+                    "status": STATUS_FAILED,
+                    "failureReason": f"Lease expired {self.max_claim_attempts} times"
+                },
+                "$unset": {"claimedBy": "", "leaseExpiresAt": "", "batchId": ""}
+            }
+        )
+        if poisoned.modified_count:
+            logger.error(f"Marked {poisoned.modified_count} sessions failed after repeated lease expiry")
+        
+        requeued = self.session_logs.update_many(
+            expired,
+            {
+                "$set": {"status": STATUS_PENDING},
+                "$unset": {"claimedBy": "", "leaseExpiresAt": "", "batchId": ""}
+            }
+        )
+        if requeued.modified_count:
+            logger.warning(f"Re-queued {requeued.modified_count} sessions with expired leases")
+        return requeued.modified_count
     
     def process_completed_sessions(self) -> int:
         """
         Process one UserLevelSessionTopicsLogs with status 1 using atomic find and update
-        Returns number of processed documents (0 or 1)
+        Returns number of claimed documents (0 or 1), whether or not processing succeeded
         """
         try:
-            # Atomically find one session with status 1 and update to status 2
-            completed_session = self.session_logs.find_one_and_update(
-                {"status": 1},
-                {"$set": {"status": 2}},
-                return_document=True  # Return the updated document
-            )
+            started = time.monotonic()
+            # Atomically lease one session with status 1 (moves it to the processing state)
+            with STAGE_SECONDS.time(stage="claim"):
+                completed_session = self.session_logs.find_one_and_update(
+                    {"status": STATUS_PENDING},
+                    {"$set": self._lease_fields(), "$inc": {"claimAttempts": 1}},
+                    return_document=True  # Return the updated document
+                )
             
             if not completed_session:
-                # Check what sessions exist for debugging
-                total_sessions = self.session_logs.count_documents({})
-                status_0_count = self.session_logs.count_documents({"status": 0})
-                status_1_count = self.session_logs.count_documents({"status": 1})
-                status_2_count = self.session_logs.count_documents({"status": 2})
-                status_neg1_count = self.session_logs.count_documents({"status": -1})
-                
-                logger.info(f"No sessions with status 1 found. Current counts - Total: {total_sessions}, Status 0: {status_0_count}, Status 1: {status_1_count}, Status 2: {status_2_count}, Status -1: {status_neg1_count}")
-                
-                # Log recent failure reasons if there are failed sessions
-                if status_neg1_count > 0:
-                    self._log_recent_failures()
+                logger.debug("No sessions with status 1 found")
                 return 0
+            self._observe_queue_lag([completed_session])
             
             logger.info(f"Processing session: {completed_session['_id']}")
             
             try:
                 # Process single session and upsert to daily log
                 self._process_single_session(completed_session)
+                self._complete_sessions([completed_session['_id']])
                 
+                SESSIONS_PROCESSED.inc()
+                SESSION_SECONDS.observe(time.monotonic() - started)
                 logger.info(f"Successfully processed session: {completed_session['_id']}")
                 return 1
                 
@@ -91,14 +530,10 @@ class SessionProcessingService:
                 error_message = str(e)
                 logger.error(f"Error processing session {completed_session['_id']}: {error_message}")
                 # Set status to -1 with failure reason if processing failed
-                self.session_logs.update_one(
-                    {"_id": completed_session['_id']},
-                    {"$set": {
-                        "status": -1,
-                        "failureReason": f"Processing error: {error_message}"
-                    }}
-                )
-                return 0
+                self._fail_session(completed_session['_id'], f"Processing error: {error_message}")
+                SESSIONS_FAILED.inc()
+                # The queue was not empty: keep draining instead of sleeping
+                return 1
             
         except Exception as e:
             logger.error(f"Error in process_completed_sessions: {e}")
@@ -108,84 +543,129 @@ class SessionProcessingService:
         """
         Process a single session and create performance log with actual timestamp
         """
-        # Use actual session timestamp instead of day start
-        created_at = session.get('createdAt')
-        if isinstance(created_at, datetime):
-            session_timestamp = created_at
-        else:
-            session_timestamp = datetime.now()
-        
-        user_chapter_level_id = session['userChapterLevelId']
-        
-        # Aggregate data from single session
-        aggregated_data = self._aggregate_session_data([session])
+        with STAGE_SECONDS.time(stage="aggregate"):
+            session_filter, session_update, session_timestamp = self._build_performance_log_update(session)
         
         # Create new record with exact timestamp - allows multiple records per session at different times
-        result = self.performance_logs.find_one_and_update(
-            {
-                "userChapterLevelId": user_chapter_level_id,
-                "userLevelSessionId": session['userLevelSessionId'],
-                "topics": aggregated_data['topics'],
-                "date": session_timestamp  # Use exact timestamp
-            },
-            {
-                "$set": {
-                    "userChapterLevelId": user_chapter_level_id,
-                    "userLevelSessionId": session['userLevelSessionId'],
-                    "date": session_timestamp,  # Store exact timestamp
-                    "topics": aggregated_data['topics'],
-                    "totalSessions": aggregated_data['totalSessions'],
-                    "questionsAnswered": aggregated_data['questionsAnswered']
-                },
-                "$currentDate": {
-                    "updatedAt": True
-                },
-                "$setOnInsert": {
-                    "createdAt": datetime.now()
-                }
-            },
-            upsert=True,
-            return_document=True
-        )
+        with STAGE_SECONDS.time(stage="write"):
+            result = self.performance_logs.find_one_and_update(
+                session_filter,
+                session_update,
+                upsert=True,
+                return_document=True
+            )
         
         if result:
             logger.info(f"Upserted performance log for session timestamp {session_timestamp}: {result['_id']}")
         else:
             logger.error(f"Failed to upsert performance log for session timestamp {session_timestamp}")
+        
+        with STAGE_SECONDS.time(stage="rollup"):
+            self._apply_rollups([session_update['$set']])
     
-
+    def _build_performance_log_update(self, session: Dict):
+        """
+        Build the (filter, update, timestamp) triple used to upsert the performance log of a session
+        """
+        return build_performance_log_update(session)
+    
+    def _claim_session_batch(self, batch_size: int) -> List[Dict]:
+        """
+        Lease up to batch_size sessions with status 1 by tagging them with a unique batch id
+        Returns the claimed session documents
+        """
+        batch_id = ObjectId()
+        candidate_ids = [
+            doc['_id'] for doc in self.session_logs.find({"status": STATUS_PENDING}, {"_id": 1}).limit(batch_size)
+        ]
+        if not candidate_ids:
+            return []
+        
+        # Only sessions still in status 1 are claimed, so concurrent claimers never share a session
+        self.session_logs.update_many(
+            {"_id": {"$in": candidate_ids}, "status": STATUS_PENDING},
+            {"$set": {**self._lease_fields(), "batchId": batch_id}, "$inc": {"claimAttempts": 1}}
+        )
+        return list(self.session_logs.find({"batchId": batch_id}))
+    
+    def process_session_batch(self, batch_size: int) -> int:
+        """
+        Claim up to batch_size sessions with status 1 and upsert all their performance logs
+        with a single unordered bulk_write. Returns number of claimed sessions (failed ones included),
+        so the caller keeps draining a non-empty queue even when a whole batch fails
+        """
+        try:
+            started = time.monotonic()
+            with STAGE_SECONDS.time(stage="claim"):
+                sessions = self._claim_session_batch(batch_size)
+            if not sessions:
+                return 0
+            self._observe_queue_lag(sessions)
+            
+            operations = []
+            op_sessions = []
+            failed = {}
+            with STAGE_SECONDS.time(stage="aggregate"):
+                for session in sessions:
+                    try:
+                        session_filter, session_update, _ = self._build_performance_log_update(session)
+                    except Exception as e:
+                        failed[session['_id']] = f"Processing error: {e}"
+                        continue
+                    operations.append(UpdateOne(session_filter, session_update, upsert=True))
+                    op_sessions.append((session, session_update['$set']))
+            
+            if operations:
+                try:
+                    with STAGE_SECONDS.time(stage="write"):
+                        self.performance_logs.bulk_write(operations, ordered=False)
+                except BulkWriteError as bwe:
+                    for write_error in bwe.details.get('writeErrors', []):
+                        session, _ = op_sessions[write_error['index']]
+                        failed[session['_id']] = f"Processing error: {write_error.get('errmsg')}"
+                
+                # Rollups are idempotent per session, so a crash here only delays them until the lease is reaped
+                with STAGE_SECONDS.time(stage="rollup"):
+                    self._apply_rollups([
+                        performance_log for session, performance_log in op_sessions if session['_id'] not in failed
+                    ])
+            
+            for session_id, failure_reason in failed.items():
+                logger.error(f"Error processing session {session_id}: {failure_reason}")
+                self._fail_session(session_id, failure_reason)
+            self._complete_sessions([session['_id'] for session in sessions if session['_id'] not in failed])
+            
+            processed_count = len(sessions) - len(failed)
+            elapsed = time.monotonic() - started
+            SESSIONS_PROCESSED.inc(processed_count)
+            SESSIONS_FAILED.inc(len(failed))
+            BATCH_SECONDS.observe(elapsed)
+            for _ in range(processed_count):
+                SESSION_SECONDS.observe(elapsed / len(sessions))
+            rate = processed_count / elapsed if elapsed > 0 else float(processed_count)
+            logger.info(
+                f"Processed batch of {len(sessions)} sessions in {elapsed:.3f}s "
+                f"({rate:.1f} sessions/s) | success: {processed_count} | failed: {len(failed)}"
+            )
+            return len(sessions)
+            
+        except Exception as e:
+            logger.error(f"Error in process_session_batch: {e}")
+            return 0
+    
+    def _observe_queue_lag(self, sessions: List[Dict]):
+        """Publish how long the oldest of the claimed sessions waited in the queue"""
+        created = [s['createdAt'] for s in sessions if isinstance(s.get('createdAt'), datetime)]
+        if created:
+            QUEUE_LAG.set((datetime.utcnow() - min(created)).total_seconds())
     
     def _aggregate_session_data(self, sessions: List[Dict]) -> Dict[str, Any]:
         """
         Aggregate data from single session (topics should remain as exact set)
         """
-        if not sessions:
-            return {"topics": [], "questionsAnswered": [], "totalSessions": 0}
-        
-        # For single session, keep exact topic set
-        session = sessions[0]
-        topics = session.get('topics', [])
-        
-        # Convert topics to ObjectId if they're strings
-        topic_ids = []
-        for topic in topics:
-            if isinstance(topic, str):
-                topic_ids.append(ObjectId(topic))
-            else:
-                topic_ids.append(topic)
-        
-        # Collect all questions
-        questions = session.get('questionsAnswered', [])
-        if not isinstance(questions, list):
-            questions = []
-        
-        return {
-            "topics": topic_ids,  # Exact topic set as ObjectIds
-            "questionsAnswered": questions,
-            "totalSessions": 1
-        }
+        return aggregate_session_data(sessions)
     
-    def _log_recent_failures(self, limit: int = 5):
+    def log_recent_failures(self, limit: int = 5):
         """
         Log recent failed sessions with their failure reasons for debugging
         """
@@ -209,26 +689,57 @@ class SessionProcessingService:
             logger.error(f"Error logging recent failures: {e}")
 
     
-    def run_continuous(self, interval_seconds: int = 10):
+    def run_continuous(self, interval_seconds: int = 10, batch_size: int = 1, event_driven: bool = False,
+                       publish_queue_stats: bool = False):
         """
-        Run the aggregation service continuously
+        Run the aggregation service continuously.
+        With batch_size > 1, sessions are claimed and written in batches.
+        The service only sleeps when the queue is empty. With event_driven, an idle
+        service wakes on new status 1 sessions (change stream) or backs off
+        exponentially up to interval_seconds instead of sleeping a fixed interval.
+        With publish_queue_stats, the cached queue statistics feed the metrics gauges.
         """
-        logger.info(f"Starting continuous session processing service (interval: {interval_seconds}s)")
+        logger.info(f"Starting continuous session processing service (interval: {interval_seconds}s, batch size: {batch_size})")
+        
+        waiter = None
+        if event_driven:
+            waiter = WorkWaiter(self.session_logs, STATUS_PENDING, max_interval=interval_seconds)
+            logger.info(f"Event-driven wakeup enabled ({waiter.mode})")
         
+        last_reap = 0.0
         while True:
             try:
-                processed_count = self.process_completed_sessions()
+                # Periodically return sessions held by crashed workers to the queue
+                if time.monotonic() - last_reap >= self.lease_seconds / 2:
+                    self.reap_expired_leases()
+                    last_reap = time.monotonic()
                 
-                if processed_count > 0:
-                    logger.info(f"Processing cycle completed. Processed {processed_count} session.")
+                if publish_queue_stats:
+                    self.get_queue_stats()
+                
+                if batch_size > 1:
+                    processed_count = self.process_session_batch(batch_size)
                 else:
-                    logger.debug("No sessions to process in this cycle")
+                    processed_count = self.process_completed_sessions()
+                
+                if processed_count > 0:
+                    logger.info(f"Processing cycle completed. Handled {processed_count} session(s).")
+                    if waiter:
+                        waiter.reset()
+                    # Keep draining the queue without waiting
+                    continue
                 
+                logger.debug("No sessions to process in this cycle")
                 # Wait before next cycle
-                time.sleep(interval_seconds)
+                if waiter:
+                    waiter.wait()
+                else:
+                    time.sleep(interval_seconds)
                 
             except KeyboardInterrupt:
                 logger.info("Received interrupt signal. Shutting down...")
+                if waiter:
+                    waiter.close()
                 break
             except Exception as e:
                 logger.error(f"Unexpected error in continuous run: {e}")
@@ -241,20 +752,114 @@ class SessionProcessingService:
             self.client.close()
             logger.info("Database connection closed")
 
-def main():
-    """Main function to run the session processing service"""
+def run_worker(interval_seconds: int, batch_size: int, lease_seconds: int, event_driven: bool = False,
+               metrics_port: int = 0, metrics_summary_interval: int = 0):
+    """Run a single session processing worker until interrupted"""
+    # No-op when inherited from the parent; needed when worker processes are spawned
+    configure_logging()
     service = None
     try:
-        service = SessionProcessingService()
+        if metrics_port:
+            start_metrics_server(metrics_port)
+        if metrics_summary_interval:
+            start_summary_logger(metrics_summary_interval, summary_logger=logger)
         
-        # Run continuously with 5-second intervals
-        service.run_continuous(interval_seconds=5)
+        service = SessionProcessingService(lease_seconds=lease_seconds)
         
+        # Run continuously, sleeping only when the queue is empty
+        service.run_continuous(interval_seconds=interval_seconds, batch_size=batch_size, event_driven=event_driven,
+                               publish_queue_stats=bool(metrics_port or metrics_summary_interval))
+        
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         logger.error(f"Failed to start session processing service: {e}")
     finally:
         if service:
             service.close()
 
+def run_workers(workers: int, interval_seconds: int, batch_size: int, lease_seconds: int, event_driven: bool = False,
+                metrics_port: int = 0, metrics_summary_interval: int = 0):
+    """
+    Launch several worker processes sharing the queue through leases.
+    Each process opens its own MongoClient (clients are not fork-safe).
+    Worker i serves its metrics on metrics_port + i.
+    """
+    logger.info(f"Launching {workers} session processing workers")
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(interval_seconds, batch_size, lease_seconds, event_driven,
+                  metrics_port + i if metrics_port else 0, metrics_summary_interval),
+            name=f"session-worker-{i}"
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logger.info("Received interrupt signal. Waiting for workers to stop...")
+        for process in processes:
+            process.join()
+
+def main():
+    """Main function to run the session processing service"""
+    configure_logging()
+    parser = argparse.ArgumentParser(description='Process completed level sessions into performance logs')
+    parser.add_argument('--interval', type=int, default=5, help='Seconds to sleep when no sessions are pending (max wait with --event-driven)')
+    parser.add_argument('--batch-size', type=int, default=1, help='Sessions to claim and write per cycle (1 = one at a time)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes to run')
+    parser.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+                        help='Seconds a claimed session stays owned by a worker before it is re-queued')
+    parser.add_argument('--event-driven', action='store_true',
+                        help='Wake on new sessions via change stream, or adaptive backoff polling when unavailable')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics on this local port (worker i uses port + i)')
+    parser.add_argument('--metrics-summary-interval', type=int, default=0,
+                        help='Log a metrics summary every N seconds (0 = off)')
+    parser.add_argument('--stats', action='store_true', help='Print the queue statistics snapshot and recent failures, then exit')
+    parser.add_argument('--migrate-keys', action='store_true', help='Add performanceKey to existing performance logs, then exit')
+    parser.add_argument('--rerollup', nargs=2, metavar=('FROM', 'TO'),
+                        help='Rebuild daily rollups for days in [FROM, TO) (YYYY-MM-DD), then exit')
+    args = parser.parse_args()
+    
+    if args.rerollup:
+        service = SessionProcessingService()
+        try:
+            date_from, date_to = (datetime.strptime(value, '%Y-%m-%d') for value in args.rerollup)
+            service.rerollup_days(date_from, date_to)
+        finally:
+            service.close()
+        return
+    
+    if args.migrate_keys:
+        service = SessionProcessingService()
+        try:
+            service.migrate_performance_keys()
+        finally:
+            service.close()
+        return
+    
+    if args.stats:
+        service = SessionProcessingService()
+        try:
+            stats = service.get_queue_stats(force_refresh=True)
+            print(json.dumps(stats, indent=2))
+            if stats['failed'] > 0:
+                service.log_recent_failures()
+        finally:
+            service.close()
+        return
+    
+    if args.workers > 1:
+        run_workers(args.workers, args.interval, args.batch_size, args.lease_seconds, args.event_driven,
+                    args.metrics_port, args.metrics_summary_interval)
+    else:
+        run_worker(args.interval, args.batch_size, args.lease_seconds, args.event_driven,
+                   args.metrics_port, args.metrics_summary_interval)
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Performance Log Backfill
+Rebuilds UserChapterTopicsPerformanceLogs from processed UserLevelSessionTopicsLogs
+for a date range and/or a set of userChapterLevelIds.
+
+The source collection is streamed with a cursor in _id order and re-aggregated with the
+same code the live service uses. Work is split into _id key ranges that run in parallel,
+and each range checkpoints the last processed _id so an interrupted replay resumes where
+it stopped. --dry-run reports the expected diff without writing anything.
+Afterwards the daily rollups of the days the replayed sessions fall on are rebuilt
+(SessionProcessingService.rerollup_days), so the rollup views match the backfilled logs.
+"""
+
+import os
+import time
+import logging
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
+
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne, ASCENDING
+
+from daily_aggregation import build_performance_log_update, SessionProcessingService, STATUS_DONE
+
+logger = logging.getLogger("performance_backfill")
+
+CHECKPOINT_COLLECTION = 'performancebackfillcheckpoints'
+DEFAULT_BATCH_SIZE = 1000
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def build_source_query(date_from: Optional[datetime], date_to: Optional[datetime],
+                       user_chapter_level_ids: List[ObjectId], statuses: List[int]) -> Dict[str, Any]:
+    """Query selecting the session logs to replay (without the _id key range)"""
+    query: Dict[str, Any] = {"status": {"$in": statuses}}
+    if date_from or date_to:
+        query["createdAt"] = {}
+        if date_from:
+            query["createdAt"]["$gte"] = date_from
+        if date_to:
+            query["createdAt"]["$lt"] = date_to
+    if user_chapter_level_ids:
+        query["userChapterLevelId"] = {"$in": user_chapter_level_ids}
+    return query
+
+
+def split_key_ranges(db, date_from: Optional[datetime], date_to: Optional[datetime], parts: int) -> List[Dict[str, ObjectId]]:
+    """
+    Split the replay into contiguous _id ranges.
+    ObjectIds embed their creation time, so the time span between the first and last
+    session is cut into equal slices without scanning the collection.
+    """
+    session_logs = db.userlevelsessiontopicslogs
+    first = session_logs.find_one({}, {"_id": 1}, sort=[("_id", ASCENDING)])
+    last = session_logs.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    if not first or not last:
+        return []
+
+    # Session logs are written when the session ends, so createdAt never precedes the _id time by much
+    start = max(first['_id'].generation_time.replace(tzinfo=None), (date_from - timedelta(days=1)) if date_from else datetime.min)
+    end = last['_id'].generation_time.replace(tzinfo=None) + timedelta(seconds=1)
+    if date_to:
+        end = min(end, date_to + timedelta(days=1))
+    if end <= start:
+        return []
+
+    step = (end - start) / parts
+    ranges = []
+    for i in range(parts):
+        range_start = ObjectId.from_datetime(start + step * i) if i > 0 else None
+        range_end = ObjectId.from_datetime(start + step * (i + 1)) if i < parts - 1 else None
+        ranges.append({"start": range_start, "end": range_end})
+    return ranges
+
+
+def backfill_update(session: Dict[str, Any]) -> tuple:
+    """
+    The live service's upsert for a session. Without a createdAt the live service stamps the
+    current time; a replay keeps the stored date instead of moving it on every run.
+    """
+    session_filter, session_update, session_timestamp = build_performance_log_update(session)
+    if not isinstance(session.get('createdAt'), datetime):
+        session_update['$setOnInsert']['date'] = session_update['$set'].pop('date')
+    return session_filter, session_update, session_timestamp
+
+
+def merge_date_span(totals: Dict[str, Any], first: datetime, last: datetime):
+    """Widen the [firstDate, lastDate] span of performance log dates in totals"""
+    totals["firstDate"] = first if totals.get("firstDate") is None else min(totals["firstDate"], first)
+    totals["lastDate"] = last if totals.get("lastDate") is None else max(totals["lastDate"], last)
+
+
+def diff_batch(performance_logs, operations: List[tuple]) -> Dict[str, int]:
+    """Compare the (filter, update) upserts of a batch against the fields stored performance logs would get"""
+    keys = [session_filter['performanceKey'] for session_filter, _ in operations]
+    stored = {doc['performanceKey']: doc for doc in performance_logs.find({"performanceKey": {"$in": keys}})}
+
+    diff = {"insert": 0, "update": 0, "unchanged": 0}
+    for session_filter, session_update in operations:
+        existing = stored.get(session_filter['performanceKey'])
+        if existing is None:
+            diff["insert"] += 1
+            continue
+        new_fields = session_update['$set']
+        if any(existing.get(field) != value for field, value in new_fields.items()):
+            diff["update"] += 1
+        else:
+            diff["unchanged"] += 1
+    return diff
+
+
+def replay_range(job_id: str, range_index: int, key_range: Dict[str, ObjectId], query: Dict[str, Any],
+                 batch_size: int, dry_run: bool) -> Dict[str, Any]:
+    """Replay one _id key range, checkpointing after every flushed batch"""
+    client = MongoClient(os.getenv('MONGO_URI'))
+    db = client.projectx
+    checkpoints = db[CHECKPOINT_COLLECTION]
+    checkpoint_id = f"{job_id}:{range_index}"
+
+    totals = {"read": 0, "written": 0, "insert": 0, "update": 0, "unchanged": 0, "failed": 0, "undated": 0}
+    try:
+        checkpoint = None if dry_run else checkpoints.find_one({"_id": checkpoint_id})
+        if checkpoint and checkpoint.get('done'):
+            logger.info(f"[range {range_index}] already complete, skipping")
+            return checkpoint.get('totals', totals)
+        if checkpoint:
+            totals.update(checkpoint.get('totals', {}))
+            logger.info(f"[range {range_index}] resuming after {checkpoint.get('lastId')}")
+
+        id_filter: Dict[str, Any] = {}
+        last_id = checkpoint.get('lastId') if checkpoint else None
+        if last_id is not None:
+            id_filter["$gt"] = last_id
+        elif key_range["start"] is not None:
+            id_filter["$gte"] = key_range["start"]
+        if key_range["end"] is not None:
+            id_filter["$lt"] = key_range["end"]
+        range_query = dict(query)
+        if id_filter:
+            range_query["_id"] = id_filter
+
+        cursor = db.userlevelsessiontopicslogs.find(range_query).sort("_id", ASCENDING).batch_size(batch_size)
+        operations = []
+        batch_last_id = None
+        started = time.monotonic()
+
+        def flush():
+            if not operations:
+                return
+            if dry_run:
+                for key, value in diff_batch(db.userchaptertopicsperformancelogs, operations).items():
+                    totals[key] += value
+            else:
+                result = db.userchaptertopicsperformancelogs.bulk_write(
+                    [UpdateOne(session_filter, session_update, upsert=True) for session_filter, session_update in operations],
+                    ordered=False
+                )
+                totals["written"] += result.upserted_count + result.modified_count
+                totals["insert"] += result.upserted_count
+                totals["update"] += result.modified_count
+                totals["unchanged"] += result.matched_count - result.modified_count
+                checkpoints.update_one(
+                    {"_id": checkpoint_id},
+                    {
+                        "$set": {"jobId": job_id, "rangeIndex": range_index, "lastId": batch_last_id,
+                                 "totals": totals, "done": False},
+                        "$currentDate": {"updatedAt": True}
+                    },
+                    upsert=True
+                )
+            elapsed = time.monotonic() - started
+            logger.info(f"[range {range_index}] read={totals['read']} ({totals['read'] / max(elapsed, 1e-6):.0f} docs/s) "
+                        f"insert={totals['insert']} update={totals['update']} unchanged={totals['unchanged']}")
+            operations.clear()
+
+        for session in cursor:
+            totals["read"] += 1
+            batch_last_id = session['_id']
+            try:
+                session_filter, session_update, session_timestamp = backfill_update(session)
+            except Exception as e:
+                totals["failed"] += 1
+                logger.error(f"[range {range_index}] cannot aggregate session {session['_id']}: {e}")
+                continue
+            if isinstance(session.get('createdAt'), datetime):
+                merge_date_span(totals, session_timestamp, session_timestamp)
+            else:
+                totals["undated"] += 1
+            operations.append((session_filter, session_update))
+            if len(operations) >= batch_size:
+                flush()
+        flush()
+
+        if not dry_run:
+            checkpoints.update_one(
+                {"_id": checkpoint_id},
+                {"$set": {"jobId": job_id, "rangeIndex": range_index, "totals": totals, "done": True},
+                 "$currentDate": {"updatedAt": True}},
+                upsert=True
+            )
+        return totals
+    finally:
+        client.close()
+
+
+def _replay_range_star(args):
+    return replay_range(*args)
+
+
+def run_backfill(job_id: str, date_from: Optional[datetime], date_to: Optional[datetime],
+                 user_chapter_level_ids: List[ObjectId], statuses: List[int], workers: int,
+                 batch_size: int, dry_run: bool, restart: bool) -> Dict[str, Any]:
+    client = MongoClient(os.getenv('MONGO_URI'))
+    db = client.projectx
+    try:
+        checkpoints = db[CHECKPOINT_COLLECTION]
+        if restart and not dry_run:
+            removed = checkpoints.delete_many({"jobId": job_id}).deleted_count
+            logger.info(f"Cleared {removed} checkpoints for job {job_id}")
+
+        # Reuse the range layout of an interrupted run so checkpoints stay valid
+        stored_job = checkpoints.find_one({"_id": f"{job_id}:layout"})
+        if stored_job and not dry_run:
+            key_ranges = stored_job['ranges']
+            logger.info(f"Resuming job {job_id} with {len(key_ranges)} key ranges")
+        else:
+            key_ranges = split_key_ranges(db, date_from, date_to, workers)
+            if not dry_run:
+                checkpoints.replace_one(
+                    {"_id": f"{job_id}:layout"},
+                    {"_id": f"{job_id}:layout", "jobId": job_id, "ranges": key_ranges, "createdAt": datetime.utcnow()},
+                    upsert=True
+                )
+    finally:
+        client.close()
+
+    if not key_ranges:
+        logger.info("No session logs to replay")
+        return {}
+
+    query = build_source_query(date_from, date_to, user_chapter_level_ids, statuses)
+    tasks = [(job_id, i, key_range, query, batch_size, dry_run) for i, key_range in enumerate(key_ranges)]
+
+    started = time.monotonic()
+    if len(tasks) > 1:
+        with multiprocessing.Pool(processes=min(workers, len(tasks))) as pool:
+            results = pool.map(_replay_range_star, tasks)
+    else:
+        results = [_replay_range_star(tasks[0])]
+
+    summary: Dict[str, Any] = {}
+    for result in results:
+        for key, value in result.items():
+            if key not in ("firstDate", "lastDate"):
+                summary[key] = summary.get(key, 0) + value
+        if result.get("firstDate") is not None:
+            merge_date_span(summary, result["firstDate"], result["lastDate"])
+    elapsed = time.monotonic() - started
+    logger.info(f"Backfill {'dry run ' if dry_run else ''}finished in {elapsed:.1f}s: {summary}")
+
+    # Undated sessions keep their stored date, or are inserted with today's
+    spans = []
+    if summary.get("firstDate") is not None:
+        first, last = summary["firstDate"], summary["lastDate"]
+        spans.append((datetime(first.year, first.month, first.day), datetime(last.year, last.month, last.day) + timedelta(days=1)))
+    if summary.get("undated"):
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        spans.append((today, today + timedelta(days=1)))
+    for rollup_from, rollup_to in spans:
+        if dry_run:
+            logger.info(f"Would rebuild the daily rollups between {rollup_from.date()} and {rollup_to.date()}")
+            continue
+        service = SessionProcessingService()
+        try:
+            service.rerollup_days(rollup_from, rollup_to, batch_size)
+        finally:
+            service.close()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild performance logs from processed session logs')
+    parser.add_argument('--from', dest='date_from', type=parse_date, help='Replay sessions created on/after this date (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='date_to', type=parse_date, help='Replay sessions created before this date (YYYY-MM-DD)')
+    parser.add_argument('--user-chapter-level-id', dest='user_chapter_level_ids', action='append', default=[],
+                        help='Restrict to this userChapterLevelId (repeatable)')
+    parser.add_argument('--status', dest='statuses', type=int, action='append',
+                        help=f'Session statuses to replay (repeatable, default {STATUS_DONE})')
+    parser.add_argument('--workers', type=int, default=1, help='Parallel key ranges')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Upserts per bulk write')
+    parser.add_argument('--job-id', default=None, help='Checkpoint name; rerun with the same id to resume')
+    parser.add_argument('--restart', action='store_true', help='Ignore existing checkpoints for this job')
+    parser.add_argument('--dry-run', action='store_true', help='Report the expected diff without writing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(processName)s %(message)s')
+    user_chapter_level_ids = [ObjectId(value) for value in args.user_chapter_level_ids]
+    statuses = args.statuses or [STATUS_DONE]
+    # Every filter is part of the default id: a run with other filters must not resume these checkpoints
+    job_id = args.job_id or "backfill:{}:{}:{}:{}".format(
+        args.date_from.date() if args.date_from else 'start',
+        args.date_to.date() if args.date_to else 'end',
+        ','.join(sorted(args.user_chapter_level_ids)) or 'all',
+        ','.join(str(status) for status in sorted(set(statuses)))
+    )
+    logger.info(f"Starting backfill job {job_id}")
+
+    run_backfill(job_id, args.date_from, args.date_to, user_chapter_level_ids, statuses,
+                 max(1, args.workers), args.batch_size, args.dry_run, args.restart)
+
+
+if __name__ == '__main__':
+    main()
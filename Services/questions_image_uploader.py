@@ -3,19 +3,31 @@
 Questions Image Uploader Script
 Processes questions for a given chapterId, extracts images from HTML content,
 uploads them to Google Cloud Storage, and updates question documents.
+Images are stored content-addressed (images/<sha256><ext>), so a diagram shared by many
+questions is stored once; source URLs are cached with their ETag/Last-Modified so reruns
+only revalidate them.
 """
 
 import os
 import sys
 import re
 import json
+import time
+import random
+import hashlib
 import argparse
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime
 from typing import List, Dict, Tuple, Optional
 from urllib.parse import urlparse, urlunparse
 from io import BytesIO
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 from pymongo import MongoClient
 from bson import ObjectId
@@ -23,6 +35,8 @@ from dotenv import load_dotenv
 from google.cloud import storage
 from google.cloud.exceptions import GoogleCloudError
 
+from metrics import REGISTRY, start_metrics_server, start_summary_logger
+
 # Load environment variables from Services/.env
 env_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(env_path)
@@ -37,9 +51,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Instrumentation
+STAGE_SECONDS = REGISTRY.histogram('image_stage_seconds', 'Time spent in each image processing stage')
+QUESTION_SECONDS = REGISTRY.histogram('image_question_seconds', 'Processing time per question')
+IMAGE_BYTES = REGISTRY.counter('image_bytes_total', 'Image bytes transferred')
+IMAGES_PROCESSED = REGISTRY.counter('images_processed_total', 'Images downloaded and uploaded')
+QUESTIONS_PROCESSED = REGISTRY.counter('image_questions_total', 'Questions processed by outcome')
+IMAGE_CACHE = REGISTRY.counter('image_source_cache_total', 'Source URL lookups by outcome (not_modified, run, changed, miss)')
+IMAGES_DEDUPLICATED = REGISTRY.counter('images_deduplicated_total', 'Uploads skipped because the content was already stored')
+UPLOAD_RETRIES = REGISTRY.counter('image_upload_retries_total', 'GCS uploads retried after a transient error')
+QUESTIONS_IN_FLIGHT = REGISTRY.gauge('image_questions_in_flight', 'Questions with images still downloading or uploading')
+
+DEFAULT_DOWNLOAD_WORKERS = 16
+DEFAULT_UPLOAD_WORKERS = 8
+# Concurrent downloads per source host, so one slow CDN cannot take every download worker
+DEFAULT_PER_HOST_LIMIT = 4
+DEFAULT_RETRIES = 4
+RETRY_BACKOFF_SECONDS = 0.5
+# HTTP statuses worth retrying (downloads and GCS uploads)
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+# Images are stored content-addressed as <prefix>/<sha256><ext>, shared by every question and chapter
+IMAGE_OBJECT_PREFIX = 'images'
+# Source URL -> stored object, with the validators (ETag / Last-Modified) of the downloaded version
+SOURCE_CACHE_COLLECTION = 'imagesourcecache'
+
 
 class QuestionsImageUploader:
-    def __init__(self):
+    def __init__(self, http_pool_size: int = DEFAULT_DOWNLOAD_WORKERS, per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+                 retries: int = DEFAULT_RETRIES, use_source_cache: bool = True):
         """Initialize the uploader with MongoDB and GCS connections"""
         # MongoDB setup
         self.mongo_uri = os.getenv('MONGO_URI')
@@ -49,6 +88,8 @@ class QuestionsImageUploader:
         self.client = MongoClient(self.mongo_uri)
         self.db = self.client.projectx
         self.questions_collection = self.db.questions
+        self.source_cache = self.db[SOURCE_CACHE_COLLECTION]
+        self.use_source_cache = use_source_cache
         
         # GCS setup
         bucket_name = os.getenv('GCP_BUCKET_NAME', 'quesimage')
@@ -114,6 +155,27 @@ class QuestionsImageUploader:
         
         self.bucket = self.storage_client.bucket(self.bucket_name)
         
+        # HTTP setup: one keep-alive connection pool shared by all downloads, transient errors retried with backoff
+        self.retries = retries
+        self.http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=http_pool_size,
+            pool_maxsize=http_pool_size,
+            max_retries=Retry(total=retries, backoff_factor=RETRY_BACKOFF_SECONDS, status_forcelist=RETRY_STATUSES,
+                              allowed_methods=['GET'], respect_retry_after_header=True)
+        )
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+        self.per_host_limit = per_host_limit
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._host_slots_lock = threading.Lock()
+        # Objects known to exist in the bucket and source URLs already resolved during this run
+        self._stored_objects: Dict[str, threading.Event] = {}
+        self._resolved_sources: Dict[str, str] = {}
+        self._pending_sources: Dict[str, Dict] = {}
+        self._url_locks: Dict[str, threading.Lock] = {}
+        self._dedup_lock = threading.Lock()
+        
         logger.info(f"Initialized QuestionsImageUploader")
         logger.info(f"MongoDB URI: {self.mongo_uri[:20]}...")
         logger.info(f"GCS Bucket: {self.bucket_name}")
@@ -163,29 +225,63 @@ class QuestionsImageUploader:
                 images.append({
                     'tag': img_tag,
                     'src': src,
+                    'src_ori': img_tag.get('src_ori'),
                     'original_tag': str(img_tag)
                 })
         
         return images
     
-    def download_image(self, url: str) -> Tuple[bytes, Optional[str]]:
-        """Download image from URL and return bytes and content type"""
+    def host_slot(self, url: str) -> threading.BoundedSemaphore:
+        """Semaphore limiting concurrent downloads from the URL's host"""
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_slots[host]
+    
+    def url_lock(self, url: str) -> threading.Lock:
+        """Lock per source URL, so an image shared by many questions is fetched once per run"""
+        with self._dedup_lock:
+            if url not in self._url_locks:
+                self._url_locks[url] = threading.Lock()
+            return self._url_locks[url]
+    
+    def download_image(self, url: str, cache_entry: Optional[Dict] = None) -> Dict:
+        """
+        Download image from URL: returns data, content_type and the response validators. With a cache
+        entry the request is conditional and an unchanged image returns {'not_modified': True} without a body.
+        """
+        headers = {}
+        if cache_entry and cache_entry.get('etag'):
+            headers['If-None-Match'] = cache_entry['etag']
+        if cache_entry and cache_entry.get('lastModified'):
+            headers['If-Modified-Since'] = cache_entry['lastModified']
         try:
-            response = requests.get(url, timeout=30, stream=True)
-            response.raise_for_status()
-            
-            content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
-            image_data = response.content
+            with self.host_slot(url), STAGE_SECONDS.time(stage='download'):
+                response = self.http.get(url, timeout=30, headers=headers)
+                if response.status_code == 304 and headers:
+                    return {'not_modified': True}
+                response.raise_for_status()
+                
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+                image_data = response.content
+            IMAGE_BYTES.inc(len(image_data), direction='download')
             
             logger.debug(f"Downloaded image from {url[:50]}... ({len(image_data)} bytes)")
-            return image_data, content_type
+            return {
+                'data': image_data,
+                'content_type': content_type,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
         
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to download image from {url}: {str(e)}")
             raise
     
-    def upload_to_gcs(self, image_data: bytes, destination_path: str, content_type: Optional[str] = None) -> str:
-        """Upload image to GCS and return public URL"""
+    def upload_to_gcs(self, image_data: bytes, destination_path: str, content_type: Optional[str] = None,
+                      if_generation_match: Optional[int] = None) -> str:
+        """Upload image to GCS and return public URL (if_generation_match=0: only create, never overwrite)"""
         try:
             # Determine content type from extension if not provided
             if not content_type:
@@ -200,13 +296,32 @@ class QuestionsImageUploader:
                 }
                 content_type = ext_to_mime.get(ext, 'image/png')
             
+            public_url = f"https://storage.googleapis.com/{self.bucket_name}/{destination_path}"
+            preconditions = {} if if_generation_match is None else {'if_generation_match': if_generation_match}
             blob = self.bucket.blob(destination_path)
-            blob.upload_from_string(image_data, content_type=content_type)
+            for attempt in range(self.retries + 1):
+                try:
+                    with STAGE_SECONDS.time(stage='upload'):
+                        blob.upload_from_string(image_data, content_type=content_type, **preconditions)
+                    break
+                except (GoogleCloudError, requests.exceptions.ConnectionError) as e:
+                    if if_generation_match == 0 and getattr(e, 'code', None) == 412:
+                        # Created concurrently (or by an earlier, retried attempt): same content by construction
+                        IMAGES_DEDUPLICATED.inc()
+                        return public_url
+                    transient = isinstance(e, requests.exceptions.ConnectionError) or getattr(e, 'code', None) in RETRY_STATUSES
+                    if not transient or attempt == self.retries:
+                        raise
+                    delay = RETRY_BACKOFF_SECONDS * 2 ** attempt * (1 + random.random())
+                    UPLOAD_RETRIES.inc()
+                    logger.warning(f"Upload of {destination_path} failed ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+            IMAGE_BYTES.inc(len(image_data), direction='upload')
+            IMAGES_PROCESSED.inc()
             
             # Make blob publicly readable (if bucket has uniform bucket-level access, this may not be needed)
             # blob.make_public()
             
-            public_url = f"https://storage.googleapis.com/{self.bucket_name}/{destination_path}"
             logger.debug(f"Uploaded to GCS: {destination_path}")
             return public_url
         
@@ -229,168 +344,298 @@ class QuestionsImageUploader:
             original_src = img_tag.get('src', '')
             if original_src in replacement_map:
                 rep = replacement_map[original_src]
-                # Set src_ori to original URL
-                img_tag['src_ori'] = original_src
+                # Set src_ori to original URL (kept from the first run when reprocessing)
+                if not img_tag.get('src_ori'):
+                    img_tag['src_ori'] = original_src
                 # Set new src to GCS URL
                 img_tag['src'] = rep['new_url']
         
         return str(soup)
     
+    def collect_image_jobs(self, question: Dict) -> List[Dict]:
+        """
+        One job per image of the question text, options and solution. 'src' is the attribute to
+        replace, 'source' the URL to fetch: the original one (src_ori) on reprocessed questions.
+        """
+        jobs = []
+        if question.get('ques'):
+            for idx, img_info in enumerate(self.extract_images_from_html(question['ques'])):
+                jobs.append({'field': 'ques', 'option_index': None, 'src': img_info['src'],
+                             'source': img_info['src_ori'] or img_info['src'], 'label': f"ques image {idx}"})
+        for opt_idx, option_html in enumerate(question.get('options') or []):
+            if option_html:
+                for img_idx, img_info in enumerate(self.extract_images_from_html(option_html)):
+                    jobs.append({'field': 'options', 'option_index': opt_idx, 'src': img_info['src'],
+                                 'source': img_info['src_ori'] or img_info['src'], 'label': f"option {opt_idx} image {img_idx}"})
+        if question.get('solution'):
+            for idx, img_info in enumerate(self.extract_images_from_html(question['solution'])):
+                jobs.append({'field': 'solution', 'option_index': None, 'src': img_info['src'],
+                             'source': img_info['src_ori'] or img_info['src'], 'label': f"solution image {idx}"})
+        return jobs
+    
+    def fetch_image(self, source: str) -> Dict:
+        """
+        Download stage: resolve a source URL to either a stored object ({'object_url'}), when it was
+        already resolved in this run or the cached version is still current (conditional GET, 304),
+        or to downloaded bytes with their sha256 for the upload stage.
+        """
+        with self.url_lock(source):
+            if source in self._resolved_sources:
+                IMAGE_CACHE.inc(outcome='run')
+                return {'object_url': self._resolved_sources[source]}
+            if source in self._pending_sources:
+                # Downloaded for another question and not stored yet: its upload is deduplicated
+                IMAGE_CACHE.inc(outcome='run')
+                return self._pending_sources[source]
+            cache_entry = self.source_cache.find_one({'_id': source}) if self.use_source_cache else None
+            fetched = self.download_image(source, cache_entry)
+            if fetched.get('not_modified'):
+                IMAGE_CACHE.inc(outcome='not_modified')
+                self.source_cache.update_one({'_id': source}, {'$set': {'checkedAt': datetime.utcnow()}})
+                self._resolved_sources[source] = cache_entry['objectUrl']
+                return {'object_url': cache_entry['objectUrl']}
+            IMAGE_CACHE.inc(outcome='changed' if cache_entry else 'miss')
+            fetched['sha256'] = hashlib.sha256(fetched['data']).hexdigest()
+            self._pending_sources[source] = fetched
+            return fetched
+    
+    def store_object(self, object_name: str, image_data: bytes, content_type: Optional[str]) -> str:
+        """Upload content-addressed bytes unless the object already exists; concurrent stores of one object upload once"""
+        public_url = f"https://storage.googleapis.com/{self.bucket_name}/{object_name}"
+        while True:
+            with self._dedup_lock:
+                event = self._stored_objects.get(object_name)
+                owner = event is None
+                if owner:
+                    event = self._stored_objects[object_name] = threading.Event()
+            if not owner:
+                event.wait()
+                with self._dedup_lock:
+                    if self._stored_objects.get(object_name) is event:
+                        IMAGES_DEDUPLICATED.inc()
+                        return public_url
+                # The owner failed: try again ourselves
+                continue
+            try:
+                with STAGE_SECONDS.time(stage='exists'):
+                    exists = self.bucket.blob(object_name).exists()
+                if exists:
+                    IMAGES_DEDUPLICATED.inc()
+                else:
+                    self.upload_to_gcs(image_data, object_name, content_type, if_generation_match=0)
+            except Exception:
+                with self._dedup_lock:
+                    del self._stored_objects[object_name]
+                raise
+            finally:
+                event.set()
+            return public_url
+    
+    def store_image(self, job: Dict, fetched: Dict) -> str:
+        """Upload stage: store a fetched image as <prefix>/<sha256><ext> and remember its source; returns the public URL"""
+        if 'object_url' in fetched:
+            return fetched['object_url']
+        ext = self.get_file_extension(job['source'], fetched['content_type'])
+        object_name = f"{IMAGE_OBJECT_PREFIX}/{fetched['sha256']}{ext}"
+        try:
+            public_url = self.store_object(object_name, fetched['data'], fetched['content_type'])
+        except Exception:
+            # Drop the bytes; a later question with this source downloads it again
+            self._pending_sources.pop(job['source'], None)
+            raise
+        now = datetime.utcnow()
+        self.source_cache.update_one(
+            {'_id': job['source']},
+            {'$set': {'objectName': object_name, 'objectUrl': public_url, 'sha256': fetched['sha256'],
+                      'etag': fetched['etag'], 'lastModified': fetched['last_modified'],
+                      'contentType': fetched['content_type'], 'size': len(fetched['data']),
+                      'checkedAt': now, 'updatedAt': now}},
+            upsert=True
+        )
+        self._resolved_sources[job['source']] = public_url
+        self._pending_sources.pop(job['source'], None)
+        logger.info(f"  Processed {job['label']}: {object_name}")
+        return public_url
+    
+    def build_update_fields(self, question: Dict, results: List[Tuple[Dict, str]]) -> Dict:
+        """Rewrite the HTML of every field that had images; results are (job, new_url) pairs"""
+        replacements = {}
+        for job, new_url in results:
+            replacements.setdefault((job['field'], job['option_index']), []).append({
+                'original_src': job['src'],
+                'new_url': new_url
+            })
+        
+        update_fields = {}
+        for field in ('ques', 'solution'):
+            if (field, None) in replacements:
+                update_fields[field] = self.update_html_with_new_urls(question[field], replacements[(field, None)])
+        
+        options = question.get('options') or []
+        updated_options = [
+            self.update_html_with_new_urls(option_html, replacements[('options', opt_idx)])
+            if ('options', opt_idx) in replacements else option_html
+            for opt_idx, option_html in enumerate(options)
+        ]
+        # Only update options if we modified any
+        if any(opt != orig for opt, orig in zip(updated_options, options)):
+            update_fields['options'] = updated_options
+        return update_fields
+    
+    def save_question(self, question: Dict, update_fields: Dict, has_images: bool):
+        """Write the rewritten fields and mark the question processed"""
+        question_id = str(question['_id'])
+        update_fields['imageStoring'] = True
+        with STAGE_SECONDS.time(stage='mongo_update'):
+            self.questions_collection.update_one(
+                {'_id': question['_id']},
+                {'$set': update_fields}
+            )
+        
+        if has_images:
+            logger.info(f"Successfully updated question {question_id} with {len(update_fields) - 1} field(s) modified")
+        else:
+            logger.info(f"Question {question_id} has no images, marked as processed")
+    
+    def mark_failed(self, question: Dict):
+        self.questions_collection.update_one(
+            {'_id': question['_id']},
+            {'$set': {'imageStoring': False}}
+        )
+    
     def process_question(self, question: Dict, chapter_id: str) -> bool:
         """Process a single question: extract, download, upload images, and update document"""
         question_id = str(question['_id'])
         logger.info(f"Processing question {question_id}")
         
         try:
-            update_fields = {}
-            has_images = False
-            
-            # Process question images
-            if question.get('ques'):
-                ques_images = self.extract_images_from_html(question['ques'])
-                if ques_images:
-                    has_images = True
-                    ques_replacements = []
-                    for idx, img_info in enumerate(ques_images):
-                        try:
-                            # Download image
-                            image_data, content_type = self.download_image(img_info['src'])
-                            
-                            # Determine extension
-                            ext = self.get_file_extension(img_info['src'], content_type)
-                            
-                            # Create destination path
-                            destination_path = f"{chapter_id}/{question_id}_ques_{idx}{ext}"
-                            
-                            # Upload to GCS
-                            public_url = self.upload_to_gcs(image_data, destination_path, content_type)
-                            
-                            ques_replacements.append({
-                                'original_src': img_info['src'],
-                                'new_url': public_url
-                            })
-                            
-                            logger.info(f"  Processed ques image {idx}: {destination_path}")
-                        
-                        except Exception as e:
-                            logger.error(f"  Failed to process ques image {idx}: {str(e)}")
-                            return False
-                    
-                    # Update ques HTML
-                    if ques_replacements:
-                        updated_ques = self.update_html_with_new_urls(question['ques'], ques_replacements)
-                        update_fields['ques'] = updated_ques
-            
-            # Process option images
-            if question.get('options'):
-                options = question['options']
-                updated_options = []
-                for opt_idx, option_html in enumerate(options):
-                    if option_html:
-                        opt_images = self.extract_images_from_html(option_html)
-                        if opt_images:
-                            has_images = True
-                            opt_replacements = []
-                            for img_idx, img_info in enumerate(opt_images):
-                                try:
-                                    # Download image
-                                    image_data, content_type = self.download_image(img_info['src'])
-                                    
-                                    # Determine extension
-                                    ext = self.get_file_extension(img_info['src'], content_type)
-                                    
-                                    # Create destination path
-                                    destination_path = f"{chapter_id}/{question_id}_option{opt_idx}_{img_idx}{ext}"
-                                    
-                                    # Upload to GCS
-                                    public_url = self.upload_to_gcs(image_data, destination_path, content_type)
-                                    
-                                    opt_replacements.append({
-                                        'original_src': img_info['src'],
-                                        'new_url': public_url
-                                    })
-                                    
-                                    logger.info(f"  Processed option {opt_idx} image {img_idx}: {destination_path}")
-                                
-                                except Exception as e:
-                                    logger.error(f"  Failed to process option {opt_idx} image {img_idx}: {str(e)}")
-                                    return False
-                            
-                            # Update option HTML
-                            if opt_replacements:
-                                updated_option = self.update_html_with_new_urls(option_html, opt_replacements)
-                                updated_options.append(updated_option)
-                            else:
-                                updated_options.append(option_html)
-                        else:
-                            updated_options.append(option_html)
-                    else:
-                        updated_options.append(option_html)
-                
-                # Only update options if we modified any
-                if any(opt != orig for opt, orig in zip(updated_options, question.get('options', []))):
-                    update_fields['options'] = updated_options
-            
-            # Process solution images
-            if question.get('solution'):
-                solution_images = self.extract_images_from_html(question['solution'])
-                if solution_images:
-                    has_images = True
-                    solution_replacements = []
-                    for idx, img_info in enumerate(solution_images):
-                        try:
-                            # Download image
-                            image_data, content_type = self.download_image(img_info['src'])
-                            
-                            # Determine extension
-                            ext = self.get_file_extension(img_info['src'], content_type)
-                            
-                            # Create destination path
-                            destination_path = f"{chapter_id}/{question_id}_solution_{idx}{ext}"
-                            
-                            # Upload to GCS
-                            public_url = self.upload_to_gcs(image_data, destination_path, content_type)
-                            
-                            solution_replacements.append({
-                                'original_src': img_info['src'],
-                                'new_url': public_url
-                            })
-                            
-                            logger.info(f"  Processed solution image {idx}: {destination_path}")
-                        
-                        except Exception as e:
-                            logger.error(f"  Failed to process solution image {idx}: {str(e)}")
-                            return False
-                    
-                    # Update solution HTML
-                    if solution_replacements:
-                        updated_solution = self.update_html_with_new_urls(question['solution'], solution_replacements)
-                        update_fields['solution'] = updated_solution
-            
-            # Update document in MongoDB
-            update_fields['imageStoring'] = True
-            self.questions_collection.update_one(
-                {'_id': question['_id']},
-                {'$set': update_fields}
-            )
-            
-            if has_images:
-                logger.info(f"Successfully updated question {question_id} with {len(update_fields) - 1} field(s) modified")
-            else:
-                logger.info(f"Question {question_id} has no images, marked as processed")
+            jobs = self.collect_image_jobs(question)
+            results = []
+            for job in jobs:
+                try:
+                    results.append((job, self.store_image(job, self.fetch_image(job['source']))))
+                except Exception as e:
+                    logger.error(f"  Failed to process {job['label']}: {str(e)}")
+                    return False
             
+            self.save_question(question, self.build_update_fields(question, results), bool(jobs))
             return True
         
         except Exception as e:
             logger.error(f"Error processing question {question_id}: {str(e)}")
             # Mark as failed
-            self.questions_collection.update_one(
-                {'_id': question['_id']},
-                {'$set': {'imageStoring': False}}
-            )
+            self.mark_failed(question)
             return False
     
-    def process_chapter_questions(self, chapter_id: str, skip_processed: bool = True):
+    def process_questions_concurrently(self, questions: List[Dict], chapter_id: str,
+                                       download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+                                       upload_workers: int = DEFAULT_UPLOAD_WORKERS) -> Tuple[int, int]:
+        """
+        Pipelined mode: images are downloaded by one bounded pool and handed to a second pool for
+        upload as soon as they arrive; a question's Mongo update is written once its last image is
+        stored. The number of questions in flight is capped, which bounds the image bytes held in
+        memory. Returns (success_count, failure_count).
+        """
+        total_questions = len(questions)
+        counts = {'success': 0, 'failed': 0}
+        lock = threading.Lock()
+        in_flight = threading.BoundedSemaphore((download_workers + upload_workers) * 2)
+        downloads = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix='image-download')
+        uploads = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='image-upload')
+        in_flight_total = [0]
+        
+        def in_flight_count(delta: int) -> int:
+            with lock:
+                in_flight_total[0] += delta
+                return in_flight_total[0]
+        
+        def record(success: bool):
+            with lock:
+                counts['success' if success else 'failed'] += 1
+                done = counts['success'] + counts['failed']
+            QUESTIONS_PROCESSED.inc(outcome='success' if success else 'failed')
+            logger.info(f"Progress: {done}/{total_questions} processed | success: {counts['success']} | failed: {counts['failed']}")
+        
+        def finish(state: Dict):
+            question = state['question']
+            success = not state['failed']
+            try:
+                if success:
+                    try:
+                        self.save_question(question, self.build_update_fields(question, state['results']), True)
+                    except Exception as e:
+                        logger.error(f"Error processing question {question['_id']}: {str(e)}")
+                        success = False
+                        try:
+                            self.mark_failed(question)
+                        except Exception as mark_error:
+                            logger.error(f"Could not mark question {question['_id']} as failed: {str(mark_error)}")
+            finally:
+                # Runs in a pool callback: an escaping error must not leak the in-flight slot and stall the feed loop
+                QUESTION_SECONDS.observe(time.perf_counter() - state['started'])
+                QUESTIONS_IN_FLIGHT.set(in_flight_count(-1))
+                in_flight.release()
+                record(success)
+        
+        def image_done(state: Dict, job: Dict, error: Optional[BaseException] = None, new_url: Optional[str] = None):
+            if error is not None:
+                logger.error(f"  Failed to process {job['label']} of question {state['question']['_id']}: {str(error)}")
+            with lock:
+                if error is not None:
+                    state['failed'] = True
+                elif new_url is not None:
+                    state['results'].append((job, new_url))
+                state['pending'] -= 1
+                last = state['pending'] == 0
+            if last:
+                finish(state)
+        
+        def on_uploaded(state: Dict, job: Dict, future):
+            error = future.exception()
+            image_done(state, job, error, None if error else future.result())
+        
+        def on_downloaded(state: Dict, job: Dict, future):
+            error = future.exception()
+            if error is not None or state['failed']:
+                # Images of a question that already failed are not uploaded, so their bytes are not kept either
+                if error is None:
+                    self._pending_sources.pop(job['source'], None)
+                image_done(state, job, error)
+                return
+            fetched = future.result()
+            if 'object_url' in fetched:
+                # Already stored: nothing to upload
+                image_done(state, job, new_url=fetched['object_url'])
+                return
+            uploads.submit(self.store_image, job, fetched).add_done_callback(partial(on_uploaded, state, job))
+        
+        try:
+            for question in questions:
+                jobs = self.collect_image_jobs(question)
+                if not jobs:
+                    try:
+                        self.save_question(question, {}, False)
+                        record(True)
+                    except Exception as e:
+                        logger.error(f"Error processing question {question['_id']}: {str(e)}")
+                        record(False)
+                    continue
+                in_flight.acquire()
+                QUESTIONS_IN_FLIGHT.set(in_flight_count(1))
+                state = {'question': question, 'pending': len(jobs), 'results': [], 'failed': False,
+                         'started': time.perf_counter()}
+                logger.info(f"Queued question {question['_id']} with {len(jobs)} image(s)")
+                for job in jobs:
+                    downloads.submit(self.fetch_image, job['source']).add_done_callback(partial(on_downloaded, state, job))
+        finally:
+            # Downloads first: their callbacks hand the images to the upload pool
+            downloads.shutdown(wait=True)
+            uploads.shutdown(wait=True)
+        return counts['success'], counts['failed']
+    
+    def process_chapter_questions(self, chapter_id: str, skip_processed: bool = True, concurrent: bool = False,
+                                  download_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+                                  upload_workers: int = DEFAULT_UPLOAD_WORKERS):
         """Process all questions for a given chapterId"""
         try:
             chapter_obj_id = ObjectId(chapter_id)
@@ -415,20 +660,32 @@ class QuestionsImageUploader:
             logger.info("No questions to process")
             return
         
-        # Process each question
-        success_count = 0
-        failure_count = 0
-        
-        for idx, question in enumerate(questions, 1):
-            logger.info(f"Processing question {idx}/{total_questions}")
-            if self.process_question(question, chapter_id):
-                success_count += 1
-            else:
-                failure_count += 1
-            logger.info(f"Progress: {idx}/{total_questions} processed | success: {success_count} | failed: {failure_count}")
+        started = time.perf_counter()
+        if concurrent:
+            logger.info(f"Concurrent mode: {download_workers} download / {upload_workers} upload workers, "
+                        f"{self.per_host_limit} downloads per host")
+            success_count, failure_count = self.process_questions_concurrently(
+                questions, chapter_id, download_workers, upload_workers)
+        else:
+            # Process each question
+            success_count = 0
+            failure_count = 0
+            
+            for idx, question in enumerate(questions, 1):
+                logger.info(f"Processing question {idx}/{total_questions}")
+                with QUESTION_SECONDS.time():
+                    success = self.process_question(question, chapter_id)
+                if success:
+                    success_count += 1
+                    QUESTIONS_PROCESSED.inc(outcome='success')
+                else:
+                    failure_count += 1
+                    QUESTIONS_PROCESSED.inc(outcome='failed')
+                logger.info(f"Progress: {idx}/{total_questions} processed | success: {success_count} | failed: {failure_count}")
         
-        logger.info(f"Processing complete!")
+        logger.info(f"Processing complete in {time.perf_counter() - started:.1f}s!")
         logger.info(f"Success: {success_count}, Failed: {failure_count}, Total: {total_questions}")
+        logger.info("Metrics summary:\n" + REGISTRY.summary())
     
     def test_question(self, question_id: str, dry_run: bool = False) -> bool:
         """Test processing a single question by questionId"""
@@ -525,11 +782,26 @@ def main():
     parser.add_argument('--reprocess', action='store_true', help='Reprocess questions even if imageStoring=true')
     parser.add_argument('--test', type=str, metavar='QUESTION_ID', help='Test mode: process a single question by questionId')
     parser.add_argument('--dry-run', action='store_true', help='Dry run mode: analyze but do not process (only with --test)')
+    parser.add_argument('--concurrent', action='store_true', help='Download and upload images with two pipelined worker pools')
+    parser.add_argument('--download-workers', type=int, default=DEFAULT_DOWNLOAD_WORKERS, help='Concurrent image downloads (with --concurrent)')
+    parser.add_argument('--upload-workers', type=int, default=DEFAULT_UPLOAD_WORKERS, help='Concurrent GCS uploads (with --concurrent)')
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST_LIMIT, help='Concurrent downloads per source host')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help='Retries with exponential backoff for transient download/upload errors')
+    parser.add_argument('--ignore-source-cache', action='store_true',
+                        help='Re-download every image instead of revalidating cached source URLs (uploads are still deduplicated)')
+    parser.add_argument('--metrics-port', type=int, default=0, help='Serve Prometheus metrics on this local port while running')
+    parser.add_argument('--metrics-summary-interval', type=int, default=0, help='Log a metrics summary every N seconds (0 = off)')
     
     args = parser.parse_args()
     
     try:
-        uploader = QuestionsImageUploader()
+        if args.metrics_port:
+            start_metrics_server(args.metrics_port)
+        if args.metrics_summary_interval:
+            start_summary_logger(args.metrics_summary_interval, summary_logger=logger)
+        
+        uploader = QuestionsImageUploader(http_pool_size=max(args.download_workers, 1), per_host_limit=max(args.per_host, 1),
+                                          retries=max(args.retries, 0), use_source_cache=not args.ignore_source_cache)
         
         # Test mode
         if args.test:
@@ -540,7 +812,9 @@ def main():
         if not args.chapterId:
             parser.error("chapterId is required unless using --test mode")
         
-        uploader.process_chapter_questions(args.chapterId, skip_processed=not args.reprocess)
+        uploader.process_chapter_questions(args.chapterId, skip_processed=not args.reprocess, concurrent=args.concurrent,
+                                           download_workers=max(args.download_workers, 1),
+                                           upload_workers=max(args.upload_workers, 1))
     except Exception as e:
         logger.error(f"Fatal error: {str(e)}")
         import traceback
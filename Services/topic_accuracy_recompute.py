@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Topic Accuracy Recompute
+Re-evaluates every topic's weighted moving accuracy under the current ATTEMPT_WINDOW_SIZE /
+ACCURACY_WEIGHT, so users are consistent again after the config changes.
+
+Only the latest attempts (attemptsWindow) are stored, so past accuracyHistory points cannot be
+replayed; instead each topic gets a new history point and summary computed from its window
+under the new parameters, and the window is trimmed to the new size. Documents are streamed
+in chunks and the WMA of all windows in a chunk is evaluated as one NumPy matrix product.
+Users are stamped with accuracyConfig (the live worker stamps the users it creates with the
+config it runs under), so an interrupted run resumes with the users not recomputed yet.
+Writes are conditional on the document version maintained by user_topic_performance.py;
+users that lose the race stay due and are picked up by a rerun.
+
+With --topic-stats the accuracy moves are applied to the topicstats distributions, as the live
+worker does; without it, run topic_stats.py --rebuild afterwards.
+
+--what-if evaluates several weights in the same pass and reports how accuracies would move,
+without writing anything. The stored accuracy is the topic summary, or the latest accuracyHistory
+point for users not backfilled yet; topics with neither are left out of the change statistics.
+"""
+
+import time
+import logging
+import argparse
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+
+from user_topic_performance import load_config, ordered_attempts, build_topic_summary, summarize_history, flush_topic_stats
+from topic_stats import SCOPES, ScopeResolver, TopicStatsRecorder, ensure_topic_stats_indexes
+
+DEFAULT_CHUNK_SIZE = 500
+# Accuracy moves larger than this are reported separately by --what-if
+CHANGE_THRESHOLD = 0.05
+
+
+def weight_matrix(weights: List[float], size: int):
+    """Return (powers, denominators): powers[i, w] = weights[w] ** i, denominators[m, w] = sum(powers[:m, w])"""
+    exponents = np.arange(size, dtype=np.float64)[:, None]
+    powers = np.power(np.asarray(weights, dtype=np.float64)[None, :], exponents)
+    denominators = np.vstack([np.zeros((1, len(weights))), np.cumsum(powers, axis=0)])
+    return powers, denominators
+
+
+def window_matrix(windows: List[List[Dict[str, Any]]], size: int):
+    """
+    Lay windows out as a (topics, size) matrix: the last `size` attempts of each window,
+    oldest in column 0, zero padded. Returns (values, counts).
+    """
+    values = np.zeros((len(windows), size), dtype=np.float64)
+    counts = np.zeros(len(windows), dtype=np.int64)
+    for row, window in enumerate(windows):
+        attempts = ordered_attempts(window)[-size:] if size > 0 else []
+        counts[row] = len(attempts)
+        if attempts:
+            values[row, :len(attempts)] = [point['value'] for point in attempts]
+    return values, counts
+
+
+def batch_wma(values, counts, powers, denominators):
+    """WMA of every window under every weight: (topics, weights), same convention as compute_wma"""
+    numerators = values @ powers
+    window_denominators = denominators[counts]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(window_denominators > 0, numerators / window_denominators, 0.0)
+
+
+def build_recompute_update(user_doc: Dict[str, Any], accuracies, size: int, weight: float, now: datetime) -> UpdateOne:
+    """One versioned update rewriting the summaries of all of a user's topics"""
+    update_set: Dict[str, Any] = {'accuracyConfig': {'windowSize': size, 'weight': weight}, 'updatedAt': now}
+    push: Dict[str, Any] = {}
+    array_filters = []
+    for i, (topic, accuracy) in enumerate(zip(user_doc.get('topics', []), accuracies)):
+        ident = f't{i}'
+        accuracy = float(accuracy)
+        previous = (topic.get('summary') or {}).get('accuracy')
+        attempt_count = (topic.get('summary') or {}).get('attemptCount', topic.get('attemptSeq', 0))
+        point = {'timestamp': now, 'accuracy': accuracy, 'recomputed': True}
+        push[f'topics.$[{ident}].accuracyHistory'] = point
+        # $each [] + $slice trims the window to the new size
+        push[f'topics.$[{ident}].attemptsWindow'] = {'$each': [], '$slice': -size}
+        update_set[f'topics.$[{ident}].summary'] = build_topic_summary(point, previous, attempt_count)
+        array_filters.append({f'{ident}.topicId': topic['topicId']})
+
+    version = user_doc.get('version')
+    update: Dict[str, Any] = {'$set': update_set, '$inc': {'version': 1}}
+    if push:
+        update['$push'] = push
+    return UpdateOne(
+        {'_id': user_doc['_id'], 'version': {'$exists': False} if version is None else version},
+        update,
+        array_filters=array_filters or None
+    )
+
+
+def stored_accuracy(topic: Dict[str, Any]) -> float:
+    """Current accuracy of a topic from its summary, else its latest history point; NaN when it has neither"""
+    accuracy = (topic.get('summary') or {}).get('accuracy')
+    if accuracy is None:
+        accuracy = summarize_history(topic)['accuracy']
+    return np.nan if accuracy is None else float(accuracy)
+
+
+def recompute(db, size: int, weight: float, what_if: Optional[List[float]] = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, user_ids: List[Any] = None,
+              topic_stats: Optional[TopicStatsRecorder] = None) -> Dict[str, Any]:
+    """
+    Stream users and recompute their topic accuracies; with what_if only report per-weight statistics.
+    With topic_stats, the accuracy moves of the users written are applied to the topic stats.
+    """
+    collection = db.usertopicperformances
+    weights = list(what_if) if what_if else [weight]
+    powers, denominators = weight_matrix(weights, size)
+    now = datetime.utcnow()
+
+    if user_ids:
+        query: Dict[str, Any] = {'userId': {'$in': user_ids}}
+    elif what_if:
+        query = {}
+    else:
+        # Users not recomputed under this config yet
+        query = {'$or': [{'accuracyConfig.windowSize': {'$ne': size}}, {'accuracyConfig.weight': {'$ne': weight}}]}
+    projection = {'userId': 1, 'topics.topicId': 1, 'topics.attemptsWindow': 1, 'topics.attemptSeq': 1, 'topics.summary': 1, 'version': 1}
+    if what_if:
+        # Fallback for topics without a summary
+        projection['topics.accuracyHistory'] = 1
+
+    totals = {'users': 0, 'topics': 0, 'written': 0, 'conflicts': 0, 'compared': 0}
+    # Per weight: sum of accuracies, sum of squares, sum of |change|, moves above threshold
+    stats = np.zeros((4, len(weights)))
+    started = time.monotonic()
+
+    def flush(chunk: List[Dict[str, Any]]):
+        windows = [topic.get('attemptsWindow') or [] for user_doc in chunk for topic in user_doc.get('topics', [])]
+        values, counts = window_matrix(windows, size)
+        accuracies = batch_wma(values, counts, powers, denominators)
+        totals['users'] += len(chunk)
+        totals['topics'] += len(windows)
+
+        if what_if:
+            stored = np.array([
+                stored_accuracy(topic) for user_doc in chunk for topic in user_doc.get('topics', [])
+            ], dtype=np.float64)
+            known = ~np.isnan(stored)
+            change = np.abs(accuracies[known] - stored[known][:, None])
+            stats[0] += accuracies.sum(axis=0)
+            stats[1] += (accuracies ** 2).sum(axis=0)
+            stats[2] += change.sum(axis=0)
+            stats[3] += (change > CHANGE_THRESHOLD).sum(axis=0)
+            totals['compared'] += int(known.sum())
+            return
+
+        operations = []
+        offset = 0
+        for user_doc in chunk:
+            topic_count = len(user_doc.get('topics', []))
+            operations.append(build_recompute_update(user_doc, accuracies[offset:offset + topic_count, 0], size, weight, now))
+            offset += topic_count
+        result = collection.bulk_write(operations, ordered=False)
+        totals['written'] += result.matched_count
+        totals['conflicts'] += len(operations) - result.matched_count
+        if topic_stats:
+            record_topic_stats(chunk, accuracies[:, 0])
+            flush_topic_stats(topic_stats)
+
+    def record_topic_stats(chunk: List[Dict[str, Any]], accuracies):
+        # The bulk result has no per-user outcome: users written now carry the config and a newer version
+        written_ids = {
+            doc['_id'] for doc in collection.find(
+                {'$or': [{'_id': user_doc['_id'], 'version': {'$gt': user_doc.get('version') or 0}} for user_doc in chunk],
+                 'accuracyConfig.windowSize': size, 'accuracyConfig.weight': weight},
+                {'_id': 1}
+            )
+        }
+        offset = 0
+        for user_doc in chunk:
+            topics = user_doc.get('topics', [])
+            if user_doc['_id'] in written_ids:
+                topic_stats.add(user_doc['userId'], [
+                    {'topicId': topic['topicId'], 'attempts': 0, 'correct': 0,
+                     'before': (topic.get('summary') or {}).get('accuracy'), 'after': float(accuracy)}
+                    for topic, accuracy in zip(topics, accuracies[offset:offset + len(topics)])
+                ])
+            offset += len(topics)
+
+    chunk: List[Dict[str, Any]] = []
+    for user_doc in collection.find(query, projection).batch_size(chunk_size):
+        chunk.append(user_doc)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+            elapsed = time.monotonic() - started
+            logging.info(f"Recomputed {totals['users']} users / {totals['topics']} topics ({totals['topics'] / max(elapsed, 1e-6):.0f} topics/s)")
+    if chunk:
+        flush(chunk)
+
+    if what_if:
+        topics = max(totals['topics'], 1)
+        compared = max(totals['compared'], 1)
+        report = []
+        for i, candidate in enumerate(weights):
+            mean = float(stats[0, i] / topics)
+            report.append({
+                'weight': candidate,
+                'mean': mean,
+                'std': float(np.sqrt(max(stats[1, i] / topics - mean ** 2, 0.0))),
+                'meanAbsChange': float(stats[2, i] / compared),
+                'changedOver': int(stats[3, i])
+            })
+            logging.info(
+                f"What-if weight={candidate:g} window={size}: mean={mean:.4f} std={report[-1]['std']:.4f} "
+                f"mean|change|={report[-1]['meanAbsChange']:.4f} changed>{CHANGE_THRESHOLD}={report[-1]['changedOver']}/{totals['compared']}"
+            )
+        totals['what_if'] = report
+
+    logging.info(
+        f"Recompute {'what-if ' if what_if else ''}complete in {time.monotonic() - started:.1f}s: users={totals['users']} "
+        f"topics={totals['topics']} written={totals['written']} conflicts={totals['conflicts']}"
+    )
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute topic accuracies after ATTEMPT_WINDOW_SIZE / ACCURACY_WEIGHT changes')
+    parser.add_argument('--window-size', type=int, default=None, help='Override ATTEMPT_WINDOW_SIZE')
+    parser.add_argument('--weight', type=float, default=None, help='Override ACCURACY_WEIGHT')
+    parser.add_argument('--what-if', type=float, nargs='+', metavar='WEIGHT',
+                        help='Report the effect of these weights in one pass, without writing')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Users per NumPy batch and bulk write')
+    parser.add_argument('--user-id', action='append', default=[], help='Recompute only this user (repeatable)')
+    parser.add_argument('--topic-stats', action='store_true', help='Apply the accuracy moves to the topicstats collection')
+    parser.add_argument('--topic-stats-scope', dest='topic_stats_scopes', action='append', choices=SCOPES, default=[],
+                        help='Scopes the topic stats are kept for, as given to the worker (repeatable)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    mongo_uri, attempt_window_size, accuracy_weight = load_config()
+    size = args.window_size if args.window_size is not None else attempt_window_size
+    weight = args.weight if args.weight is not None else accuracy_weight
+
+    client = MongoClient(mongo_uri)
+    db = client.get_default_database()
+    topic_stats = None
+    if args.topic_stats and not args.what_if:
+        ensure_topic_stats_indexes(db)
+        topic_stats = TopicStatsRecorder(db, ScopeResolver(db, args.topic_stats_scopes))
+    try:
+        recompute(db, size, weight, args.what_if, args.chunk_size, [ObjectId(value) for value in args.user_id], topic_stats)
+    except KeyboardInterrupt:
+        logging.info("Interrupted; rerun to continue with the remaining users")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Topic Stats
+Cross-user statistics per topic, maintained incrementally by user_topic_performance.py so
+admin analytics ("which topics is this cohort worst at", "average accuracy on topic X") read
+one document per topic instead of unwinding every usertopicperformances document.
+
+One document per (topicId, scope, scopeId), scope being 'all', 'org' (userprofiles.organizationId)
+or 'batch' (batches containing the user):
+  attempts / correct   graded attempts seen since countingSince
+  users / accuracySum  users with an accuracy on the topic and the sum of their current accuracies
+  buckets.b0..b9       users by current accuracy, in ACCURACY_BUCKETS equal-width buckets
+
+The worker issues the increments of a whole batch as one unordered bulk write right after the
+user writes and before acknowledging the snapshots, so stats follow the same at-least-once
+semantics as the user documents. --rebuild recomputes the distribution fields from
+usertopicperformances (attempts/correct cannot be recovered and are left as counted) and
+deletes the documents of the rebuilt scopes that no user counts towards any more.
+
+A user's topic counts towards the distributions once it has a summary. The jobs that change
+summaries outside the worker keep the stats in step when given --topic-stats (same scopes as
+the worker): user_topic_performance.py --backfill-summaries and topic_accuracy_recompute.py.
+If they were run without it, run --rebuild afterwards. accuracy_history_compactor.py only
+rewrites accuracyHistory, never summaries, so it does not affect the stats.
+"""
+
+import os
+import time
+import logging
+import argparse
+from datetime import datetime
+from typing import List, Dict, Any, Tuple
+
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv
+
+TOPIC_STATS_COLLECTION = 'topicstats'
+TOPIC_STATS_INDEX = 'topicId_scope_scopeId_unique'
+ACCURACY_BUCKETS = 10
+SCOPES = ('org', 'batch')
+DEFAULT_SCOPE_TTL_SECONDS = 300
+
+
+def accuracy_bucket(accuracy: float) -> str:
+    index = min(max(int(accuracy * ACCURACY_BUCKETS), 0), ACCURACY_BUCKETS - 1)
+    return f'b{index}'
+
+
+def ensure_topic_stats_indexes(db):
+    db[TOPIC_STATS_COLLECTION].create_index(
+        [('topicId', 1), ('scope', 1), ('scopeId', 1)], name=TOPIC_STATS_INDEX, unique=True
+    )
+
+
+class ScopeResolver:
+    """Organization / batches of a user, cached for ttl_seconds (classes reuse the same students)"""
+
+    def __init__(self, db, scopes: List[str], ttl_seconds: float = DEFAULT_SCOPE_TTL_SECONDS):
+        self.db = db
+        self.scopes = scopes
+        self.ttl_seconds = ttl_seconds
+        self._cache: Dict[Any, Tuple[float, List[Tuple[str, Any]]]] = {}
+
+    def resolve(self, user_id) -> List[Tuple[str, Any]]:
+        """(scope, scopeId) pairs the user's attempts count towards, always including ('all', None)"""
+        cached = self._cache.get(user_id)
+        if cached and time.monotonic() - cached[0] < self.ttl_seconds:
+            return cached[1]
+        keys: List[Tuple[str, Any]] = [('all', None)]
+        # userprofiles and batches store the user id as a string
+        if 'org' in self.scopes:
+            profile = self.db.userprofiles.find_one({'userId': str(user_id)}, {'organizationId': 1})
+            if profile and profile.get('organizationId'):
+                keys.append(('org', profile['organizationId']))
+        if 'batch' in self.scopes:
+            keys.extend(('batch', batch['_id']) for batch in self.db.batches.find({'userIds': str(user_id)}, {'_id': 1}))
+        if len(self._cache) > 10000:
+            self._cache.clear()
+        self._cache[user_id] = (time.monotonic(), keys)
+        return keys
+
+
+class TopicStatsRecorder:
+    """Accumulates topic changes of a batch of users and writes the merged increments at once"""
+
+    def __init__(self, db, resolver: ScopeResolver):
+        self.db = db
+        self.resolver = resolver
+        self._increments: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+    def add(self, user_id, topic_changes: List[Dict[str, Any]]):
+        """
+        topic_changes as produced by apply_snapshots: topicId, attempts, correct and the user's
+        accuracy on the topic before (None for a first attempt) and after the write.
+        """
+        if not topic_changes:
+            return
+        scope_keys = self.resolver.resolve(user_id)
+        for change in topic_changes:
+            inc: Dict[str, float] = {'attempts': change['attempts'], 'correct': change['correct']}
+            before, after = change['before'], change['after']
+            if after is not None:
+                if before is None:
+                    inc['users'] = 1
+                    inc['accuracySum'] = after
+                    inc[f'buckets.{accuracy_bucket(after)}'] = 1
+                else:
+                    inc['accuracySum'] = after - before
+                    if accuracy_bucket(before) != accuracy_bucket(after):
+                        inc[f'buckets.{accuracy_bucket(before)}'] = -1
+                        inc[f'buckets.{accuracy_bucket(after)}'] = 1
+            for scope, scope_id in scope_keys:
+                key = (str(change['topicId']), scope, str(scope_id))
+                entry = self._increments.setdefault(
+                    key, {'topicId': change['topicId'], 'scope': scope, 'scopeId': scope_id, 'inc': {}}
+                )
+                for field, value in inc.items():
+                    entry['inc'][field] = entry['inc'].get(field, 0) + value
+
+    def flush(self) -> int:
+        if not self._increments:
+            return 0
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {'topicId': entry['topicId'], 'scope': entry['scope'], 'scopeId': entry['scopeId']},
+                {'$inc': entry['inc'], '$set': {'updatedAt': now}, '$setOnInsert': {'countingSince': now}},
+                upsert=True
+            )
+            for entry in self._increments.values()
+        ]
+        self._increments.clear()
+        self.db[TOPIC_STATS_COLLECTION].bulk_write(operations, ordered=False)
+        return len(operations)
+
+
+def rebuild_topic_stats(db, scopes: List[str], batch_size: int = 500) -> Dict[str, int]:
+    """
+    Recompute users/accuracySum/buckets of every stats document from current topic summaries.
+    Documents of the rebuilt scopes left without users are deleted, unless the live worker
+    updated them after the scan started.
+    """
+    resolver = ScopeResolver(db, scopes, ttl_seconds=float('inf'))
+    distributions: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    totals = {'users': 0, 'topics': 0, 'without_summary': 0, 'stale_removed': 0}
+    started = time.monotonic()
+    scan_started = datetime.utcnow()
+    for user_doc in db.usertopicperformances.find({}, {'userId': 1, 'topics.topicId': 1, 'topics.summary.accuracy': 1}).batch_size(batch_size):
+        totals['users'] += 1
+        scope_keys = resolver.resolve(user_doc['userId'])
+        for topic in user_doc.get('topics', []):
+            accuracy = (topic.get('summary') or {}).get('accuracy')
+            if accuracy is None:
+                totals['without_summary'] += 1
+                continue
+            totals['topics'] += 1
+            for scope, scope_id in scope_keys:
+                key = (str(topic['topicId']), scope, str(scope_id))
+                entry = distributions.setdefault(key, {
+                    'topicId': topic['topicId'], 'scope': scope, 'scopeId': scope_id, 'users': 0, 'accuracySum': 0.0,
+                    'buckets': {f'b{i}': 0 for i in range(ACCURACY_BUCKETS)}
+                })
+                entry['users'] += 1
+                entry['accuracySum'] += accuracy
+                entry['buckets'][accuracy_bucket(accuracy)] += 1
+        if totals['users'] % batch_size == 0:
+            logging.info(f"Scanned {totals['users']} users ({totals['users'] / (time.monotonic() - started):.0f} users/s)")
+
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {'topicId': entry['topicId'], 'scope': entry['scope'], 'scopeId': entry['scopeId']},
+            {'$set': {'users': entry['users'], 'accuracySum': entry['accuracySum'], 'buckets': entry['buckets'],
+                      'updatedAt': now, 'rebuiltAt': now},
+             '$setOnInsert': {'attempts': 0, 'correct': 0, 'countingSince': now}},
+            upsert=True
+        )
+        for entry in distributions.values()
+    ]
+    for start in range(0, len(operations), batch_size):
+        db[TOPIC_STATS_COLLECTION].bulk_write(operations[start:start + batch_size], ordered=False)
+    # (topicId, scope, scopeId) combinations that no longer exist, e.g. a user moved to another organization
+    totals['stale_removed'] = db[TOPIC_STATS_COLLECTION].delete_many({
+        'scope': {'$in': ['all', *scopes]},
+        'rebuiltAt': {'$ne': now},
+        '$or': [{'updatedAt': {'$lt': scan_started}}, {'updatedAt': {'$exists': False}}]
+    }).deleted_count
+    logging.info(
+        f"Topic stats rebuilt: users={totals['users']} topics={totals['topics']} stats_docs={len(operations)} "
+        f"stale_removed={totals['stale_removed']} "
+        f"without_summary={totals['without_summary']} (run user_topic_performance.py --backfill-summaries first)"
+    )
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain cross-user topic statistics')
+    parser.add_argument('--rebuild', action='store_true', help='Recompute the accuracy distributions from usertopicperformances')
+    parser.add_argument('--scope', dest='scopes', action='append', choices=SCOPES, default=[],
+                        help='Also keep per-organization / per-batch stats (repeatable)')
+    parser.add_argument('--batch-size', type=int, default=500, help='Users per progress log and stats docs per bulk write')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        raise RuntimeError('MONGO_URI missing in Services/.env')
+    client = MongoClient(mongo_uri)
+    db = client.get_default_database()
+    try:
+        ensure_topic_stats_indexes(db)
+        if args.rebuild:
+            rebuild_topic_stats(db, args.scopes, args.batch_size)
+        else:
+            parser.print_help()
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
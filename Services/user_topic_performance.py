@@ -1,13 +1,35 @@
 import os
 import time
+import signal
 import logging
-from datetime import datetime
-from typing import List, Dict, Any
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple, Optional
 
+import bson
 from bson import ObjectId
-from pymongo import MongoClient, ReturnDocument
+from pymongo import MongoClient, ReturnDocument, UpdateOne, UpdateMany
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
+from work_waiter import WorkWaiter
+from metrics import REGISTRY, start_metrics_server, start_summary_logger
+from topic_stats import ScopeResolver, TopicStatsRecorder, ensure_topic_stats_indexes
+
+STAGE_SECONDS = REGISTRY.histogram('snapshot_stage_seconds', 'Time spent in each snapshot processing stage')
+SNAPSHOT_SECONDS = REGISTRY.histogram('snapshot_processing_seconds', 'Claim-to-done latency per snapshot (batch time / batch size in batch mode)')
+BATCH_SECONDS = REGISTRY.histogram('snapshot_batch_seconds', 'Claim-to-done time of a whole snapshot batch')
+SNAPSHOTS_PROCESSED = REGISTRY.counter('snapshots_processed_total', 'Snapshots applied to UserTopicPerformance')
+SNAPSHOTS_FAILED = REGISTRY.counter('snapshots_failed_total', 'Snapshots marked failed')
+ATTEMPTS_APPLIED = REGISTRY.counter('snapshot_attempts_applied_total', 'Topic attempts pushed into attempt windows')
+QUEUE_LAG = REGISTRY.gauge('snapshot_queue_lag_seconds', 'Age of the last claimed snapshot')
+CACHE_LOOKUPS = REGISTRY.counter('topic_cache_lookups_total', 'Write-behind cache lookups by result (hit/miss)')
+CACHE_BYTES = REGISTRY.gauge('topic_cache_bytes', 'Estimated size of the cached topic windows')
+CACHE_USERS = REGISTRY.gauge('topic_cache_users', 'Users held in the write-behind cache')
+
 
 def load_config():
     load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
@@ -20,151 +42,1001 @@ def load_config():
     return mongo_uri, attempt_window_size, accuracy_weight
 
 
+@lru_cache(maxsize=16)
+def weight_tables(weight: float, size: int) -> Tuple[Tuple[float, ...], Tuple[float, ...]]:
+    """Return (powers, denominators): powers[i] = weight ** i, denominators[m] = sum(powers[:m])"""
+    powers = tuple(weight ** i for i in range(size))
+    denominators = [0.0]
+    for power in powers:
+        denominators.append(denominators[-1] + power)
+    return powers, tuple(denominators)
+
+
+def ordered_attempts(attempts_window: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Oldest -> newest. Points carry a sequence number; legacy points keep their append order."""
+    if all('seq' in point for point in attempts_window):
+        return sorted(attempts_window, key=lambda x: x['seq'])
+    return list(attempts_window)
+
+
 def compute_wma(attempts_window: List[Dict[str, Any]], weight: float) -> float:
     if not attempts_window:
         return 0.0
-    # sort by timestamp ascending (oldest -> newest)
-    attempts_window_sorted = sorted(attempts_window, key=lambda x: x['timestamp'])
-    m = len(attempts_window_sorted)
-    numerator = 0.0
-    denominator = 0.0
-    for idx, point in enumerate(attempts_window_sorted):
-        w = weight ** idx
-        numerator += (point['value'] * w)
-        denominator += w
+    attempts = ordered_attempts(attempts_window)
+    powers, denominators = weight_tables(weight, len(attempts))
+    numerator = sum(point['value'] * powers[idx] for idx, point in enumerate(attempts))
+    denominator = denominators[len(attempts)]
     return (numerator / denominator) if denominator > 0 else 0.0
 
 
-def ensure_topic_entry(user_doc: Dict[str, Any], topic_id: ObjectId) -> int:
-    """Return index of the topic entry for topic_id; create if missing."""
-    topics = user_doc.get('topics', [])
-    for i, t in enumerate(topics):
-        if str(t.get('topicId')) == str(topic_id):
-            return i
-    # Create a new topic entry
-    topics.append({
-        'topicId': topic_id,
-        'attemptsWindow': [],
-        'accuracyHistory': []
-    })
-    return len(topics) - 1
+class AttemptWindow:
+    """
+    Fixed-size ring buffer of the latest attempts of one topic with an incrementally
+    maintained WMA numerator, so each push costs O(1) whatever the window size.
+    Weights grow with recency: the oldest slot has weight ** 0, the newest weight ** (count - 1).
+    """
 
+    def __init__(self, size: int, weight: float, points: List[Dict[str, Any]] = None, next_seq: int = None):
+        self.size = size
+        self.weight = weight
+        self.powers, self.denominators = weight_tables(weight, size)
+        self.slots: List[Dict[str, Any]] = [None] * size
+        self.start = 0
+        self.count = 0
+        self.numerator = 0.0
+        self.pushes_since_recompute = 0
+
+        points = ordered_attempts(points or [])[-size:] if size > 0 else []
+        for offset, point in enumerate(points):
+            self.slots[offset] = point
+            self.numerator += point['value'] * self.powers[offset]
+        self.count = len(points)
+        last_seq = max((point.get('seq', -1) for point in points), default=-1)
+        self.next_seq = max(next_seq or 0, last_seq + 1, self.count)
+
+    def push(self, value: int, timestamp: datetime) -> Optional[Dict[str, Any]]:
+        """Append an attempt and return the stored point"""
+        if self.size <= 0:
+            return None
+        point = {'timestamp': timestamp, 'value': value, 'seq': self.next_seq}
+        self.next_seq += 1
+        if self.count < self.size:
+            self.slots[(self.start + self.count) % self.size] = point
+            self.numerator += value * self.powers[self.count]
+            self.count += 1
+            return point
+        # Full: drop the oldest, every remaining weight shrinks by one power, newest gets the top weight
+        oldest = self.slots[self.start]
+        self.slots[self.start] = point
+        self.start = (self.start + 1) % self.size
+        if self.weight == 0:
+            self._recompute()
+            return point
+        self.numerator = (self.numerator - oldest['value']) / self.weight + value * self.powers[self.size - 1]
+        self.pushes_since_recompute += 1
+        # Bound floating point drift; amortised O(1) per push
+        if self.pushes_since_recompute >= self.size:
+            self._recompute()
+        return point
+
+    def _recompute(self):
+        self.numerator = sum(point['value'] * self.powers[offset] for offset, point in enumerate(self.to_list()))
+        self.pushes_since_recompute = 0
+
+    def wma(self) -> float:
+        denominator = self.denominators[self.count]
+        return (self.numerator / denominator) if denominator > 0 else 0.0
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Attempts oldest -> newest"""
+        return [self.slots[(self.start + offset) % self.size] for offset in range(self.count)]
+
+
+# Optimistic concurrency: retries when another worker changed the same user document
+MAX_UPDATE_RETRIES = 10
+# Ids of the latest snapshots applied to a topic, kept on the topic entry so a snapshot re-queued
+# after a crash between its write and its acknowledgement is not applied twice
+APPLIED_SNAPSHOT_IDS = 32
+
+
+def normalize_topic_id(topic_id):
+    if isinstance(topic_id, str) and ObjectId.is_valid(topic_id):
+        return ObjectId(topic_id)
+    return topic_id
 
-def process_snapshot(db, snapshot: Dict[str, Any], attempt_window_size: int, accuracy_weight: float) -> Dict[str, int]:
-    user_id = snapshot['userId']
-    questions_history = snapshot.get('questionsHistory', [])
-    now = datetime.utcnow()
-
-    # Upsert/get the UserTopicPerformance doc for this user
-    utp = db.usertopicperformances.find_one({'userId': user_id})
-    if not utp:
-        utp = {
-            'userId': user_id,
-            'topics': [],
-            'createdAt': now,
-            'updatedAt': now,
-        }
-        utp_id = db.usertopicperformances.insert_one(utp).inserted_id
-        utp['_id'] = utp_id
-
-    topics_changed = set()
-    questions_processed = 0
-    skipped_questions = 0
-    attempts_added = 0
 
-    for entry in questions_history:
+def collect_snapshot_attempts(snapshot: Dict[str, Any]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, int]]:
+    """
+    Group the graded attempts of a snapshot by topic, keeping answer order.
+    Returns ({str(topicId): {'topicId': id, 'values': [0/1, ...]}}, counters)
+    """
+    by_topic: Dict[str, Dict[str, Any]] = {}
+    counters = {'questions_processed': 0, 'skipped_questions': 0, 'attempts_added': 0}
+
+    for entry in snapshot.get('questionsHistory', []):
         # Skip if correctOption missing
         if entry.get('correctOption', None) is None:
-            skipped_questions += 1
+            counters['skipped_questions'] += 1
             continue
         is_correct = 1 if entry.get('userOptionChoice') == entry.get('correctOption') else 0
         applied_to_topics = 0
         for topic in (entry.get('topics') or []):
-            topic_id = topic.get('topicId')
+            topic_id = normalize_topic_id(topic.get('topicId'))
             if not topic_id:
                 continue
-            idx = ensure_topic_entry(utp, topic_id)
-            # Push attempt
-            utp['topics'][idx]['attemptsWindow'].append({
-                'timestamp': now,
-                'value': is_correct
-            })
-            # Enforce window size
-            aw = utp['topics'][idx]['attemptsWindow']
-            if len(aw) > attempt_window_size:
-                utp['topics'][idx]['attemptsWindow'] = aw[-attempt_window_size:]
-            topics_changed.add(idx)
+            by_topic.setdefault(str(topic_id), {'topicId': topic_id, 'values': []})['values'].append(is_correct)
             applied_to_topics += 1
-        attempts_added += applied_to_topics
-        questions_processed += 1 if applied_to_topics > 0 else 0
-
-    # After applying all attempts from this snapshot, compute one WMA update per touched topic
-    for idx in topics_changed:
-        aw = utp['topics'][idx]['attemptsWindow']
-        wma = compute_wma(aw, accuracy_weight)
-        utp['topics'][idx]['accuracyHistory'].append({
-            'timestamp': now,
-            'accuracy': wma
-        })
-
-    if topics_changed:
-        utp['updatedAt'] = now
-        # Write back entire doc (simple, safe for low volume worker)
-        db.usertopicperformances.replace_one({'_id': utp['_id']}, utp)
+        counters['attempts_added'] += applied_to_topics
+        counters['questions_processed'] += 1 if applied_to_topics > 0 else 0
+    return by_topic, counters
+
+
+def load_topic_windows(db, user_id, topic_ids: List[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Fetch only the attempt windows of the given topics (never accuracyHistory) plus the document version.
+    `loaded` lists the topic keys the state is authoritative for (present or not).
+    Returns None when the user has no UserTopicPerformance document yet.
+    """
+    candidates = list(topic_ids) + [str(topic_id) for topic_id in topic_ids]
+    pipeline = [
+        {'$match': {'userId': user_id}},
+        {'$limit': 1},
+        {'$project': {
+            'version': 1,
+            'topics': {'$map': {
+                'input': {'$filter': {
+                    'input': {'$ifNull': ['$topics', []]},
+                    'cond': {'$in': ['$$this.topicId', candidates]}
+                }},
+                'in': {
+                    'topicId': '$$this.topicId',
+                    'attemptsWindow': '$$this.attemptsWindow',
+                    'attemptSeq': '$$this.attemptSeq',
+                    'appliedSnapshotIds': '$$this.appliedSnapshotIds',
+                    'summary': '$$this.summary'
+                }
+            }}
+        }}
+    ]
+    docs = list(db.usertopicperformances.aggregate(pipeline))
+    if not docs:
+        return None
+    doc = docs[0]
     return {
-        'questions_processed': questions_processed,
-        'skipped_questions': skipped_questions,
-        'attempts_added': attempts_added,
-        'topics_touched': len(topics_changed)
+        '_id': doc['_id'],
+        'version': doc.get('version'),
+        'topics': {str(entry['topicId']): entry for entry in doc.get('topics', [])},
+        'loaded': {str(topic_id) for topic_id in topic_ids}
     }
 
 
-def main():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
-    mongo_uri, attempt_window_size, accuracy_weight = load_config()
-    client = MongoClient(mongo_uri)
-    db = client.get_default_database()  # projectx from URI
-    logging.info(f"Connected to MongoDB database: {db.name}")
+def snapshot_timestamps(snapshots: List[Dict[str, Any]], now: datetime) -> List[datetime]:
+    """Time of each snapshot's accuracy points: its createdAt, or now; at the millisecond precision MongoDB stores"""
+    timestamps = []
+    for snapshot in snapshots:
+        timestamp = snapshot.get('createdAt') if isinstance(snapshot.get('createdAt'), datetime) else now
+        timestamps.append(timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000))
+    return timestamps
 
-    while True:
-        try:
-            # Atomically claim the oldest pending snapshot: status 0 -> 1
-            claimed = db.userlevelsessionperformances.find_one_and_update(
-                {'status': 0},
-                {'$set': {'status': 1}},
-                sort=[('createdAt', 1)],
-                return_document=ReturnDocument.AFTER
+
+def plan_topic_update(topic_key: str, stored_entry: Optional[Dict[str, Any]], snapshot_attempts: List[Dict[str, Dict[str, Any]]],
+                      attempt_window_size: int, accuracy_weight: float, timestamps: List[datetime],
+                      snapshot_ids: List[Any]) -> Dict[str, Any]:
+    """
+    Replay the snapshots' attempts for one topic on its stored window. `timestamps` and `snapshot_ids`
+    hold one entry per snapshot; snapshots already in the topic's appliedSnapshotIds are skipped, and
+    the topic's history points are kept strictly increasing (readers pick the newest point with >).
+    """
+    stored_entry = stored_entry or {}
+    already_applied = set(stored_entry.get('appliedSnapshotIds') or [])
+    applied = []
+    window = AttemptWindow(attempt_window_size, accuracy_weight,
+                           stored_entry.get('attemptsWindow') or [], stored_entry.get('attemptSeq'))
+    new_points = []
+    history_points = []
+    previous_accuracy = (stored_entry.get('summary') or {}).get('accuracy')
+    last_timestamp = (stored_entry.get('summary') or {}).get('timestamp')
+    for index, (by_topic, timestamp, snapshot_id) in enumerate(zip(snapshot_attempts, timestamps, snapshot_ids)):
+        topic_attempts = by_topic.get(topic_key)
+        if not topic_attempts or (snapshot_id is not None and snapshot_id in already_applied):
+            continue
+        applied.append(index)
+        if isinstance(last_timestamp, datetime) and timestamp <= last_timestamp:
+            timestamp = last_timestamp + timedelta(milliseconds=1)
+        last_timestamp = timestamp
+        # The sequence number keeps attempts of one snapshot in answer order
+        for value in topic_attempts['values']:
+            point = window.push(value, timestamp)
+            if point is not None:
+                new_points.append(point)
+        # One WMA update per touched topic per snapshot
+        history_points.append({'timestamp': timestamp, 'accuracy': window.wma()})
+    if len(history_points) > 1:
+        previous_accuracy = history_points[-2]['accuracy']
+    latest = history_points[-1] if history_points else None
+    applied_ids = [snapshot_ids[index] for index in applied if snapshot_ids[index] is not None]
+    return {
+        'applied': applied,
+        'applied_ids': (list(stored_entry.get('appliedSnapshotIds') or []) + applied_ids)[-APPLIED_SNAPSHOT_IDS:],
+        'new_points': new_points,
+        'window': window.to_list(),
+        'history_points': history_points,
+        'next_seq': window.next_seq,
+        'summary': build_topic_summary(latest, previous_accuracy, window.next_seq) if latest else stored_entry.get('summary')
+    }
+
+
+def build_topic_summary(latest: Optional[Dict[str, Any]], previous_accuracy: Optional[float], attempt_count: int) -> Dict[str, Any]:
+    """Compact per-topic summary so readers can project it instead of scanning accuracyHistory"""
+    accuracy = latest['accuracy'] if latest else None
+    return {
+        'accuracy': accuracy,
+        'timestamp': latest['timestamp'] if latest else None,
+        'attemptCount': attempt_count,
+        'trend': (accuracy - previous_accuracy) if accuracy is not None and previous_accuracy is not None else 0.0
+    }
+
+
+def apply_snapshots(db, user_id, snapshots: List[Dict[str, Any]], attempt_window_size: int,
+                    accuracy_weight: float, now: datetime = None) -> Dict[str, int]:
+    """
+    Apply a user's snapshots (oldest first) with targeted updates: only the touched topics'
+    attempt windows are read, and each write pushes the new attempts ($push + $slice), appends
+    accuracy points and bumps a version, conditional on the version read. A concurrent writer
+    makes the condition fail and the remaining topics are replayed on fresh state.
+    """
+    totals, _ = apply_snapshots_with_state(db, user_id, snapshots, attempt_window_size, accuracy_weight, now)
+    return totals
+
+
+def apply_snapshots_with_state(db, user_id, snapshots: List[Dict[str, Any]], attempt_window_size: int,
+                               accuracy_weight: float, now: datetime = None,
+                               state: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, int], Dict[str, Any]]:
+    """
+    apply_snapshots starting from a known state (as returned by load_topic_windows, e.g. cached)
+    instead of reading it first. Returns the totals and the state after the writes.
+    totals['topic_changes'] lists per written topic the attempts, correct answers and accuracy
+    before/after, for topic_stats.
+    """
+    now = now or datetime.utcnow()
+    timestamps = snapshot_timestamps(snapshots, now)
+    snapshot_ids = [snapshot.get('_id') for snapshot in snapshots]
+    snapshot_attempts = []
+    totals = {'questions_processed': 0, 'skipped_questions': 0, 'attempts_added': 0, 'topics_touched': 0}
+    topic_changes = []
+    topic_ids: Dict[str, Any] = {}
+    for snapshot in snapshots:
+        by_topic, counters = collect_snapshot_attempts(snapshot)
+        snapshot_attempts.append(by_topic)
+        for key, value in counters.items():
+            totals[key] += value
+        for topic_key, topic_attempts in by_topic.items():
+            topic_ids.setdefault(topic_key, topic_attempts['topicId'])
+    totals['topics_touched'] = len(topic_ids)
+
+    pending = list(topic_ids)
+    for _ in range(MAX_UPDATE_RETRIES):
+        if not pending:
+            totals['topic_changes'] = topic_changes
+            return totals, state
+        if state is None:
+            state = load_topic_windows(db, user_id, [topic_ids[key] for key in pending])
+        if state is None:
+            # accuracyConfig: a new user is already consistent with the config the worker runs under,
+            # so topic_accuracy_recompute.py does not select it
+            db.usertopicperformances.update_one(
+                {'userId': user_id},
+                {'$setOnInsert': {'userId': user_id, 'topics': [], 'version': 0, 'createdAt': now, 'updatedAt': now,
+                                  'accuracyConfig': {'windowSize': attempt_window_size, 'weight': accuracy_weight}}},
+                upsert=True
             )
+            continue
 
-            if not claimed:
-                time.sleep(10)
+        missing = [key for key in pending if key not in state['topics']]
+        # New topic entries and updates inside topics[] would conflict in one update: add new topics first
+        targets = missing or pending
+        update: Dict[str, Any] = {'$set': {'updatedAt': now}, '$inc': {'version': 1}}
+        array_filters = None
+        # State of the target topics once the write succeeds
+        written: Dict[str, Dict[str, Any]] = {}
+        plans: Dict[str, Dict[str, Any]] = {}
+        if missing:
+            new_entries = []
+            for key in missing:
+                plan = plans[key] = plan_topic_update(key, None, snapshot_attempts, attempt_window_size, accuracy_weight,
+                                                      timestamps, snapshot_ids)
+                new_entries.append({
+                    'topicId': topic_ids[key],
+                    'attemptsWindow': plan['window'],
+                    'attemptSeq': plan['next_seq'],
+                    'appliedSnapshotIds': plan['applied_ids'],
+                    'accuracyHistory': plan['history_points'],
+                    'summary': plan['summary']
+                })
+                written[key] = {'topicId': topic_ids[key], 'attemptsWindow': plan['window'], 'attemptSeq': plan['next_seq'],
+                                'appliedSnapshotIds': plan['applied_ids'], 'summary': plan['summary']}
+            update['$push'] = {'topics': {'$each': new_entries}}
+        else:
+            push: Dict[str, Any] = {}
+            array_filters = []
+            for key in targets:
+                stored_entry = state['topics'][key]
+                plan = plans[key] = plan_topic_update(key, stored_entry, snapshot_attempts, attempt_window_size, accuracy_weight,
+                                                      timestamps, snapshot_ids)
+                if not plan['applied']:
+                    # Every snapshot touching this topic was applied before (re-queued after a crash)
+                    written[key] = stored_entry
+                    continue
+                written[key] = {'topicId': stored_entry['topicId'], 'attemptsWindow': plan['window'], 'attemptSeq': plan['next_seq'],
+                                'appliedSnapshotIds': plan['applied_ids'], 'summary': plan['summary']}
+                ident = f't{len(array_filters)}'
+                push[f'topics.$[{ident}].attemptsWindow'] = {'$each': plan['new_points'], '$slice': -attempt_window_size}
+                push[f'topics.$[{ident}].accuracyHistory'] = {'$each': plan['history_points']}
+                update['$set'][f'topics.$[{ident}].attemptSeq'] = plan['next_seq']
+                update['$set'][f'topics.$[{ident}].appliedSnapshotIds'] = plan['applied_ids']
+                update['$set'][f'topics.$[{ident}].summary'] = plan['summary']
+                array_filters.append({f'{ident}.topicId': stored_entry['topicId']})
+            if not push:
+                pending = [key for key in pending if key not in targets]
                 continue
+            update['$push'] = push
+
+        version_filter = {'$exists': False} if state['version'] is None else state['version']
+        with STAGE_SECONDS.time(stage='update'):
+            result = db.usertopicperformances.update_one(
+                {'_id': state['_id'], 'version': version_filter}, update, array_filters=array_filters
+            )
+        if result.matched_count:
+            pending = [key for key in pending if key not in targets]
+            for key, entry in written.items():
+                if plans[key]['applied']:
+                    applied_attempts = [snapshot_attempts[index] for index in plans[key]['applied']]
+                    topic_changes.append(topic_change(key, state['topics'].get(key), entry, applied_attempts))
+            state['topics'].update(written)
+            state['loaded'].update(written)
+            state['version'] = (state['version'] or 0) + 1
+        else:
+            logging.debug(f"Concurrent update on UserTopicPerformance of user {user_id}, retrying")
+            state = None
+
+    if pending:
+        raise RuntimeError(f"Gave up updating UserTopicPerformance of user {user_id} after {MAX_UPDATE_RETRIES} attempts")
+    totals['topic_changes'] = topic_changes
+    return totals, state
+
+
+def topic_change(topic_key: str, stored_entry: Optional[Dict[str, Any]], written_entry: Dict[str, Any],
+                 snapshot_attempts: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    What one topic write means for the cross-user topic stats. A topic counts towards the stats
+    once it has a summary (as in topic_stats --rebuild), so a topic without one is new to them.
+    """
+    values = [value for by_topic in snapshot_attempts for value in by_topic.get(topic_key, {}).get('values', [])]
+    before = ((stored_entry or {}).get('summary') or {}).get('accuracy')
+    return {
+        'topicId': written_entry['topicId'],
+        'attempts': len(values),
+        'correct': sum(values),
+        'before': before,
+        'after': written_entry['summary']['accuracy']
+    }
+
+
+def process_snapshot(db, snapshot: Dict[str, Any], attempt_window_size: int, accuracy_weight: float) -> Dict[str, int]:
+    return apply_snapshots(db, snapshot['userId'], [snapshot], attempt_window_size, accuracy_weight)
+
+
+def summarize_history(topic: Dict[str, Any]) -> Dict[str, Any]:
+    """Summary of a topic computed from its stored history (used by the backfill)"""
+    history = sorted(
+        (point for point in topic.get('accuracyHistory') or [] if isinstance(point.get('timestamp'), datetime)),
+        key=lambda point: point['timestamp']
+    )
+    latest = history[-1] if history else None
+    previous_accuracy = history[-2]['accuracy'] if len(history) > 1 else None
+    attempt_count = topic.get('attemptSeq') or len(topic.get('attemptsWindow') or [])
+    return build_topic_summary(latest, previous_accuracy, attempt_count)
+
+
+def backfill_topic_summaries(db, batch_size: int = 500, stats: Optional[TopicStatsRecorder] = None) -> Dict[str, int]:
+    """
+    One-shot migration: add topics[].summary to users written before the worker maintained it.
+    Uses the same version check as the worker; users changed concurrently are left for the next run
+    (the worker itself writes the summary of every topic it touches). With stats, the topics that
+    get a summary are added to the topic stats distributions.
+    """
+    collection = db.usertopicperformances
+    totals = {'users': 0, 'topics': 0, 'conflicts': 0}
+    cursor = collection.find(
+        {'topics': {'$elemMatch': {'summary': {'$exists': False}}}},
+        {'userId': 1, 'topics.topicId': 1, 'topics.accuracyHistory': 1, 'topics.attemptSeq': 1,
+         'topics.attemptsWindow': 1, 'topics.summary': 1, 'version': 1}
+    ).batch_size(batch_size)
+    for doc in cursor:
+        update_set = {}
+        array_filters = []
+        changes = []
+        for topic in doc.get('topics', []):
+            if 'summary' in topic:
+                continue
+            ident = f't{len(array_filters)}'
+            summary = summarize_history(topic)
+            update_set[f'topics.$[{ident}].summary'] = summary
+            array_filters.append({f'{ident}.topicId': topic['topicId']})
+            changes.append({'topicId': topic['topicId'], 'attempts': 0, 'correct': 0, 'before': None, 'after': summary['accuracy']})
+        if not array_filters:
+            continue
+        version = doc.get('version')
+        result = collection.update_one(
+            {'_id': doc['_id'], 'version': {'$exists': False} if version is None else version},
+            {'$set': update_set, '$inc': {'version': 1}},
+            array_filters=array_filters
+        )
+        if result.matched_count:
+            totals['users'] += 1
+            totals['topics'] += len(array_filters)
+            if stats:
+                stats.add(doc['userId'], changes)
+                if totals['users'] % batch_size == 0:
+                    flush_topic_stats(stats)
+        else:
+            totals['conflicts'] += 1
+    flush_topic_stats(stats)
+    logging.info(f"Summary backfill complete: users={totals['users']} topics={totals['topics']} conflicts={totals['conflicts']}")
+    return totals
+
+
+# userId hash space split between partitioned workers
+HASH_SLOTS = 4096
+HEX_DIGITS = '0123456789abcdef'
+# An unpartitioned worker only re-queues claims older than this (claimedAt): younger ones may belong to a live worker
+DEFAULT_CLAIM_LEASE_SECONDS = 300
+
+
+def user_hash_slot(user_id) -> int:
+    """
+    Slot of a userId in [0, HASH_SLOTS): the last three hex digits of the ObjectId, i.e. the low
+    bits of its counter, which are uniformly spread. Must match user_hash_slot_expr.
+    """
+    return int(str(user_id)[-3:].lower(), 16)
+
+
+def user_hash_slot_expr(field: str = '$userId') -> Dict[str, Any]:
+    """Aggregation expression computing user_hash_slot server-side"""
+    hex_id = {'$toLower': {'$toString': field}}
+    digits = [
+        {'$indexOfBytes': [HEX_DIGITS, {'$substrBytes': [hex_id, {'$subtract': [{'$strLenBytes': hex_id}, 3 - i]}, 1]}]}
+        for i in range(3)
+    ]
+    return {'$add': [{'$multiply': [digits[0], 256]}, {'$multiply': [digits[1], 16]}, digits[2]]}
+
+
+def partition_slots(index: int, count: int) -> Tuple[int, int]:
+    """[start, end) slot range owned by partition index of count"""
+    return index * HASH_SLOTS // count, (index + 1) * HASH_SLOTS // count
+
+
+def snapshot_filter(status: int, partition: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+    """Snapshots with this status, restricted to the userId hash range of partition (index, count)"""
+    query: Dict[str, Any] = {'status': status}
+    if partition and partition[1] > 1:
+        start, end = partition_slots(*partition)
+        slot = user_hash_slot_expr()
+        query['$expr'] = {'$and': [{'$gte': [slot, start]}, {'$lt': [slot, end]}]}
+    return query
+
 
-            logging.info(f"Claimed snapshot _id={claimed['_id']} userId={claimed.get('userId')} history_count={len(claimed.get('questionsHistory', []))}")
-            # Process it
+def requeue_orphaned_snapshots(db, partition: Optional[Tuple[int, int]] = None,
+                               lease_seconds: float = DEFAULT_CLAIM_LEASE_SECONDS) -> int:
+    """
+    Put snapshots left claimed (status 1) back to pending. A partitioned worker is the sole owner
+    of its partition, so everything claimed there is orphaned once it starts. Without a partition
+    other live workers share the queue, so only claims older than lease_seconds (or without a
+    claimedAt) are re-queued. Snapshots that were applied but not acknowledged are skipped on
+    replay (see APPLIED_SNAPSHOT_IDS).
+    """
+    query = snapshot_filter(1, partition)
+    if not partition:
+        cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+        query['$or'] = [{'claimedAt': {'$lt': cutoff}}, {'claimedAt': {'$exists': False}}]
+    result = db.userlevelsessionperformances.update_many(
+        query, {'$set': {'status': 0}, '$unset': {'batchId': '', 'claimedAt': ''}}
+    )
+    if result.modified_count:
+        scope = f"partition {partition[0]}/{partition[1]}" if partition else f"the queue (claims older than {lease_seconds:g}s)"
+        logging.warning(f"Re-queued {result.modified_count} snapshots left claimed in {scope}")
+    return result.modified_count
+
+
+def claim_snapshot_batch(db, batch_size: int, partition: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
+    """Claim up to batch_size of the oldest pending snapshots (status 0 -> 1), oldest first"""
+    batch_id = ObjectId()
+    candidate_ids = [
+        doc['_id'] for doc in db.userlevelsessionperformances.find(snapshot_filter(0, partition), {'_id': 1})
+        .sort('createdAt', 1).limit(batch_size)
+    ]
+    if not candidate_ids:
+        return []
+    # Only snapshots still pending are claimed, so concurrent claimers never share one
+    db.userlevelsessionperformances.update_many(
+        {'_id': {'$in': candidate_ids}, 'status': 0},
+        {'$set': {'status': 1, 'batchId': batch_id, 'claimedAt': datetime.utcnow()}}
+    )
+    return list(db.userlevelsessionperformances.find({'batchId': batch_id}).sort('createdAt', 1))
+
+
+def flush_topic_stats(stats: Optional[TopicStatsRecorder]):
+    """Write a batch's topic stats increments; a failure there must not fail the applied snapshots"""
+    if not stats:
+        return
+    try:
+        with STAGE_SECONDS.time(stage='topic_stats'):
+            stats.flush()
+    except Exception:
+        logging.exception("Could not update topic stats")
+
+
+def acknowledge_snapshots(db, done_ids: List[Any], failures: List[Tuple[Any, str]]):
+    """Mark snapshots done (status 2) or failed (status -1 with the error) in one bulk write"""
+    status_updates = [
+        UpdateOne({'_id': snapshot_id}, {'$set': {'status': -1, 'error': error}, '$unset': {'batchId': ''}})
+        for snapshot_id, error in failures
+    ]
+    if done_ids:
+        status_updates.append(UpdateMany({'_id': {'$in': done_ids}}, {'$set': {'status': 2}, '$unset': {'batchId': ''}}))
+    if not status_updates:
+        return
+    with STAGE_SECONDS.time(stage='ack'):
+        db.userlevelsessionperformances.bulk_write(status_updates, ordered=False)
+    SNAPSHOTS_FAILED.inc(len(failures))
+
+
+def process_snapshot_batch(db, batch_size: int, attempt_window_size: int, accuracy_weight: float,
+                           partition: Optional[Tuple[int, int]] = None,
+                           stats: Optional[TopicStatsRecorder] = None) -> int:
+    """
+    Claim a window of pending snapshots, group them by user (keeping each user's chronological
+    order) and apply each group with one targeted write. Status changes go out as one bulk write.
+    Returns number of claimed snapshots.
+    """
+    started = time.monotonic()
+    with STAGE_SECONDS.time(stage='claim'):
+        snapshots = claim_snapshot_batch(db, batch_size, partition)
+    if not snapshots:
+        return 0
+    created = [s['createdAt'] for s in snapshots if isinstance(s.get('createdAt'), datetime)]
+    if created:
+        QUEUE_LAG.set((datetime.utcnow() - min(created)).total_seconds())
+
+    by_user: Dict[Any, List[Dict[str, Any]]] = {}
+    for snapshot in snapshots:
+        by_user.setdefault(snapshot['userId'], []).append(snapshot)
+
+    failures = []
+    done_ids = []
+    attempts_added = 0
+    for user_id, user_snapshots in by_user.items():
+        try:
+            with STAGE_SECONDS.time(stage='process_snapshot'):
+                result = apply_snapshots(db, user_id, user_snapshots, attempt_window_size, accuracy_weight)
+            done_ids.extend(snapshot['_id'] for snapshot in user_snapshots)
+            attempts_added += result['attempts_added']
+            if stats:
+                stats.add(user_id, result['topic_changes'])
+        except Exception as e:
+            logging.exception(f"Processing failed for {len(user_snapshots)} snapshots of userId={user_id}")
+            failures.extend((snapshot['_id'], str(e)) for snapshot in user_snapshots)
+
+    flush_topic_stats(stats)
+    acknowledge_snapshots(db, done_ids, failures)
+    elapsed = time.monotonic() - started
+    SNAPSHOTS_PROCESSED.inc(len(done_ids))
+    ATTEMPTS_APPLIED.inc(attempts_added)
+    BATCH_SECONDS.observe(elapsed)
+    for _ in done_ids:
+        SNAPSHOT_SECONDS.observe(elapsed / len(snapshots))
+    logging.info(
+        f"Processed batch of {len(snapshots)} snapshots for {len(by_user)} users in {elapsed:.3f}s "
+        f"| done={len(done_ids)} failed={len(snapshots) - len(done_ids)} attempts_added={attempts_added}"
+    )
+    return len(snapshots)
+
+
+class TopicPerformanceCache:
+    """
+    Write-behind LRU cache of users' topic windows for bursty traffic (a class finishing levels
+    back to back). Claimed snapshots are queued per user and applied on flush, starting from
+    the cached state instead of re-reading it; writes stay conditional on the cached version,
+    so a concurrent writer (compactor, recompute, another worker) only costs a re-read.
+    Snapshots are acknowledged after their flush, so a crash leaves them claimed and they are
+    re-queued (see requeue_orphaned_snapshots) rather than lost.
+    """
+
+    def __init__(self, db, attempt_window_size: int, accuracy_weight: float, max_bytes: int,
+                 flush_interval: float, flush_batch: int, stats: Optional[TopicStatsRecorder] = None):
+        self.db = db
+        self.stats = stats
+        self.attempt_window_size = attempt_window_size
+        self.accuracy_weight = accuracy_weight
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        # userId -> {'state': load_topic_windows() state or None, 'bytes': int, 'pending': [snapshots]}
+        self.entries: 'OrderedDict[Any, Dict[str, Any]]' = OrderedDict()
+        self.pending_count = 0
+        self.total_bytes = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, snapshot: Dict[str, Any]):
+        user_id = snapshot['userId']
+        entry = self.entries.get(user_id)
+        if entry is None:
+            entry = {'state': None, 'bytes': 0, 'pending': []}
+            self.entries[user_id] = entry
+        self.entries.move_to_end(user_id)
+        entry['pending'].append(snapshot)
+        self.pending_count += 1
+
+    def due(self) -> bool:
+        if not self.pending_count:
+            return False
+        return self.pending_count >= self.flush_batch or time.monotonic() - self.last_flush >= self.flush_interval
+
+    def _state_for(self, user_id, entry: Dict[str, Any], topic_ids: List[Any]) -> Optional[Dict[str, Any]]:
+        """Cached state covering topic_ids, reading only the topics not cached yet"""
+        state = entry['state']
+        unknown = [topic_id for topic_id in topic_ids if state is None or str(topic_id) not in state['loaded']]
+        if not unknown:
+            CACHE_LOOKUPS.inc(result='hit')
+            return state
+        CACHE_LOOKUPS.inc(result='miss')
+        fresh = load_topic_windows(self.db, user_id, unknown)
+        if state is None or fresh is None:
+            return fresh
+        if fresh['version'] != state['version']:
+            # Written by someone else since it was cached: start over from the stored document
+            return load_topic_windows(self.db, user_id, topic_ids)
+        state['topics'].update(fresh['topics'])
+        state['loaded'].update(fresh['loaded'])
+        return state
+
+    def _store(self, entry: Dict[str, Any], state: Optional[Dict[str, Any]]):
+        entry['state'] = state
+        self.total_bytes -= entry['bytes']
+        entry['bytes'] = len(bson.encode({'topics': state['topics']})) if state else 0
+        self.total_bytes += entry['bytes']
+
+    def flush(self) -> int:
+        """Apply all queued snapshots, acknowledge them and evict down to the memory budget"""
+        started = time.monotonic()
+        done_ids = []
+        failures = []
+        attempts_added = 0
+        users = 0
+        for user_id, entry in list(self.entries.items()):
+            snapshots = entry['pending']
+            if not snapshots:
+                continue
+            entry['pending'] = []
+            users += 1
             try:
-                result = process_snapshot(db, claimed, attempt_window_size, accuracy_weight)
+                topic_ids: Dict[str, Any] = {}
+                for snapshot in snapshots:
+                    by_topic, _ = collect_snapshot_attempts(snapshot)
+                    for topic_key, topic_attempts in by_topic.items():
+                        topic_ids.setdefault(topic_key, topic_attempts['topicId'])
+                state = self._state_for(user_id, entry, list(topic_ids.values())) if topic_ids else entry['state']
+                with STAGE_SECONDS.time(stage='process_snapshot'):
+                    result, state = apply_snapshots_with_state(
+                        self.db, user_id, snapshots, self.attempt_window_size, self.accuracy_weight, state=state
+                    )
+                self._store(entry, state)
+                done_ids.extend(snapshot['_id'] for snapshot in snapshots)
+                attempts_added += result['attempts_added']
+                if self.stats:
+                    self.stats.add(user_id, result['topic_changes'])
             except Exception as e:
-                # mark failed
-                db.userlevelsessionperformances.update_one({'_id': claimed['_id']}, {'$set': {'status': -1, 'error': str(e)}})
-                logging.exception(f"Processing failed for snapshot _id={claimed['_id']}")
-                continue
+                logging.exception(f"Processing failed for {len(snapshots)} snapshots of userId={user_id}")
+                failures.extend((snapshot['_id'], str(e)) for snapshot in snapshots)
+                self._store(entry, None)
+
+        flush_topic_stats(self.stats)
+        acknowledge_snapshots(self.db, done_ids, failures)
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
 
-            # Mark as processed
-            db.userlevelsessionperformances.update_one({'_id': claimed['_id']}, {'$set': {'status': 2}})
+        # Everything is flushed, so any entry can go; least recently used first
+        while self.total_bytes > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry['bytes']
+        CACHE_BYTES.set(self.total_bytes)
+        CACHE_USERS.set(len(self.entries))
+
+        elapsed = self.last_flush - started
+        SNAPSHOTS_PROCESSED.inc(len(done_ids))
+        ATTEMPTS_APPLIED.inc(attempts_added)
+        if done_ids or failures:
             logging.info(
-                f"Processed snapshot _id={claimed['_id']} | questions={result['questions_processed']} "
-                f"skipped={result['skipped_questions']} attempts_added={result['attempts_added']} "
-                f"topics_touched={result['topics_touched']}"
+                f"Flushed {len(done_ids) + len(failures)} snapshots for {users} users in {elapsed:.3f}s "
+                f"| done={len(done_ids)} failed={len(failures)} attempts_added={attempts_added} "
+                f"cached_users={len(self.entries)} cached_bytes={self.total_bytes}"
             )
+        return len(done_ids) + len(failures)
 
-        except Exception as outer:
-            # Backoff a bit on unexpected errors
-            logging.exception("Worker loop error")
-            time.sleep(10)
 
+def ensure_indexes(db):
+    """One UserTopicPerformance document per user keeps upserts from racing into duplicates"""
+    try:
+        db.usertopicperformances.create_index([('userId', 1)], name='userId_unique', unique=True)
+    except OperationFailure as e:
+        logging.warning(f"Could not create unique userId index on usertopicperformances: {e}")
+    db.userlevelsessionperformances.create_index([('status', 1), ('createdAt', 1)], name='status_createdAt')
+    # Batch claims look their snapshots up by batchId
+    db.userlevelsessionperformances.create_index([('batchId', 1)], name='batchId', sparse=True)
 
-if __name__ == '__main__':
-    main()
 
+def run_worker(args, partition: Optional[Tuple[int, int]] = None, stop_event=None, metrics_port: int = 0):
+    """
+    Claim and apply snapshots until stopped. With a partition (index, count) only snapshots of
+    users in that userId hash range are claimed, so each user is owned by exactly one worker
+    and their snapshots are applied strictly in createdAt order.
+    """
+    mongo_uri, attempt_window_size, accuracy_weight = load_config()
+    client = MongoClient(mongo_uri)
+    db = client.get_default_database()  # projectx from URI
+    if partition:
+        logging.info(f"Partition {partition[0]}/{partition[1]} owns userId slots {partition_slots(*partition)}")
+    requeue_orphaned_snapshots(db, partition, args.claim_lease_seconds)
+    last_requeue = time.monotonic()
+
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    if args.metrics_summary_interval:
+        start_summary_logger(args.metrics_summary_interval)
+
+    waiter = None
+    if args.event_driven:
+        waiter = WorkWaiter(db.userlevelsessionperformances, 0, max_interval=args.interval)
+        logging.info(f"Event-driven wakeup enabled ({waiter.mode})")
+
+    stats = None
+    if args.topic_stats:
+        stats = TopicStatsRecorder(db, ScopeResolver(db, args.topic_stats_scopes))
+        logging.info(f"Maintaining topic stats (scopes: all {' '.join(args.topic_stats_scopes)})")
+
+    cache = None
+    if args.cache_mb > 0:
+        cache = TopicPerformanceCache(db, attempt_window_size, accuracy_weight, int(args.cache_mb * 1024 * 1024),
+                                      args.flush_interval, args.flush_batch, stats)
+        logging.info(f"Write-behind cache enabled ({args.cache_mb:g} MB, flush every {args.flush_interval:g}s "
+                     f"or {args.flush_batch} snapshots)")
 
+    try:
+        while not (stop_event and stop_event.is_set()):
+            try:
+                if not partition and time.monotonic() - last_requeue >= args.claim_lease_seconds / 2:
+                    # Claims of a crashed unpartitioned worker: nobody else restarts for them
+                    requeue_orphaned_snapshots(db, None, args.claim_lease_seconds)
+                    last_requeue = time.monotonic()
+                if cache:
+                    with STAGE_SECONDS.time(stage='claim'):
+                        claimed_batch = claim_snapshot_batch(db, max(args.batch_size, 1), partition)
+                    created = [s['createdAt'] for s in claimed_batch if isinstance(s.get('createdAt'), datetime)]
+                    if created:
+                        QUEUE_LAG.set((datetime.utcnow() - min(created)).total_seconds())
+                    for snapshot in claimed_batch:
+                        cache.add(snapshot)
+                    # Nothing new to claim: flush now rather than holding acks while idle
+                    if cache.due() or (not claimed_batch and cache.pending_count):
+                        cache.flush()
+                    if claimed_batch:
+                        if waiter:
+                            waiter.reset()
+                    elif waiter:
+                        waiter.wait()
+                    else:
+                        time.sleep(args.interval)
+                    continue
+
+                if args.batch_size > 1:
+                    if process_snapshot_batch(db, args.batch_size, attempt_window_size, accuracy_weight, partition, stats):
+                        if waiter:
+                            waiter.reset()
+                    elif waiter:
+                        waiter.wait()
+                    else:
+                        time.sleep(args.interval)
+                    continue
+
+                started = time.monotonic()
+                # Atomically claim the oldest pending snapshot: status 0 -> 1
+                with STAGE_SECONDS.time(stage='claim'):
+                    claimed = db.userlevelsessionperformances.find_one_and_update(
+                        snapshot_filter(0, partition),
+                        {'$set': {'status': 1, 'claimedAt': datetime.utcnow()}},
+                        sort=[('createdAt', 1)],
+                        return_document=ReturnDocument.AFTER
+                    )
+
+                if not claimed:
+                    if waiter:
+                        waiter.wait()
+                    else:
+                        time.sleep(args.interval)
+                    continue
+                if waiter:
+                    waiter.reset()
+                if isinstance(claimed.get('createdAt'), datetime):
+                    QUEUE_LAG.set((datetime.utcnow() - claimed['createdAt']).total_seconds())
+
+                logging.info(f"Claimed snapshot _id={claimed['_id']} userId={claimed.get('userId')} history_count={len(claimed.get('questionsHistory', []))}")
+                # Process it
+                try:
+                    with STAGE_SECONDS.time(stage='process_snapshot'):
+                        result = process_snapshot(db, claimed, attempt_window_size, accuracy_weight)
+                except Exception as e:
+                    # mark failed
+                    db.userlevelsessionperformances.update_one({'_id': claimed['_id']}, {'$set': {'status': -1, 'error': str(e)}})
+                    SNAPSHOTS_FAILED.inc()
+                    logging.exception(f"Processing failed for snapshot _id={claimed['_id']}")
+                    continue
+                if stats:
+                    stats.add(claimed['userId'], result['topic_changes'])
+                    flush_topic_stats(stats)
+
+                # Mark as processed
+                with STAGE_SECONDS.time(stage='ack'):
+                    db.userlevelsessionperformances.update_one({'_id': claimed['_id']}, {'$set': {'status': 2}})
+                SNAPSHOTS_PROCESSED.inc()
+                ATTEMPTS_APPLIED.inc(result['attempts_added'])
+                SNAPSHOT_SECONDS.observe(time.monotonic() - started)
+                logging.info(
+                    f"Processed snapshot _id={claimed['_id']} | questions={result['questions_processed']} "
+                    f"skipped={result['skipped_questions']} attempts_added={result['attempts_added']} "
+                    f"topics_touched={result['topics_touched']}"
+                )
+
+            except Exception as outer:
+                # Backoff a bit on unexpected errors
+                logging.exception("Worker loop error")
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if cache and cache.pending_count:
+            try:
+                cache.flush()
+            except Exception:
+                logging.exception("Final cache flush failed; unflushed snapshots stay claimed")
+        if waiter:
+            waiter.close()
+        client.close()
+
+
+def partition_layout(workers: int, pod_index: int, pod_count: int) -> List[Tuple[int, int]]:
+    """Partitions run by this pod: pod k of P with N workers owns partitions k*N .. k*N+N-1 of P*N"""
+    total = workers * pod_count
+    return [(pod_index * workers + i, total) for i in range(workers)]
+
+
+def stop_partition_workers(running: Dict[Tuple[int, int], Tuple[Any, Any]], grace_seconds: float):
+    """Ask workers to finish their current snapshot and exit; terminate the ones that do not"""
+    for process, stop_event in running.values():
+        stop_event.set()
+    deadline = time.monotonic() + grace_seconds
+    for process, _ in running.values():
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logging.warning(f"{process.name} did not stop within {grace_seconds}s, terminating")
+            process.terminate()
+            process.join()
+    running.clear()
+
+
+def run_supervisor(args):
+    """
+    Run one worker process per partition and keep them alive: a dead partition is restarted
+    (after re-queueing what it had claimed), and when the worker count changes (SIGHUP re-reads
+    TOPIC_PERFORMANCE_WORKERS from Services/.env) every worker is stopped before the new
+    layout starts, so no two processes ever own the same user.
+    """
+    desired = {'workers': args.workers}
+
+    def reload_worker_count(signum, frame):
+        load_dotenv(os.path.join(os.path.dirname(__file__), '.env'), override=True)
+        desired['workers'] = max(1, int(os.getenv('TOPIC_PERFORMANCE_WORKERS', desired['workers'])))
+        logging.info(f"Reload requested: {desired['workers']} workers")
+
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload_worker_count)
+
+    running: Dict[Tuple[int, int], Tuple[Any, Any]] = {}
+    layout: List[Tuple[int, int]] = []
+    try:
+        while True:
+            target = partition_layout(desired['workers'], args.pod_index, args.pod_count)
+            if target != layout:
+                if running:
+                    logging.info(f"Rebalancing from {len(layout)} to {len(target)} partitions")
+                    stop_partition_workers(running, args.stop_grace_seconds)
+                layout = target
+
+            for i, partition in enumerate(layout):
+                entry = running.get(partition)
+                if entry and entry[0].is_alive():
+                    continue
+                if entry:
+                    logging.warning(f"{entry[0].name} exited with code {entry[0].exitcode}, restarting")
+                stop_event = multiprocessing.Event()
+                process = multiprocessing.Process(
+                    target=run_worker,
+                    args=(args, partition, stop_event, args.metrics_port + i if args.metrics_port else 0),
+                    name=f"topic-worker-{partition[0]}"
+                )
+                process.start()
+                running[partition] = (process, stop_event)
+
+            time.sleep(args.supervise_interval)
+    except KeyboardInterrupt:
+        logging.info("Received interrupt signal. Stopping workers...")
+    finally:
+        stop_partition_workers(running, args.stop_grace_seconds)
+
+
+def main():
+    load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
+    parser = argparse.ArgumentParser(description='Apply level session snapshots to UserTopicPerformance')
+    parser.add_argument('--interval', type=float, default=10, help='Seconds to sleep when idle (max wait with --event-driven)')
+    parser.add_argument('--event-driven', action='store_true',
+                        help='Wake on new snapshots via change stream, or adaptive backoff polling when unavailable')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics on this local port (partition worker i uses port + i)')
+    parser.add_argument('--metrics-summary-interval', type=int, default=0, help='Log a metrics summary every N seconds (0 = off)')
+    parser.add_argument('--backfill-summaries', action='store_true', help='Add per-topic summaries to existing users, then exit (with --topic-stats also counts them in topic stats)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Claim up to N snapshots per cycle and write once per user (1 = one snapshot at a time)')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('TOPIC_PERFORMANCE_WORKERS', '1')),
+                        help='Worker processes, each owning a userId hash range (SIGHUP re-reads TOPIC_PERFORMANCE_WORKERS)')
+    parser.add_argument('--cache-mb', type=float, default=0,
+                        help='Write-behind cache of hot users\' topic windows with this memory budget (0 = off); '
+                             'best with --workers so a crashed worker\'s unflushed snapshots are re-queued')
+    parser.add_argument('--claim-lease-seconds', type=float, default=DEFAULT_CLAIM_LEASE_SECONDS,
+                        help='Without partitions, claimed snapshots older than this are re-queued (keep above --flush-interval)')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='Max seconds snapshots wait in the cache')
+    parser.add_argument('--flush-batch', type=int, default=200, help='Flush once this many snapshots are queued')
+    parser.add_argument('--topic-stats', action='store_true', help='Maintain the cross-user topicstats collection')
+    parser.add_argument('--topic-stats-scope', dest='topic_stats_scopes', action='append', choices=['org', 'batch'], default=[],
+                        help='Also keep topic stats per organization / batch (repeatable)')
+    parser.add_argument('--pod-index', type=int, default=0, help='Index of this pod when partitions are spread over pods')
+    parser.add_argument('--pod-count', type=int, default=1, help='Number of pods sharing the partitions (same --workers on each)')
+    parser.add_argument('--supervise-interval', type=float, default=5, help='Seconds between worker liveness checks')
+    parser.add_argument('--stop-grace-seconds', type=float, default=30, help='Time a worker gets to stop before it is terminated')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(processName)s %(message)s')
+    if not 0 <= args.pod_index < args.pod_count:
+        parser.error('--pod-index must be in [0, --pod-count)')
+
+    mongo_uri, _, _ = load_config()
+    client = MongoClient(mongo_uri)
+    db = client.get_default_database()  # projectx from URI
+    logging.info(f"Connected to MongoDB database: {db.name}")
+    ensure_indexes(db)
+    if args.topic_stats:
+        ensure_topic_stats_indexes(db)
+    if args.backfill_summaries:
+        stats = TopicStatsRecorder(db, ScopeResolver(db, args.topic_stats_scopes)) if args.topic_stats else None
+        backfill_topic_summaries(db, stats=stats)
+    client.close()
+    if args.backfill_summaries:
+        return
+
+    if args.workers > 1 or args.pod_count > 1:
+        # Clients are not fork-safe: every worker process opens its own
+        run_supervisor(args)
+    else:
+        run_worker(args, metrics_port=args.metrics_port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Work Waiter
+Blocks a queue worker until new work is likely to be available.
+Uses a MongoDB change stream on the queue collection when the deployment supports it
+(replica set / sharded cluster) and falls back to exponential-backoff polling otherwise.
+"""
+
+import time
+import logging
+from typing import Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Server-side wait of one change stream getMore. Short, so draining a burst of events ends
+# quickly; wait() keeps issuing getMores until its own deadline.
+STREAM_AWAIT_SECONDS = 0.25
+
+
+class WorkWaiter:
+    def __init__(self, collection, status: int, min_interval: float = 0.05,
+                 max_interval: float = 10.0, use_change_stream: bool = True):
+        """
+        Wait for documents of `collection` to enter `status`.
+        max_interval bounds every wait, so workers still poll as a safety net
+        (e.g. for events missed while the stream was being reopened).
+        """
+        self.collection = collection
+        self.status = status
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.current_interval = min_interval
+        self.stream = None
+        self.use_change_stream = use_change_stream
+
+        if use_change_stream:
+            self._open_stream()
+
+    def _open_stream(self):
+        """Open the change stream, disabling it for good if the server does not support one"""
+        pipeline = [{
+            "$match": {
+                "$or": [
+                    {"operationType": {"$in": ["insert", "replace"]}, "fullDocument.status": self.status},
+                    {"operationType": "update", "updateDescription.updatedFields.status": self.status}
+                ]
+            }
+        }]
+        try:
+            await_seconds = min(self.max_interval, STREAM_AWAIT_SECONDS)
+            self.stream = self.collection.watch(pipeline, max_await_time_ms=max(int(await_seconds * 1000), 1))
+            logger.info(f"Watching {self.collection.name} for status {self.status} via change stream")
+        except OperationFailure as e:
+            # Standalone servers have no oplog to watch
+            logger.info(f"Change streams unavailable on {self.collection.name} ({e}); using adaptive polling")
+            self.stream = None
+            self.use_change_stream = False
+
+    @property
+    def mode(self) -> str:
+        return "change-stream" if self.stream is not None else "polling"
+
+    def reset(self):
+        """Work was found - poll tightly again"""
+        self.current_interval = self.min_interval
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until new work is signalled or the wait times out.
+        Returns True if a change event signalled new work. All events already delivered
+        are consumed, so a burst of N inserts wakes the worker once, not N times.
+        """
+        timeout = self.max_interval if timeout is None else timeout
+
+        if self.stream is not None:
+            deadline = time.monotonic() + timeout
+            try:
+                while time.monotonic() < deadline:
+                    if self.stream.try_next() is not None:
+                        # Drain the rest of the burst; the worker's claim loop picks all of it up
+                        while time.monotonic() < deadline and self.stream.try_next() is not None:
+                            pass
+                        return True
+                return False
+            except PyMongoError as e:
+                # Reopen on the next wait; the timed-out poll covers anything missed meanwhile
+                logger.warning(f"Change stream on {self.collection.name} failed: {e}")
+                self.close()
+                self._open_stream()
+                return False
+
+        # Exponential backoff: idle workers converge to max_interval, busy ones stay at min_interval
+        time.sleep(min(self.current_interval, timeout))
+        self.current_interval = min(self.current_interval * 2, self.max_interval)
+        return False
+
+    def close(self):
+        """Close the change stream if open"""
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except PyMongoError:
+                pass
+            self.stream = None